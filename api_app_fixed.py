@@ -3,15 +3,20 @@ from flask import Flask, request, jsonify, send_from_directory
 import os
 import shutil
 from werkzeug.utils import secure_filename
-import subprocess
 import hashlib
 import jwt
 import datetime
-import sqlite3
 import datetime as dt
 import threading
 import time
 
+import db
+import invoice_store
+from exports import new_job_id, render_export
+from extraction_service import ExtractionTimeout, get_service
+from report_writers import WRITERS, parse_formats
+from upload_buffer import UploadBuffer
+
 UPLOAD_FOLDER = 'uploads'
 EXTRACTED_FOLDER = 'extracted_data'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
@@ -21,62 +26,12 @@ app = Flask(__name__)
 CORS(app)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Global lock to prevent multiple OCR processes
-ocr_lock = threading.Lock()
+# One extraction service per server process; documents queue on its workers
+extraction_service = get_service()
 
 def get_db():
-    conn = sqlite3.connect("users.db")
-    conn.execute(
-        "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT)"
-    )
-    conn.execute(
-        "CREATE TABLE IF NOT EXISTS uploads (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, original_filename TEXT, excel_filename TEXT, word_filename TEXT, invoice_type TEXT, upload_time TEXT)"
-    )
-    
-    # Ensure all profile columns exist
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN email TEXT")
-    except:
-        pass
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN full_name TEXT")
-    except:
-        pass
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN phone TEXT")
-    except:
-        pass
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN company TEXT")
-    except:
-        pass
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN address TEXT")
-    except:
-        pass
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN city TEXT")
-    except:
-        pass
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN state TEXT")
-    except:
-        pass
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN country TEXT")
-    except:
-        pass
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN zip TEXT")
-    except:
-        pass
-    try:
-        conn.execute("ALTER TABLE users ADD COLUMN bio TEXT")
-    except:
-        pass
-    
-    conn.commit()
-    return conn
+    # Pooled connection to the migrated database; close() returns it to the pool
+    return db.connect()
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -95,13 +50,6 @@ def verify_token(token):
     except Exception:
         return None
 
-def init_uploads_table():
-    conn = sqlite3.connect("users.db")
-    conn.execute(
-        "CREATE TABLE IF NOT EXISTS uploads (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, original_filename TEXT, excel_filename TEXT, word_filename TEXT, invoice_type TEXT, upload_time TEXT)"
-    )
-    conn.close()
-
 def cleanup_old_files():
     """Clean up old extracted files to prevent clutter"""
     try:
@@ -117,32 +65,29 @@ def cleanup_old_files():
     except Exception as e:
         print(f"Cleanup error: {e}")
 
-def safe_run_ocr():
-    """Safely run OCR with proper locking and error handling"""
-    with ocr_lock:
-        try:
-            print("Starting OCR process...")
-            # Clean up old files first
-            cleanup_old_files()
-            
-            # Run the fixed OCR script
-            result = subprocess.run(
-                ['python', 'ocr_to_word_excel_fixed.py'], 
-                check=True, 
-                capture_output=True, 
-                text=True,
-                timeout=300  # 5 minute timeout
-            )
-            print("OCR completed successfully")
-            return True, None
-        except subprocess.TimeoutExpired:
-            return False, "OCR process timed out"
-        except subprocess.CalledProcessError as e:
-            return False, f"OCR failed: {e.stderr}"
-        except Exception as e:
-            return False, f"OCR error: {str(e)}"
+def safe_run_ocr(upload, job_id):
+    """Run extraction on the persistent in-process service; returns (result or None, error message)"""
+    try:
+        print("Starting OCR...")
+        # Clean up old files first
+        cleanup_old_files()
+        
+        # The model stays loaded between uploads; only inference runs per request
+        result = extraction_service.process_invoice(
+            upload.source,
+            {'filename': upload.filename, 'job_id': job_id, 'formats': []},
+        )
+        if not result:
+            return None, "OCR processing failed"
+        print("OCR completed successfully")
+        return result, None
+    except ExtractionTimeout as e:
+        return None, str(e)
+    except Exception as e:
+        return None, f"OCR error: {str(e)}"
 
-init_uploads_table()
+# One-time schema migration at startup (versioned; see db.py)
+db.migrate()
 
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -205,59 +150,42 @@ def upload_invoice():
             base_name, ext = os.path.splitext(safe_filename)
             unique_filename = f"{base_name}_{timestamp}{ext}"
             
-            # Save uploaded file
-            upload_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(upload_path)
-            
-            # Prepare invoice processing
-            invoices_dir = 'invoices'
-            if not os.path.exists(invoices_dir):
-                os.makedirs(invoices_dir)
-            
-            # Use unique filename for invoice processing
-            invoice_path = os.path.join(invoices_dir, f'invoice_{timestamp}.pdf')
-            shutil.copy(upload_path, invoice_path)
-            
-            # Update the OCR script to use the correct file
-            update_ocr_script_path(invoice_path)
-            
             # Run extraction script with proper locking
             invoice_type = request.form.get('invoice_type', 'printed')
-            print(f"Processing invoice: {unique_filename} (type: {invoice_type})")
+            formats = parse_formats(request.form.get('formats'))
+            job_id = new_job_id(safe_filename)
+            print(f"Processing invoice: {unique_filename} (type: {invoice_type}, formats: {','.join(formats)})")
             
-            success, error_msg = safe_run_ocr()
-            if not success:
+            # Buffer the upload for this job (in memory unless large) instead of saving and copying it
+            with UploadBuffer.from_stream(file.stream, unique_filename) as upload:
+                result, error_msg = safe_run_ocr(upload, job_id)
+            if not result:
+                conn = get_db()
+                db.record_upload(conn, username, unique_filename, None, None, invoice_type, status='failed')
+                conn.commit()
+                conn.close()
                 return jsonify({'error': f'Extraction failed: {error_msg}'}), 500
             
-            # Find the generated files
-            files = os.listdir(EXTRACTED_FOLDER)
-            excel_files = [f for f in files if f.endswith('.xlsx')]
-            word_files = [f for f in files if f.endswith('.docx')]
-            
-            # Get the most recent files
-            excel_file = max(excel_files, key=lambda x: os.path.getctime(os.path.join(EXTRACTED_FOLDER, x))) if excel_files else None
-            word_file = max(word_files, key=lambda x: os.path.getctime(os.path.join(EXTRACTED_FOLDER, x))) if word_files else None
+            # Exports are rendered from the stored result when first downloaded
+            excel_file = f"{job_id}.xlsx" if 'xlsx' in formats else None
+            word_file = f"{job_id}.docx" if 'docx' in formats else None
+            outputs = {fmt: f"/api/download/{job_id}{WRITERS[fmt].extension}" for fmt in formats if fmt in WRITERS}
             
-            # Save to database
+            # Save to database: the upload and its extracted invoices in one transaction
             conn = get_db()
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO uploads (username, original_filename, excel_filename, word_filename, invoice_type, upload_time) VALUES (?, ?, ?, ?, ?, ?)",
-                (username, unique_filename, excel_file, word_file, invoice_type, dt.datetime.now().isoformat())
-            )
+            upload_id = db.record_upload(conn, username, unique_filename, excel_file, word_file, invoice_type,
+                                         job_id=job_id)
+            stored = invoice_store.store_result(conn, upload_id, username, result)
             conn.commit()
             conn.close()
             
-            # Clean up temporary files
-            try:
-                os.remove(upload_path)
-                os.remove(invoice_path)
-            except:
-                pass
-            
             return jsonify({
                 'excel_url': f'/api/download/{excel_file}' if excel_file else None,
                 'word_url': f'/api/download/{word_file}' if word_file else None,
+                'outputs': outputs,
+                'invoice_ids': stored['invoice_ids'],
+                'duplicate': bool(stored['duplicates']['document'] or stored['duplicates']['invoices']),
+                'duplicates': stored['duplicates'],
                 'message': 'Invoice processed successfully'
             })
             
@@ -267,31 +195,15 @@ def upload_invoice():
     else:
         return jsonify({'error': 'Invalid file type'}), 400
 
-def update_ocr_script_path(new_path):
-    """Update the OCR script to use the correct invoice path"""
-    try:
-        # Read the current OCR script
-        with open('ocr_to_word_excel_fixed.py', 'r') as f:
-            content = f.read()
-        
-        # Update the PDF path
-        updated_content = content.replace(
-            'PDF_PATH = "invoices/your_invoice.pdf"',
-            f'PDF_PATH = "{new_path}"'
-        )
-        
-        # Write back the updated script
-        with open('ocr_to_word_excel_fixed.py', 'w') as f:
-            f.write(updated_content)
-            
-    except Exception as e:
-        print(f"Error updating OCR script: {e}")
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @app.route('/api/download/<filename>')
 def download_file(filename):
+    # Export of a stored job (rendered on first request); older uploads have files in EXTRACTED_FOLDER
+    export_path = render_export(filename)
+    if export_path:
+        return send_from_directory(os.path.dirname(export_path), filename, as_attachment=True)
     return send_from_directory(EXTRACTED_FOLDER, filename, as_attachment=True)
 
 @app.route('/api/history', methods=['GET'])
@@ -303,26 +215,100 @@ def history():
     username = verify_token(token)
     if not username:
         return jsonify({'error': 'Invalid or expired token'}), 401
+    # Keyset-paginated: ?limit=&cursor=<next_cursor>, optional ?from=&to= (ISO dates) and ?status= (completed|failed|all)
+    status = request.args.get('status', 'completed')
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, original_filename, excel_filename, word_filename, invoice_type, upload_time FROM uploads WHERE username = ? ORDER BY upload_time DESC",
-        (username,)
-    )
-    rows = cur.fetchall()
-    conn.close()
-    history = [
-        {
-            "id": row[0],
-            "original_filename": row[1],
-            "excel_filename": row[2],
-            "word_filename": row[3],
-            "invoice_type": row[4],
-            "upload_time": row[5],
-        }
-        for row in rows
-    ]
-    return jsonify({"history": history})
+    try:
+        history, next_cursor = db.upload_history(
+            conn, username,
+            limit=request.args.get('limit'),
+            cursor=request.args.get('cursor'),
+            date_from=request.args.get('from'),
+            date_to=request.args.get('to'),
+            status=None if status == 'all' else status,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({"history": history, "next_cursor": next_cursor})
+
+@app.route('/api/invoices', methods=['GET'])
+def invoices():
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'error': 'Missing or invalid token'}), 401
+    token = auth_header.split(' ')[1]
+    username = verify_token(token)
+    if not username:
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    # Filters: ?seller_trn=&buyer_trn=&invoice_number=&company=&from=&to=&min_total=&max_total=&upload_id=
+    # Sorting and paging: ?sort=(-)date|total|vat|invoice_number|seller_trn|id&limit=&cursor=<next_cursor>
+    args = request.args
+    filters = {name: args.get(name) for name in invoice_store.INVOICE_FILTERS if name in args}
+    filters['date_from'], filters['date_to'] = args.get('from'), args.get('to')
+    conn = get_db()
+    try:
+        rows, next_cursor = invoice_store.query_invoices(
+            conn, username, filters,
+            sort=args.get('sort', '-date'),
+            limit=args.get('limit'),
+            cursor=args.get('cursor'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({"invoices": rows, "next_cursor": next_cursor})
+
+@app.route('/api/search', methods=['GET'])
+def search():
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'error': 'Missing or invalid token'}), 401
+    token = auth_header.split(' ')[1]
+    username = verify_token(token)
+    if not username:
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    # Full-text search of OCR page text: ?q=<words, word* for prefixes>&limit=&offset=<next_offset>
+    conn = get_db()
+    try:
+        results, next_offset = invoice_store.search_pages(
+            conn, username, request.args.get('q', ''),
+            limit=request.args.get('limit'),
+            offset=request.args.get('offset'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({"results": results, "next_offset": next_offset})
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return jsonify({'error': 'Missing or invalid token'}), 401
+    token = auth_header.split(' ')[1]
+    username = verify_token(token)
+    if not username:
+        return jsonify({'error': 'Invalid or expired token'}), 401
+    # Pre-aggregated totals: ?group=seller,month|seller|month|none, optional ?seller_trn=&from=&to= (YYYY-MM)
+    group = request.args.get('group', 'seller,month')
+    conn = get_db()
+    try:
+        groups, totals = invoice_store.invoice_stats(
+            conn, username,
+            group_by=None if group == 'none' else group,
+            seller_trn=request.args.get('seller_trn'),
+            month_from=request.args.get('from'),
+            month_to=request.args.get('to'),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
+    return jsonify({"stats": groups, "totals": totals})
 
 @app.route('/api/profile', methods=['GET'])
 def get_profile():
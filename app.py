@@ -4,6 +4,9 @@ import shutil
 from werkzeug.utils import secure_filename
 import subprocess
 
+from exports import new_job_id, render_export
+from upload_buffer import UploadBuffer
+
 UPLOAD_FOLDER = 'uploads'
 EXTRACTED_FOLDER = 'extracted_data'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
@@ -56,34 +59,20 @@ def upload_file():
             return redirect(request.url)
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            upload_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(upload_path)
-            # Move uploaded file to invoices/your_invoice.<ext>
-            invoices_dir = 'invoices'
-            if not os.path.exists(invoices_dir):
-                os.makedirs(invoices_dir)
-            _, ext = os.path.splitext(filename)
-            ext = ext.lower()
-            dest_name = 'your_invoice' + (ext if ext in ['.pdf', '.png', '.jpg', '.jpeg'] else '.pdf')
-            dest_path = os.path.join(invoices_dir, dest_name)
-            shutil.copy(upload_path, dest_path)
-            # Run extraction in-process using the fixed OCR pipeline
+            # Run extraction in-process on the buffered upload (in memory unless large)
+            job_id = new_job_id(filename)
             try:
                 from ocr_to_word_excel_fixed import process_invoice
-                ok = process_invoice(dest_path)
+                with UploadBuffer.from_stream(file.stream, filename) as upload:
+                    ok = process_invoice(upload.source, formats=[], job_id=job_id, filename=upload.filename)
                 if not ok:
                     raise RuntimeError('OCR extraction failed')
             except Exception as e:
                 flash(f'Error during extraction: {e}')
                 return render_template_string(TEMPLATE, excel_file=None, word_file=None)
-            # Find latest Excel and Word files
-            files = os.listdir(EXTRACTED_FOLDER)
-            excel_files = [f for f in files if f.endswith('.xlsx')]
-            word_files = [f for f in files if f.endswith('.docx')]
-            if excel_files:
-                excel_file = max(excel_files, key=lambda x: os.path.getctime(os.path.join(EXTRACTED_FOLDER, x)))
-            if word_files:
-                word_file = max(word_files, key=lambda x: os.path.getctime(os.path.join(EXTRACTED_FOLDER, x)))
+            # Excel and Word files are rendered when the links are followed
+            excel_file = f"{job_id}.xlsx"
+            word_file = f"{job_id}.docx"
             flash('Extraction complete! Download your files below.')
         else:
             flash('Invalid file type. Please upload a PDF or image (PNG/JPG/JPEG).')
@@ -91,6 +80,9 @@ def upload_file():
 
 @app.route('/download/<filename>')
 def download_file(filename):
+    export_path = render_export(filename)
+    if export_path:
+        return send_from_directory(os.path.dirname(export_path), filename, as_attachment=True)
     return send_from_directory(EXTRACTED_FOLDER, filename, as_attachment=True)
 
 if __name__ == '__main__':
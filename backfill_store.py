@@ -0,0 +1,139 @@
+"""
+Load uploads made before the invoice store into the ``invoices`` table and
+the full-text page index.
+
+Uploads recorded before invoice_store existed have a stored job result
+(exports.save_result) but no ``invoices`` rows, so /api/invoices,
+/api/search and /api/stats do not see them. This script replays
+invoice_store.store_result for each such upload, oldest first so duplicates
+point to the first occurrence:
+
+    python backfill_store.py
+    python backfill_store.py --db users.db --cache ocr_cache --jobs jobs
+
+The job id comes from ``uploads.job_id`` or, for older rows, from the export
+names saved with the upload (``<job_id>.xlsx``). Page texts and the content
+hash come from the OCR cache entry whose source is the upload's file name,
+as recorded or as secure_filename() turned it into the cached source name.
+Only a name with exactly one cache entry is trusted: the cache is keyed by
+content, so several entries under one name are different files and any of
+them could be the wrong one. Without a single entry the invoices are stored
+but the pages are not indexed and no content hash is recorded. Uploads that
+already have invoices or indexed pages are skipped, so the script can be
+run again safely.
+"""
+
+import argparse
+import glob
+import os
+
+from werkzeug.utils import secure_filename
+
+import config
+import db
+import invoice_store
+from exports import load_result, parse_export_name
+from ocr_to_word_excel_fixed import OCR_CACHE_FOLDER, load_ocr_export, page_texts_from_export
+
+
+def cached_sources(cache_folder: str) -> dict:
+    """Source file name -> OCR cache paths with that source."""
+    sources = {}
+    for path in sorted(glob.glob(os.path.join(cache_folder, '*.json.gz'))):
+        try:
+            sources.setdefault(load_ocr_export(path).get('source'), []).append(path)
+        except Exception as e:
+            print(f"Error reading OCR cache entry {path}: {e}")
+    return sources
+
+
+def cache_entry(sources: dict, filename: str | None) -> str | None:
+    """The one cache entry of an upload's file name, or None when there is none or more than one."""
+    if not filename:
+        return None
+    paths = set()
+    for name in {filename, secure_filename(filename)}:
+        paths.update(sources.get(name, []))
+    return paths.pop() if len(paths) == 1 else None
+
+
+def upload_job_id(job_id: str | None, *export_names: str | None) -> str | None:
+    """The upload's job id, or the one in the name of an export saved with it."""
+    if job_id:
+        return job_id
+    for name in export_names:
+        parsed = parse_export_name(os.path.basename(name)) if name else None
+        if parsed:
+            return parsed[0]
+    return None
+
+
+def pending_uploads(conn) -> list[tuple]:
+    """Completed uploads with neither invoices nor indexed pages, oldest first."""
+    indexed = "AND NOT EXISTS (SELECT 1 FROM page_search p WHERE p.upload_id = u.id) " \
+        if db.has_table(conn, 'page_search') else ""
+    return conn.execute(
+        "SELECT u.id, u.username, u.original_filename, u.job_id, u.excel_filename, u.word_filename FROM uploads u "
+        "WHERE u.status = 'completed' AND NOT EXISTS (SELECT 1 FROM invoices i WHERE i.upload_id = u.id) "
+        f"{indexed}ORDER BY u.id"
+    ).fetchall()
+
+
+def backfill_upload(conn, upload: tuple, sources: dict, jobs_folder: str) -> dict | None:
+    """Store one upload's job result (not committed); None when its result is not on disk."""
+    upload_id, username, filename, job_id, excel_file, word_file = upload
+    job_id = upload_job_id(job_id, excel_file, word_file)
+    record = load_result(job_id, jobs_folder) if job_id else None
+    if record is None:
+        return None
+    result = {'job_id': job_id, 'rows': record.get('rows', []), 'page_texts': [], 'content_hash': None}
+    cache_path = cache_entry(sources, filename)
+    if cache_path:
+        cached = load_ocr_export(cache_path)
+        result['page_texts'] = page_texts_from_export(cached['export'])
+        result['content_hash'] = cached.get('sha256')
+    conn.execute("UPDATE uploads SET job_id = ? WHERE id = ?", (job_id, upload_id))
+    return invoice_store.store_result(conn, upload_id, username, result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Store invoices and page texts of uploads made before the invoice store")
+    parser.add_argument('--db', default=config.DATABASE_FILE, help="SQLite database")
+    parser.add_argument('--jobs', default=config.JOBS_FOLDER, help="folder containing job results")
+    parser.add_argument('--cache', default=OCR_CACHE_FOLDER, help="folder containing cached OCR exports")
+    args = parser.parse_args()
+
+    db.migrate(args.db)
+    conn = db.connect(args.db)
+    try:
+        uploads = pending_uploads(conn)
+        if not uploads:
+            print("No uploads to backfill")
+            return
+        sources = cached_sources(args.cache)
+        print(f"Backfilling {len(uploads)} uploads...")
+        done = missing = failed = 0
+        for upload in uploads:
+            try:
+                stored = backfill_upload(conn, upload, sources, args.jobs)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                failed += 1
+                print(f"✗ Upload {upload[0]} ({upload[2]}): {e}")
+                continue
+            if stored is None:
+                missing += 1
+                print(f"- Upload {upload[0]} ({upload[2]}): no stored job result")
+            else:
+                done += 1
+                print(f"✓ Upload {upload[0]} ({upload[2]}): {len(stored['invoice_ids'])} invoices, "
+                      f"{stored['pages_indexed']} pages")
+    finally:
+        conn.close()
+
+    print(f"\nBackfill complete! {done} uploads stored, {missing} without a job result, {failed} failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -77,7 +77,58 @@ COMPANY_NAME_EXCLUDE_WORDS = [
 EXCEL_SHEET_NAME = 'Invoice Data'
 WORD_TITLE = 'Invoice Data Extraction Report'
 WORD_TABLE_STYLE = 'Table Grid'
+WORD_TABLE_SPLIT_ROWS = 0  # Start a new table on a new page every N rows in Word reports (0 = one table)
+OUTPUT_FORMATS = ['xlsx', 'docx']  # Default outputs; also available: parquet, csv, jsonl
+JOBS_FOLDER = "jobs"  # One sharded folder per processed document: stored rows/items plus outputs written up front
+EXPORT_CACHE_FOLDER = "export_cache"  # Exports rendered on demand by the download endpoints
+EXPORT_CACHE_TTL = 3600  # Seconds a rendered export is served from the cache before it is rebuilt
 
 # Processing Settings
+UPLOAD_MEMORY_LIMIT = 20 * 1024 * 1024  # Uploads larger than this (bytes) are buffered in a private temp file
 BATCH_SIZE = 10  # Process invoices in batches
-SAVE_INTERMEDIATE = True  # Save progress after each batch 
\ No newline at end of file
+SAVE_INTERMEDIATE = True  # Save progress after each batch 
+
+# Extraction Rules (patterns, keyword lists, thresholds)
+RULES_FILE = "extraction_rules.json"
+RULES_RELOAD_INTERVAL = 2.0  # Seconds between checks of the rules file for changes
+
+# Vendor Layout Templates (learned per seller TRN)
+VENDOR_TEMPLATES_FILE = "vendor_templates.json"
+TEMPLATE_MARGIN = 0.015  # Slack (normalized page units) around a learned field region
+
+# Vendor Master Index (canonical supplier names)
+VENDOR_MASTER_FILE = "vendors.csv"  # Columns: trn,name,aliases (aliases separated by |)
+VENDOR_MATCH_THRESHOLD = 0.6  # Minimum trigram similarity for a fuzzy company-name match
+VENDOR_AUTO_REGISTER = False  # Append the first name seen for an unknown labelled seller TRN to VENDOR_MASTER_FILE
+
+# Ruled Table Detection (requires opencv-python)
+GRID_TABLES_ENABLED = True
+GRID_MIN_TABLE_WIDTH = 0.3  # Minimum table width as a fraction of the page width
+GRID_MIN_CELLS = 4  # Fewer enclosed cells than this is not treated as a table
+GRID_RECO_BATCH_SIZE = 64  # Cell crops per recognition batch
+GRID_MIN_CONFIDENCE = 0.5  # Cells recognized below this are also read by the full OCR pass
+
+# Regex Safety (custom patterns run over the whole document text)
+REGEX_USE_RE2 = True  # Match custom patterns with the linear-time re2 engine when installed (pip install google-re2)
+REGEX_FIELD_BUDGET = 0.25  # Seconds of pattern matching allowed per field before remaining patterns are skipped
+
+# Master Ledger (append-only Parquet dataset, one partition per month)
+LEDGER_ENABLED = True  # Skipped without pyarrow (pip install pyarrow)
+LEDGER_FOLDER = "ledger"
+
+# Extraction Service (API servers run extraction in-process)
+EXTRACTION_WORKERS = 1  # Worker processes (each holding the OCR model) per server process
+EXTRACTION_TIMEOUT = 300  # Seconds before an upload fails and its worker is killed and restarted
+EXTRACTION_PRELOAD = True  # Start the workers (and load the model) when the server starts
+
+# Database (users, uploads, extracted invoices)
+DATABASE_FILE = "users.db"
+DB_POOL_SIZE = 8  # Idle SQLite connections kept open per server process
+DB_BUSY_TIMEOUT = 5.0  # Seconds to wait for a lock held by another connection
+HISTORY_PAGE_SIZE = 50  # Uploads per /api/history page unless ?limit= is given
+HISTORY_MAX_PAGE_SIZE = 500
+INVOICES_PAGE_SIZE = 50  # Invoices per /api/invoices page unless ?limit= is given
+INVOICES_MAX_PAGE_SIZE = 500
+SEARCH_PAGE_SIZE = 20  # Page hits per /api/search response unless ?limit= is given
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_SNIPPET_TOKENS = 12  # Words of context in each search snippet
@@ -0,0 +1,447 @@
+"""
+SQLite access shared by the API servers.
+
+The schema is brought up to date once per process by migrate(): migrations
+are numbered, the applied version is kept in ``PRAGMA user_version``, and the
+pending ones run inside one ``BEGIN IMMEDIATE`` transaction so concurrent
+server processes do not apply them twice. Requests then borrow connections
+from a small pool (connect()); each is opened once with WAL journaling and
+the pragmas below, so a request costs only its own statements, which
+sqlite3 also keeps prepared per connection.
+
+    conn = connect()
+    try:
+        conn.execute(...)
+        conn.commit()
+    finally:
+        conn.close()  # returns the connection to the pool
+"""
+
+import base64
+import json
+import queue
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+
+import config
+
+# Applied to every pooled connection
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+)
+
+PROFILE_COLUMNS = ['email', 'full_name', 'phone', 'company', 'address', 'city', 'state', 'country', 'zip', 'bio']
+
+
+def table_columns(conn, table: str) -> set[str]:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def has_table(conn, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone() is not None
+
+
+def add_missing_columns(conn, table: str, columns: list[str], column_type: str = 'TEXT'):
+    """ALTER TABLE ADD COLUMN for columns not present yet (older databases gained some ad hoc)."""
+    existing = table_columns(conn, table)
+    for column in columns:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+
+def migration_1(conn):
+    """Users and uploads tables."""
+    conn.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT)")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS uploads (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, original_filename TEXT, "
+        "excel_filename TEXT, word_filename TEXT, invoice_type TEXT, upload_time TEXT)"
+    )
+
+
+def migration_2(conn):
+    """Profile columns on users."""
+    add_missing_columns(conn, 'users', PROFILE_COLUMNS)
+
+
+def migration_3(conn):
+    """Upload status and the (username, upload_time) history index."""
+    if 'status' not in table_columns(conn, 'uploads'):
+        conn.execute("ALTER TABLE uploads ADD COLUMN status TEXT NOT NULL DEFAULT 'completed'")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_user_time ON uploads (username, upload_time, id)")
+
+
+def migration_4(conn):
+    """Typed invoices table linked to uploads, indexed on TRN, invoice number, date and total."""
+    add_missing_columns(conn, 'uploads', ['job_id'])
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS invoices (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "upload_id INTEGER NOT NULL REFERENCES uploads (id) ON DELETE CASCADE, username TEXT NOT NULL, "
+        "job_id TEXT, pages TEXT, company_name TEXT, invoice_number TEXT, invoice_date TEXT, date_text TEXT, "
+        "seller_trn TEXT, buyer_trn TEXT, vat_amount REAL, total_amount REAL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_upload ON invoices (upload_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_seller ON invoices (username, seller_trn, invoice_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_buyer ON invoices (username, buyer_trn, invoice_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices (username, invoice_number)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (username, invoice_date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_total ON invoices (username, total_amount)")
+
+
+def migration_5(conn):
+    """Full-text index of OCR page text (FTS5)."""
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS page_search USING fts5(body, username UNINDEXED, "
+            "upload_id UNINDEXED, invoice_id UNINDEXED, page UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+        )
+    except sqlite3.OperationalError as e:
+        print(f"Warning: full-text search unavailable, SQLite lacks FTS5 ({e})")
+
+
+def migration_6(conn):
+    """Duplicate detection: upload content hashes and invoice duplicate keys, both indexed."""
+    add_missing_columns(conn, 'uploads', ['content_hash'])
+    add_missing_columns(conn, 'invoices', ['duplicate_key'])
+    add_missing_columns(conn, 'invoices', ['duplicate_of'], 'INTEGER')
+    # Same key as invoice_store.duplicate_key, for invoices stored before this migration
+    conn.execute(
+        "UPDATE invoices SET duplicate_key = upper(replace(replace(seller_trn, ' ', ''), '-', '')) || '|' || "
+        "invoice_number || '|' || printf('%.2f', total_amount) "
+        "WHERE seller_trn IS NOT NULL AND invoice_number IS NOT NULL AND total_amount IS NOT NULL"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_uploads_content_hash ON uploads (username, content_hash)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_duplicate_key ON invoices (username, duplicate_key)")
+
+
+def migration_7(conn):
+    """Per user, seller TRN and invoice month totals, kept current by triggers on invoices."""
+    # '' stands for an unknown seller or month; duplicates (duplicate_of set) are not counted
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS invoice_totals (username TEXT NOT NULL, seller_trn TEXT NOT NULL, "
+        "month TEXT NOT NULL, invoices INTEGER NOT NULL DEFAULT 0, total_amount REAL NOT NULL DEFAULT 0, "
+        "vat_amount REAL NOT NULL DEFAULT 0, PRIMARY KEY (username, seller_trn, month)) WITHOUT ROWID"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS invoices_totals_insert AFTER INSERT ON invoices WHEN NEW.duplicate_of IS NULL "
+        "BEGIN "
+        "INSERT INTO invoice_totals (username, seller_trn, month, invoices, total_amount, vat_amount) "
+        "VALUES (NEW.username, coalesce(NEW.seller_trn, ''), coalesce(substr(NEW.invoice_date, 1, 7), ''), 1, "
+        "coalesce(NEW.total_amount, 0), coalesce(NEW.vat_amount, 0)) "
+        "ON CONFLICT (username, seller_trn, month) DO UPDATE SET invoices = invoices + 1, "
+        "total_amount = total_amount + excluded.total_amount, vat_amount = vat_amount + excluded.vat_amount; "
+        "END"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS invoices_totals_delete AFTER DELETE ON invoices WHEN OLD.duplicate_of IS NULL "
+        "BEGIN "
+        "UPDATE invoice_totals SET invoices = invoices - 1, total_amount = total_amount - coalesce(OLD.total_amount, 0), "
+        "vat_amount = vat_amount - coalesce(OLD.vat_amount, 0) WHERE username = OLD.username "
+        "AND seller_trn = coalesce(OLD.seller_trn, '') AND month = coalesce(substr(OLD.invoice_date, 1, 7), ''); "
+        "DELETE FROM invoice_totals WHERE username = OLD.username AND seller_trn = coalesce(OLD.seller_trn, '') "
+        "AND month = coalesce(substr(OLD.invoice_date, 1, 7), '') AND invoices <= 0; "
+        "END"
+    )
+    # Totals of invoices stored before this migration
+    rebuild_invoice_totals(conn)
+
+
+def migration_8(conn):
+    """Promote the oldest copy of a deleted invoice so duplicate_of never points at a missing row."""
+    # The copies re-point to the oldest of them, which becomes the original (duplicate_of NULL)
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS invoices_promote_duplicate AFTER DELETE ON invoices WHEN OLD.duplicate_of IS NULL "
+        "BEGIN "
+        "UPDATE invoices SET duplicate_of = (SELECT min(id) FROM invoices WHERE duplicate_of = OLD.id) "
+        "WHERE duplicate_of = OLD.id AND id > (SELECT min(id) FROM invoices WHERE duplicate_of = OLD.id); "
+        "UPDATE invoices SET duplicate_of = NULL WHERE duplicate_of = OLD.id; "
+        "END"
+    )
+    # A promoted copy now counts towards the totals (and a demoted invoice no longer does)
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS invoices_totals_promote AFTER UPDATE OF duplicate_of ON invoices "
+        "WHEN OLD.duplicate_of IS NOT NULL AND NEW.duplicate_of IS NULL "
+        "BEGIN "
+        "INSERT INTO invoice_totals (username, seller_trn, month, invoices, total_amount, vat_amount) "
+        "VALUES (NEW.username, coalesce(NEW.seller_trn, ''), coalesce(substr(NEW.invoice_date, 1, 7), ''), 1, "
+        "coalesce(NEW.total_amount, 0), coalesce(NEW.vat_amount, 0)) "
+        "ON CONFLICT (username, seller_trn, month) DO UPDATE SET invoices = invoices + 1, "
+        "total_amount = total_amount + excluded.total_amount, vat_amount = vat_amount + excluded.vat_amount; "
+        "END"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS invoices_totals_demote AFTER UPDATE OF duplicate_of ON invoices "
+        "WHEN OLD.duplicate_of IS NULL AND NEW.duplicate_of IS NOT NULL "
+        "BEGIN "
+        "UPDATE invoice_totals SET invoices = invoices - 1, total_amount = total_amount - coalesce(OLD.total_amount, 0), "
+        "vat_amount = vat_amount - coalesce(OLD.vat_amount, 0) WHERE username = OLD.username "
+        "AND seller_trn = coalesce(OLD.seller_trn, '') AND month = coalesce(substr(OLD.invoice_date, 1, 7), ''); "
+        "DELETE FROM invoice_totals WHERE username = OLD.username AND seller_trn = coalesce(OLD.seller_trn, '') "
+        "AND month = coalesce(substr(OLD.invoice_date, 1, 7), '') AND invoices <= 0; "
+        "END"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_duplicate_of ON invoices (duplicate_of)")
+    # Copies whose original was deleted before this migration
+    dangling = conn.execute(
+        "SELECT DISTINCT duplicate_of FROM invoices WHERE duplicate_of IS NOT NULL "
+        "AND duplicate_of NOT IN (SELECT id FROM invoices)"
+    ).fetchall()
+    for (original,) in dangling:
+        first = conn.execute("SELECT min(id) FROM invoices WHERE duplicate_of = ?", (original,)).fetchone()[0]
+        conn.execute("UPDATE invoices SET duplicate_of = ? WHERE duplicate_of = ? AND id > ?", (first, original, first))
+        conn.execute("UPDATE invoices SET duplicate_of = NULL WHERE id = ?", (first,))
+    rebuild_invoice_totals(conn)
+
+
+def migration_9(conn):
+    """Index the owner of each page in page_search, so a search only visits the user's own pages."""
+    if not has_table(conn, 'page_search'):
+        create_page_search(conn)
+        return
+    conn.execute("ALTER TABLE page_search RENAME TO page_search_old")
+    create_page_search(conn)
+    conn.execute(
+        "INSERT INTO page_search (body, owner, username, upload_id, invoice_id, page) "
+        "SELECT body, 'u' || hex(username), username, upload_id, invoice_id, page FROM page_search_old"
+    )
+    conn.execute("DROP TABLE page_search_old")
+
+
+def migration_10(conn):
+    """End each invoices sort index with id, so keyset pages of /api/invoices are read in index order."""
+    for name in ('idx_invoices_seller', 'idx_invoices_buyer', 'idx_invoices_number', 'idx_invoices_date',
+                 'idx_invoices_total'):
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.execute("CREATE INDEX idx_invoices_user ON invoices (username, id)")
+    conn.execute("CREATE INDEX idx_invoices_seller ON invoices (username, seller_trn, invoice_date, id)")
+    conn.execute("CREATE INDEX idx_invoices_seller_id ON invoices (username, seller_trn, id)")
+    conn.execute("CREATE INDEX idx_invoices_buyer ON invoices (username, buyer_trn, invoice_date, id)")
+    conn.execute("CREATE INDEX idx_invoices_number ON invoices (username, invoice_number, id)")
+    conn.execute("CREATE INDEX idx_invoices_date ON invoices (username, invoice_date, id)")
+    conn.execute("CREATE INDEX idx_invoices_total ON invoices (username, total_amount, id)")
+    conn.execute("CREATE INDEX idx_invoices_vat ON invoices (username, vat_amount, id)")
+
+
+def create_page_search(conn) -> bool:
+    """Create the FTS5 page index; False (with a warning) when SQLite lacks FTS5.
+
+    ``owner`` holds the username as one token ('u' + hex of its UTF-8 bytes,
+    see invoice_store.owner_token) so a MATCH on it narrows the search to
+    the user's pages inside the index.
+    """
+    try:
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS page_search USING fts5(body, owner, username UNINDEXED, "
+            "upload_id UNINDEXED, invoice_id UNINDEXED, page UNINDEXED, tokenize='unicode61 remove_diacritics 2')"
+        )
+        return True
+    except sqlite3.OperationalError as e:
+        print(f"Warning: full-text search unavailable, SQLite lacks FTS5 ({e})")
+        return False
+
+
+def rebuild_invoice_totals(conn):
+    """Recompute invoice_totals from the invoices table."""
+    conn.execute("DELETE FROM invoice_totals")
+    conn.execute(
+        "INSERT INTO invoice_totals (username, seller_trn, month, invoices, total_amount, vat_amount) "
+        "SELECT username, coalesce(seller_trn, ''), coalesce(substr(invoice_date, 1, 7), ''), count(*), "
+        "coalesce(sum(total_amount), 0), coalesce(sum(vat_amount), 0) FROM invoices WHERE duplicate_of IS NULL "
+        "GROUP BY 1, 2, 3"
+    )
+
+
+# Schema version -> migration; append new ones, never edit applied ones
+MIGRATIONS = {
+    1: migration_1,
+    2: migration_2,
+    3: migration_3,
+    4: migration_4,
+    5: migration_5,
+    6: migration_6,
+    7: migration_7,
+    8: migration_8,
+    9: migration_9,
+    10: migration_10,
+}
+
+# Database path -> schema version, for databases already migrated by this process
+_migrated = {}
+_migrate_lock = threading.Lock()
+
+
+def open_connection(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=config.DB_BUSY_TIMEOUT, check_same_thread=False)
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def migrate(path: str = config.DATABASE_FILE) -> int:
+    """Apply pending migrations (once per process and database); returns the schema version."""
+    with _migrate_lock:
+        if path in _migrated:
+            return _migrated[path]
+        conn = open_connection(path)
+        try:
+            conn.isolation_level = None
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                for number in sorted(MIGRATIONS):
+                    if number > version:
+                        MIGRATIONS[number](conn)
+                        version = number
+                        print(f"Applied database migration {number}: {MIGRATIONS[number].__doc__}")
+                # Created later once SQLite has FTS5 if migration 9 ran without it
+                if version >= 9 and not has_table(conn, 'page_search'):
+                    create_page_search(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        _migrated[path] = version
+        return version
+
+
+class ConnectionPool:
+    """Reusable connections to one database; at most ``size`` are kept idle."""
+
+    def __init__(self, path: str, size: int = config.DB_POOL_SIZE):
+        self.path = path
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return open_connection(self.path)
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+
+class PooledConnection:
+    """sqlite3.Connection stand-in whose close() hands the connection back to its pool."""
+
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+        self._conn = pool.acquire()
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self._conn.commit()
+        self.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def connect(path: str = config.DATABASE_FILE) -> PooledConnection:
+    """Borrow a connection to a migrated database; close() returns it to the pool."""
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                migrate(path)
+                pool = _pools[path] = ConnectionPool(path)
+    return PooledConnection(pool)
+
+
+UPLOAD_STATUSES = ('completed', 'failed')
+HISTORY_FIELDS = ['id', 'original_filename', 'excel_filename', 'word_filename', 'invoice_type', 'upload_time', 'status']
+
+
+def record_upload(conn, username: str, original_filename: str, excel_filename: str | None, word_filename: str | None,
+                  invoice_type: str, status: str = 'completed', job_id: str | None = None) -> int:
+    """Insert an uploads row (not committed); returns its id."""
+    cur = conn.execute(
+        "INSERT INTO uploads (username, original_filename, excel_filename, word_filename, invoice_type, upload_time, "
+        "status, job_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (username, original_filename, excel_filename, word_filename, invoice_type, datetime.now().isoformat(), status,
+         job_id)
+    )
+    return cur.lastrowid
+
+
+def encode_cursor(upload_time: str, upload_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([upload_time, upload_id]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    """Inverse of encode_cursor; raises ValueError on anything else."""
+    try:
+        upload_time, upload_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return str(upload_time), int(upload_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def time_bound(value: str, end: bool = False) -> str:
+    """ISO date or timestamp filter -> upload_time bound; a plain end date includes that whole day."""
+    if len(value) == 10:
+        day = date.fromisoformat(value)
+        return (day + timedelta(days=1) if end else day).isoformat()
+    return datetime.fromisoformat(value).isoformat()
+
+
+def upload_history(conn, username: str, limit: int | str | None = None, cursor: str | None = None,
+                   date_from: str | None = None, date_to: str | None = None,
+                   status: str | None = 'completed') -> tuple[list[dict], str | None]:
+    """One page of a user's uploads, newest first; returns (rows, cursor of the next page or None).
+
+    Keyset pagination on (upload_time, id) walks the idx_uploads_user_time
+    index, so every page costs the same however deep it is. ``status=None``
+    includes every status. Raises ValueError for a malformed cursor or date.
+    """
+    limit = config.HISTORY_PAGE_SIZE if limit is None else max(1, min(int(limit), config.HISTORY_MAX_PAGE_SIZE))
+    where, params = ["username = ?"], [username]
+    if status:
+        if status not in UPLOAD_STATUSES:
+            raise ValueError(f"Unknown status: {status}")
+        where.append("status = ?")
+        params.append(status)
+    if date_from:
+        where.append("upload_time >= ?")
+        params.append(time_bound(date_from))
+    if date_to:
+        bound = time_bound(date_to, end=True)
+        where.append("upload_time < ?" if len(date_to) == 10 else "upload_time <= ?")
+        params.append(bound)
+    if cursor:
+        where.append("(upload_time, id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+    rows = conn.execute(
+        f"SELECT {', '.join(HISTORY_FIELDS)} FROM uploads WHERE {' AND '.join(where)} "
+        "ORDER BY upload_time DESC, id DESC LIMIT ?",
+        params + [limit + 1]
+    ).fetchall()
+    page = [dict(zip(HISTORY_FIELDS, row)) for row in rows[:limit]]
+    next_cursor = encode_cursor(page[-1]['upload_time'], page[-1]['id']) if len(rows) > limit else None
+    return page, next_cursor
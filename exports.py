@@ -0,0 +1,177 @@
+"""
+Per-job result storage and lazy export rendering.
+
+Each processed document is a job with its own folder, sharded by a hash of
+the job id so no single directory grows with the archive:
+
+    jobs/3f/<job_id>/result.json.gz    extracted rows and line items
+    jobs/3f/<job_id>/<job_id>.xlsx     outputs written up front, if any
+
+render_export() turns a download name such as ``<job_id>.xlsx`` into a file:
+an output already in the job folder is served as is; otherwise the format is
+rendered from the stored result on first request, cached in
+config.EXPORT_CACHE_FOLDER and served from there until it is older than
+config.EXPORT_CACHE_TTL seconds (or the stored result was rewritten). Expired
+exports are swept periodically and rebuilt on the next request.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+import config
+from report_writers import ITEM_TABLE_COLUMNS, REPORT_FORMATS, WRITERS, write_outputs
+
+# <job_id>.<ext>, or <job_id>_items.<ext> for the columnar items file
+EXPORT_NAME_PATTERN = re.compile(r'^(\w[\w-]*?)(_items)?\.(\w+)$')
+# Seconds between sweeps of expired exports
+PURGE_INTERVAL = 60
+
+_render_lock = threading.Lock()
+_last_purge = float('-inf')
+
+
+def new_job_id(filename: str) -> str:
+    """Unique, filesystem-safe id for the job processing one file."""
+    stem = re.sub(r'[^\w-]', '_', os.path.splitext(os.path.basename(filename))[0]) or 'invoice'
+    return f"{stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(4)}"
+
+
+def job_dir(job_id: str, folder: str = config.JOBS_FOLDER) -> str:
+    """Folder of one job: ``<folder>/<2 hex chars of sha1(job_id)>/<job_id>``."""
+    shard = hashlib.sha1(job_id.encode('utf-8')).hexdigest()[:2]
+    return os.path.join(folder, shard, job_id)
+
+
+def result_path(job_id: str, folder: str = config.JOBS_FOLDER) -> str:
+    return os.path.join(job_dir(job_id, folder), 'result.json.gz')
+
+
+def save_result(job_id: str, rows: list[dict], items=None, folder: str = config.JOBS_FOLDER):
+    """Store extraction rows (and the line-item DataFrame) in the job folder."""
+    os.makedirs(job_dir(job_id, folder), exist_ok=True)
+    record = {
+        'job_id': job_id,
+        'created': datetime.now().isoformat(),
+        'rows': rows,
+        'items': items.to_dict('records') if items is not None else [],
+    }
+    path = result_path(job_id, folder)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(record, f, default=str)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_result(job_id: str, folder: str = config.JOBS_FOLDER) -> dict | None:
+    path = result_path(job_id, folder)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def export_formats() -> list[str]:
+    return list(REPORT_FORMATS) + list(WRITERS)
+
+
+def parse_export_name(filename: str) -> tuple[str, str, bool] | None:
+    """Split a download name into (job_id, format, is_items_file); None if it is not an export name."""
+    m = EXPORT_NAME_PATTERN.match(filename)
+    if not m:
+        return None
+    job_id, items_suffix, fmt = m.group(1), m.group(2), m.group(3).lower()
+    if fmt not in export_formats():
+        return None
+    if items_suffix and (fmt not in WRITERS or os.path.exists(result_path(job_id + items_suffix))):
+        # Either not a columnar items file, or a result whose id itself ends in _items
+        job_id, items_suffix = job_id + items_suffix, None
+    return job_id, fmt, bool(items_suffix)
+
+
+def is_fresh(path: str, source: str, ttl: float) -> bool:
+    if not os.path.exists(path):
+        return False
+    mtime = os.path.getmtime(path)
+    return time.time() - mtime < ttl and mtime >= os.path.getmtime(source)
+
+
+def render_to(folder: str, record: dict, job_id: str, fmt: str) -> dict:
+    """Write one format of a stored result into ``folder``."""
+    items = pd.DataFrame(record.get('items') or [], columns=ITEM_TABLE_COLUMNS)
+    return write_outputs(record['rows'], items, [fmt], job_id, folder)
+
+
+def render_export(filename: str, cache_folder: str = config.EXPORT_CACHE_FOLDER,
+                  ttl: float = config.EXPORT_CACHE_TTL) -> str | None:
+    """Path of the export for a download name, rendering it if missing or expired.
+
+    Returns None when the name does not refer to a stored job, or the result
+    has no rows to render.
+    """
+    parsed = parse_export_name(filename)
+    if parsed is None:
+        return None
+    job_id, fmt, _ = parsed
+    written = os.path.join(job_dir(job_id), filename)
+    if os.path.exists(written):
+        return written
+    source = result_path(job_id)
+    if not os.path.exists(source):
+        return None
+    path = os.path.join(cache_folder, filename)
+    if is_fresh(path, source, ttl):
+        return path
+    with _render_lock:
+        if is_fresh(path, source, ttl):
+            return path
+        record = load_result(job_id)
+        if record is None:
+            return None
+        os.makedirs(cache_folder, exist_ok=True)
+        # Render into a private folder and move into place, so readers never see partial files
+        work = tempfile.mkdtemp(dir=cache_folder, prefix='.render-')
+        try:
+            if not render_to(work, record, job_id, fmt):
+                return None
+            for name in os.listdir(work):
+                os.replace(os.path.join(work, name), os.path.join(cache_folder, name))
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+    purge_expired_exports(cache_folder, ttl)
+    return path if os.path.exists(path) else None
+
+
+def purge_expired_exports(cache_folder: str = config.EXPORT_CACHE_FOLDER, ttl: float = config.EXPORT_CACHE_TTL,
+                          force: bool = False) -> int:
+    """Delete cached exports older than ``ttl``; runs at most every PURGE_INTERVAL seconds unless forced."""
+    global _last_purge
+    now = time.monotonic()
+    if not force and now - _last_purge < PURGE_INTERVAL:
+        return 0
+    _last_purge = now
+    removed = 0
+    try:
+        entries = list(os.scandir(cache_folder))
+    except FileNotFoundError:
+        return 0
+    cutoff = time.time() - ttl
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError as e:
+            print(f"Error removing expired export {entry.name}: {e}")
+    return removed
@@ -0,0 +1,163 @@
+"""
+Hot-reloadable extraction rules (patterns, keyword lists, thresholds).
+
+Rules are read from the versioned JSON file named by config.RULES_FILE and
+compiled once into a RuleSet. get_rules() re-checks the file's mtime at most
+every config.RULES_RELOAD_INTERVAL seconds; when it changed, a new RuleSet is
+built and swapped in with a single reference assignment, so callers that hold
+a RuleSet for the duration of a document keep a consistent view while new
+documents pick up the new rules. A file that fails to load is reported and the
+previous rules stay active.
+"""
+
+import copy
+import json
+import os
+import re
+import threading
+import time
+
+import config
+from regex_guard import guard_patterns
+
+DEFAULT_RULES = {
+    'version': 0,
+    # Patterns used by the layout/text pipeline in ocr_to_word_excel_fixed.py
+    'patterns': {
+        'invoice_number': [r'[A-Z]{2,4}/\d{4,}/?\d{0,6}|[A-Z]{2,4}/\d{6,}'],
+        'date': [r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}[/-]\d{1,2}[/-]\d{1,2}|\d{1,2}-[A-Za-z]{3}-\d{4})'],
+        'trn': [r'(?i)TRN\s*:?\s*(\d{9,15})'],
+        # "Page 2 of 3" / "Page 2/3" markers used to split multi-invoice files
+        'page_of': [r'(?i)\bPAGE\s*(\d{1,3})\s*(?:OF|/)\s*(\d{1,3})\b'],
+    },
+    # Case-insensitive patterns tried first by InvoiceDataExtractor
+    'custom_patterns': config.CUSTOM_PATTERNS,
+    'keywords': {
+        'company': [
+            "LLC", "L.L.C", "TRADING", "GARMENTS", "COMPANY", "COLLECTIONS", "TEXTILES",
+            "CORPORATION", "EST", "SUPPLIERS", "INDUSTRIAL", "UNIFORMS", "AREA"
+        ],
+        'company_exclude': [
+            "INVOICE", "DATE", "TOTAL", "AMOUNT", "VAT", "TRN", "BILL", "NUMBER", "QUANTITY", "ADDRESS"
+        ],
+        'invoice_number_label': ['INVOICE NO'],
+        'date_label': ['DATED', 'DATE'],
+        'subtotal': ['SUBTOTAL', 'SUB-TOTAL', 'AMOUNT BEFORE TAX', 'BEFORE VAT'],
+        'layout_total': ['GRAND TOTAL', 'TOTAL AMOUNT', 'AMOUNT PAYABLE', 'NET PAYABLE', 'INVOICE TOTAL'],
+        'layout_total_exclude': ['QTY', 'QUANTITY', 'PCS'],
+        'vat_exclude': ['TRN', 'REG', 'REGISTRATION', 'INCLUSIVE'],
+        'vat_total_hint': ['GRAND TOTAL', 'TOTAL AMOUNT', 'AMOUNT PAYABLE', 'INVOICE TOTAL'],
+        'final_total': [
+            'GRAND TOTAL', 'NET PAYABLE', 'NET AMOUNT', 'AMOUNT PAYABLE', 'TOTAL AMOUNT',
+            'AMOUNT DUE', 'BALANCE DUE', 'INVOICE TOTAL', 'FINAL TOTAL', 'TOTAL PAYABLE'
+        ],
+        'intermediate': ['SUBTOTAL', 'SUB-TOTAL', 'BEFORE VAT', 'BEFORE TAX', 'EXCLUDING VAT'],
+        'quantity': ['QTY', 'QUANTITY', 'PCS', 'PIECES', 'ITEMS', 'TOTAL QTY', 'TOTAL PCS'],
+        'currency': ['AED', 'DHS', 'DIRHAM'],
+        # Line-item table headers and the summary terms that end the table
+        'item_quantity_header': ['QTY', 'QUANTITY'],
+        'item_description_header': ['DESCRIPTION', 'PARTICULARS', 'ITEM'],
+        'item_rate_header': ['RATE', 'PRICE'],
+        'item_amount_header': ['AMOUNT', 'VALUE'],
+        'item_table_end': ['TOTAL', 'VAT', 'NET AMOUNT', 'AMOUNT PAYABLE'],
+    },
+    'thresholds': {
+        # VAT above this fraction of the total is treated as implausible
+        'vat_to_total_ratio': 0.3,
+        # Plain (non currency-marked) numbers at or below this are not totals
+        'min_plain_total': 10,
+        'company_search_lines': 30,
+        'invoice_number_search_lines': 15,
+    },
+}
+
+
+class RuleSet:
+    """One compiled, immutable-by-convention version of the extraction rules."""
+
+    def __init__(self, data: dict, source: str | None = None, mtime: float | None = None):
+        self.data = data
+        self.source = source
+        self.mtime = mtime
+        self.version = data.get('version', 0)
+        self.keywords = data['keywords']
+        self.thresholds = data['thresholds']
+        # Backtracking-prone patterns are rewritten or dropped (see regex_guard)
+        self.patterns = {
+            name: guard_patterns(patterns)
+            for name, patterns in data['patterns'].items()
+        }
+        self.custom_patterns = {
+            name: guard_patterns(patterns, re.IGNORECASE, linear=True)
+            for name, patterns in data['custom_patterns'].items()
+        }
+        # Regex alternation of currency markers, e.g. (?:AED|DHS|DIRHAM)
+        self.currency = '(?:' + '|'.join(re.escape(c) for c in self.keywords['currency']) + ')'
+
+    @property
+    def anchor_terms(self) -> list[str]:
+        """Terms the page token index should resolve up front."""
+        k = self.keywords
+        return list(dict.fromkeys(k['subtotal'] + k['layout_total'] + ['TOTAL', 'VAT', 'AMOUNT']))
+
+
+def merge_rules(base: dict, override: dict) -> dict:
+    """Overlay a (possibly partial) rules document onto the defaults, section by section."""
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key].update(value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_rules(path: str = config.RULES_FILE) -> RuleSet:
+    """Read and compile a rules file; raises on invalid JSON or patterns."""
+    if not os.path.exists(path):
+        return RuleSet(copy.deepcopy(DEFAULT_RULES))
+    mtime = os.path.getmtime(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return RuleSet(merge_rules(DEFAULT_RULES, data), source=path, mtime=mtime)
+
+
+_rules = None
+_rules_lock = threading.Lock()
+_last_check = float('-inf')
+# mtime of the last file version we attempted to load (successfully or not)
+_seen_mtime = None
+
+
+def get_rules() -> RuleSet:
+    """Return the active RuleSet, reloading it if the rules file changed."""
+    global _rules, _last_check, _seen_mtime
+    now = time.monotonic()
+    if _rules is not None and now - _last_check < config.RULES_RELOAD_INTERVAL:
+        return _rules
+    with _rules_lock:
+        if _rules is not None and now - _last_check < config.RULES_RELOAD_INTERVAL:
+            return _rules
+        _last_check = now
+        try:
+            mtime = os.path.getmtime(config.RULES_FILE) if os.path.exists(config.RULES_FILE) else None
+        except OSError:
+            mtime = None
+        if _rules is None or mtime != _seen_mtime:
+            _seen_mtime = mtime
+            try:
+                new_rules = load_rules(config.RULES_FILE)
+                _rules = new_rules
+                print(f"Loaded extraction rules v{_rules.version}")
+            except Exception as e:
+                print(f"Error loading extraction rules from {config.RULES_FILE}: {e}")
+                if _rules is None:
+                    _rules = RuleSet(copy.deepcopy(DEFAULT_RULES))
+    return _rules
+
+
+def reload_rules() -> RuleSet:
+    """Force the next get_rules() call to re-check the rules file."""
+    global _last_check
+    _last_check = float('-inf')
+    return get_rules()
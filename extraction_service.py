@@ -0,0 +1,170 @@
+"""
+Long-lived extraction service with supervised worker processes.
+
+The API servers used to run ``python ocr_to_word_excel_fixed.py`` per upload,
+paying for interpreter start-up, the torch import and model loading on every
+request. The service instead keeps config.EXTRACTION_WORKERS worker processes
+alive as long as the server: each loads the OCR model once (at start-up when
+config.EXTRACTION_PRELOAD is set) and then processes one document at a time
+sent to it over a pipe, so a request only pays for inference and extraction.
+
+A document that does not finish within its timeout gets its worker killed
+and replaced, as the per-upload subprocess used to be, so a hung job neither
+blocks the uploads queued behind it nor writes results for an upload already
+recorded as failed. Workers are started with the ``spawn`` method: the server
+process is multithreaded and must not be forked.
+
+    service = get_service()
+    result = service.process_invoice(upload_bytes, {'filename': 'inv.pdf', 'formats': []})
+
+``options`` keys: ``filename``, ``job_id``, ``formats`` (as for
+ocr_to_word_excel_fixed.process_invoice) and ``timeout`` in seconds
+(default config.EXTRACTION_TIMEOUT), counted from the call including any
+wait for a free worker. The result is process_invoice's result dict, or None
+on failure. A path ``source`` must stay in place until the call returns.
+"""
+
+import multiprocessing
+import queue
+import threading
+import time
+
+import config
+
+# Process name of the workers; set before a spawned worker re-imports the server's main module
+WORKER_NAME = 'extraction-worker'
+
+
+class ExtractionTimeout(Exception):
+    """The document did not finish within the request's timeout (its worker was restarted)."""
+
+
+def worker_main(conn, preload: bool):
+    """Worker process loop: receive (source, options), reply ('ok', result) or ('error', message)."""
+    import ocr_to_word_excel_fixed as pipeline
+    if preload:
+        try:
+            pipeline.get_model()
+        except Exception as e:
+            print(f"Error preloading OCR model: {e}")
+    while True:
+        try:
+            source, options = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            result = pipeline.process_invoice(
+                source,
+                formats=options.get('formats'),
+                job_id=options.get('job_id'),
+                filename=options.get('filename'),
+            )
+            conn.send(('ok', result))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+
+class ExtractionWorker:
+    """One worker process and the pipe to it; restarted when a job overruns or the process dies."""
+
+    def __init__(self, context, preload: bool = config.EXTRACTION_PRELOAD):
+        self.context = context
+        self.preload = preload
+        self.process = None
+        self.conn = None
+
+    def start(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=worker_main, args=(child_conn, self.preload), name=WORKER_NAME, daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        return self
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+            self.process = self.conn = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def run(self, source, options: dict, timeout: float) -> dict | None:
+        if not self.alive():
+            self.restart()
+        self.conn.send((source, options))
+        if not self.conn.poll(timeout):
+            print(f"Extraction timed out after {timeout:.0f}s; restarting worker")
+            self.restart()
+            raise ExtractionTimeout("OCR process timed out")
+        try:
+            status, payload = self.conn.recv()
+        except (EOFError, OSError):
+            print("Extraction worker exited unexpectedly; restarting it")
+            self.restart()
+            return None
+        if status == 'error':
+            print(f"Error processing invoice: {payload}")
+            return None
+        return payload
+
+
+class ExtractionService:
+    def __init__(self, workers: int = config.EXTRACTION_WORKERS):
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [ExtractionWorker(self.context) for _ in range(max(1, workers))]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes (each loads the model) so the first upload does not wait for them."""
+        with self._start_lock:
+            for worker in self.workers:
+                if not worker.alive():
+                    worker.start()
+        return self
+
+    def process_invoice(self, source, options: dict | None = None) -> dict | None:
+        """Process a document (path or bytes) on a free worker; raises ExtractionTimeout after ``options['timeout']``."""
+        options = options or {}
+        timeout = options.get('timeout', config.EXTRACTION_TIMEOUT)
+        deadline = time.monotonic() + timeout
+        try:
+            worker = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise ExtractionTimeout("No extraction worker became free in time")
+        try:
+            request = {key: options.get(key) for key in ('filename', 'job_id', 'formats')}
+            return worker.run(source, request, max(0.0, deadline - time.monotonic()))
+        finally:
+            self.idle.put(worker)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service() -> ExtractionService:
+    """The process-wide service, created (and its workers started) on first use."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = ExtractionService()
+                # Workers import the server's main module again; only the server itself starts workers
+                if config.EXTRACTION_PRELOAD and multiprocessing.current_process().name != WORKER_NAME:
+                    _service.start()
+    return _service
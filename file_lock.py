@@ -0,0 +1,43 @@
+"""
+Inter-process lock for files shared by several worker processes.
+
+The lock is held on a sidecar ``<path>.lock`` file (fcntl on Unix, msvcrt on
+Windows), so the data file itself can still be replaced atomically while
+other processes wait:
+
+    with locked(path):
+        data = read(path)
+        ...
+        os.replace(tmp_path, path)
+"""
+
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    import msvcrt
+    HAS_FCNTL = False
+
+
+@contextmanager
+def locked(path: str):
+    """Hold the exclusive lock for ``path`` (blocks until it is free)."""
+    fd = os.open(path + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if HAS_FCNTL:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if HAS_FCNTL:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+    finally:
+        os.close(fd)
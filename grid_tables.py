@@ -0,0 +1,201 @@
+"""
+Ruled (grid-line) table detection with cell-level recognition.
+
+Tables drawn with ruling lines are found with OpenCV morphology: long
+horizontal and vertical strokes are isolated, the enclosed regions of the
+grid become cells, and the cell crops are sent straight to the recognition
+model in batches. The table area is then blanked on the page image so the
+full OCR pass does not detect and recognize those words a second time. The
+recognized cells are merged back into the doctr export as a block of lines
+(one word per cell) plus a ``grid_tables`` entry holding the cell structure.
+A cell with several lines of text is recognized line by line, and a cell
+recognized with low confidence is also left to the full pass.
+"""
+
+import numpy as np
+
+import config
+
+# Try to import OpenCV for grid detection
+try:
+    import cv2
+    HAS_CV2 = True
+except ImportError:
+    HAS_CV2 = False
+
+
+def to_gray(image: np.ndarray) -> np.ndarray:
+    """uint8 grayscale copy of a doctr page image."""
+    if image.dtype != np.uint8:
+        image = (image * 255).astype(np.uint8) if image.max() <= 1.0 else image.astype(np.uint8)
+    return cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if image.ndim == 3 else image
+
+
+def group_cells(cells: list[tuple]) -> list[list[tuple]]:
+    """Group cell boxes into rows by top edge; rows top to bottom, cells left to right."""
+    if not cells:
+        return []
+    cells = sorted(cells, key=lambda c: (c[1], c[0]))
+    tol = max(np.median([c[3] - c[1] for c in cells]) / 2.0, 2)
+    rows = [[cells[0]]]
+    for cell in cells[1:]:
+        if abs(cell[1] - rows[-1][0][1]) <= tol:
+            rows[-1].append(cell)
+        else:
+            rows.append([cell])
+    return [sorted(row, key=lambda c: c[0]) for row in rows]
+
+
+def detect_grid_tables(image: np.ndarray) -> list[dict]:
+    """Find ruled tables on a page image.
+
+    Returns ``[{'bbox': (x0, y0, x1, y1), 'rows': [[cell_box, ...], ...]}]`` in pixels.
+    """
+    gray = to_gray(image)
+    height, width = gray.shape
+    binary = cv2.adaptiveThreshold(cv2.bitwise_not(gray), 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, 15, -2)
+    # Keep only strokes much longer than a character in each direction
+    horizontal = cv2.morphologyEx(
+        binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 30, 10), 1)))
+    vertical = cv2.morphologyEx(
+        binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(height // 30, 10))))
+    grid = cv2.dilate(cv2.bitwise_or(horizontal, vertical), np.ones((3, 3), np.uint8))
+
+    tables = []
+    contours, _ = cv2.findContours(grid, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < width * config.GRID_MIN_TABLE_WIDTH or h < height * 0.02:
+            continue
+        region = grid[y:y + h, x:x + w]
+        # Connected non-line areas inside the grid are the cells
+        count, _, stats, _ = cv2.connectedComponentsWithStats(cv2.bitwise_not(region), connectivity=4)
+        cells = []
+        for i in range(1, count):
+            cx, cy, cw, ch, _ = stats[i]
+            if cw < 8 or ch < 8:
+                continue
+            # Areas touching the region border lie outside the table frame
+            if cx == 0 or cy == 0 or cx + cw >= w or cy + ch >= h:
+                continue
+            cells.append((x + cx, y + cy, x + cx + cw, y + cy + ch))
+        if len(cells) < config.GRID_MIN_CELLS:
+            continue
+        tables.append({'bbox': (x, y, x + w, y + h), 'rows': group_cells(cells)})
+    return tables
+
+
+def text_line_bands(gray: np.ndarray, min_height: int = 4) -> list[tuple[int, int]]:
+    """Vertical extents (top, bottom) of the text lines in a cell crop, found from rows containing ink."""
+    ink = np.flatnonzero((gray < 128).any(axis=1))
+    if ink.size == 0:
+        return []
+    # Split where at least two blank pixel rows separate the ink
+    breaks = np.flatnonzero(np.diff(ink) > 2)
+    starts = np.concatenate(([ink[0]], ink[breaks + 1]))
+    ends = np.concatenate((ink[breaks], [ink[-1]])) + 1
+    return [(int(a), int(b)) for a, b in zip(starts, ends) if b - a >= min_height]
+
+
+def recognize_cells(reco_predictor, image: np.ndarray, boxes: list[tuple]) -> list[tuple[str, float]]:
+    """Recognize cell crops in batches; blank cells are skipped and return ``('', 1.0)``.
+
+    The recognizer reads one line of text, so a cell holding several lines
+    (a wrapped description) is cut into one crop per line; the lines are
+    joined with spaces and the cell gets the lowest of their confidences.
+    """
+    gray = to_gray(image)
+    results = [('', 1.0)] * len(boxes)
+    crops, crop_idx = [], []
+    for i, (x0, y0, x1, y1) in enumerate(boxes):
+        # Trim a couple of pixels so leftover ruling does not reach the recognizer
+        x0, y0, x1, y1 = x0 + 2, y0 + 2, x1 - 2, y1 - 2
+        if x1 <= x0 or y1 <= y0:
+            continue
+        if gray[y0:y1, x0:x1].min() > 200:
+            continue
+        bands = text_line_bands(gray[y0:y1, x0:x1])
+        if len(bands) <= 1:
+            crops.append(image[y0:y1, x0:x1])
+            crop_idx.append(i)
+            continue
+        for top, bottom in bands:
+            crops.append(image[max(y0, y0 + top - 2):min(y1, y0 + bottom + 2), x0:x1])
+            crop_idx.append(i)
+    batch_size = config.GRID_RECO_BATCH_SIZE
+    lines = {}
+    for start in range(0, len(crops), batch_size):
+        predictions = reco_predictor(crops[start:start + batch_size])
+        for i, (value, confidence) in zip(crop_idx[start:start + batch_size], predictions):
+            lines.setdefault(i, []).append((value, float(confidence)))
+    for i, parts in lines.items():
+        results[i] = (' '.join(v for v, _ in parts if v), min(c for _, c in parts))
+    return results
+
+
+def is_confident(cell: dict) -> bool:
+    """Whether a recognized cell is kept instead of being left to the full OCR pass."""
+    return cell['confidence'] >= config.GRID_MIN_CONFIDENCE
+
+
+def recognize_grid_tables(model, pages: list[np.ndarray]) -> tuple[list[np.ndarray], list[list[dict]]]:
+    """Detect and recognize ruled tables on every page.
+
+    Returns the pages with table areas blanked (ready for the full OCR pass) and,
+    per page, the tables with normalized geometry. Cells recognized below
+    config.GRID_MIN_CONFIDENCE are left on the page, so the full pass reads
+    them as well and its words stand in for them in the page text:
+    ``{'bbox': [[x0, y0], [x1, y1]], 'rows': [[{'value', 'confidence', 'geometry'}, ...], ...]}``.
+    """
+    masked_pages, page_tables = [], []
+    for image in pages:
+        height, width = image.shape[:2]
+        tables = detect_grid_tables(image)
+        if not tables:
+            masked_pages.append(image)
+            page_tables.append([])
+            continue
+        boxes = [cell for table in tables for row in table['rows'] for cell in row]
+        texts = iter(recognize_cells(model.reco_predictor, image, boxes))
+        masked = image.copy()
+        normalized = []
+        for table in tables:
+            x0, y0, x1, y1 = table['bbox']
+            masked[y0:y1, x0:x1] = 255
+            rows = []
+            for row in table['rows']:
+                cells = []
+                for cx0, cy0, cx1, cy1 in row:
+                    value, confidence = next(texts)
+                    cell = {
+                        'value': value,
+                        'confidence': confidence,
+                        'geometry': [[cx0 / width, cy0 / height], [cx1 / width, cy1 / height]],
+                    }
+                    if not is_confident(cell):
+                        masked[cy0:cy1, cx0:cx1] = image[cy0:cy1, cx0:cx1]
+                    cells.append(cell)
+                rows.append(cells)
+            normalized.append({'bbox': [[x0 / width, y0 / height], [x1 / width, y1 / height]], 'rows': rows})
+        masked_pages.append(masked)
+        page_tables.append(normalized)
+    return masked_pages, page_tables
+
+
+def merge_grid_tables(export_data: dict, page_tables: list[list[dict]]):
+    """Add recognized table cells to a doctr export, in reading order by vertical position."""
+    for page, tables in zip(export_data.get('pages', []), page_tables):
+        if not tables:
+            continue
+        page['grid_tables'] = tables
+        blocks = page.setdefault('blocks', [])
+        for table in tables:
+            lines = [
+                {'geometry': [row[0]['geometry'][0], row[-1]['geometry'][1]],
+                 'words': [cell for cell in row if cell['value'] and is_confident(cell)]}
+                for row in table['rows']
+            ]
+            block = {'geometry': table['bbox'], 'lines': [line for line in lines if line['words']]}
+            top = table['bbox'][0][1]
+            at = next((i for i, b in enumerate(blocks) if b.get('geometry', [[0, 0]])[0][1] > top), len(blocks))
+            blocks.insert(at, block)
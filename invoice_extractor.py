@@ -12,6 +12,11 @@ from docx.shared import Inches
 import warnings
 warnings.filterwarnings('ignore')
 
+from extraction_rules import get_rules
+from regex_guard import guard_pattern, guard_patterns, search_first
+from report_writers import StreamingExcelWriter, add_bulk_table
+from vendor_index import get_vendor_index, is_labelled_trn
+
 # Try to import PyPDF2 for text-based PDFs
 try:
     import PyPDF2
@@ -171,18 +176,26 @@ class InvoiceDataExtractor:
         
         return "Not Found"
     
-    def extract_field(self, text_data: List[Dict], field_patterns: List[str]) -> str:
+    def field_patterns(self, field: str) -> List[re.Pattern]:
+        """
+        Compiled patterns for a field: custom patterns from the active rules file first,
+        then this extractor's own patterns not already covered by them
+        """
+        rules = get_rules()
+        custom = rules.custom_patterns.get(field, [])
+        seen = set(rules.data['custom_patterns'].get(field, []))
+        own = guard_patterns([p for p in self.patterns.get(field, []) if p not in seen], re.IGNORECASE, linear=True)
+        return custom + own
+    
+    def extract_field(self, text_data: List[Dict], field_patterns: List) -> str:
         """
         Extract specific field using regex patterns
         """
         full_text = ' '.join([item['text'] for item in text_data])
         
-        for pattern in field_patterns:
-            matches = re.findall(pattern, full_text, re.IGNORECASE)
-            if matches:
-                return matches[0] if isinstance(matches[0], str) else ' '.join(matches[0])
-        
-        return "Not Found"
+        compiled = [p if not isinstance(p, str) else guard_pattern(p, re.IGNORECASE, True) for p in field_patterns]
+        match = search_first([p for p in compiled if p is not None], full_text)
+        return match if match is not None else "Not Found"
     
     def extract_invoice_data(self, pdf_path: str) -> Dict:
         """
@@ -197,16 +210,20 @@ class InvoiceDataExtractor:
             return {"error": "No text extracted from PDF"}
         
         # Extract all fields
+        seller_trn = self.extract_field(text_data, self.field_patterns('trn'))
+        full_text = ' '.join(item['text'] for item in text_data)
+        vendor_trn = seller_trn if is_labelled_trn(full_text, seller_trn) else None
+        company_name = get_vendor_index().canonical_name(self.find_company_name(text_data), vendor_trn)
         extracted_data = {
             'file_name': os.path.basename(pdf_path),
-            'company_name': self.find_company_name(text_data),
-            'invoice_number': self.extract_field(text_data, self.patterns['invoice_number']),
-            'date': self.extract_field(text_data, self.patterns['date']),
-            'seller_trn': self.extract_field(text_data, self.patterns['trn']),
-            'buyer_trn': self.extract_field(text_data, self.patterns['trn']),  # May need refinement
-            'total_quantity_meters': self.extract_field(text_data, self.patterns['quantity']),
-            'total_amount': self.extract_field(text_data, self.patterns['amount']),
-            'vat_amount': self.extract_field(text_data, self.patterns['vat_amount']),
+            'company_name': company_name,
+            'invoice_number': self.extract_field(text_data, self.field_patterns('invoice_number')),
+            'date': self.extract_field(text_data, self.field_patterns('date')),
+            'seller_trn': seller_trn,
+            'buyer_trn': self.extract_field(text_data, self.field_patterns('trn')),  # May need refinement
+            'total_quantity_meters': self.extract_field(text_data, self.field_patterns('quantity')),
+            'total_amount': self.extract_field(text_data, self.field_patterns('amount')),
+            'vat_amount': self.extract_field(text_data, self.field_patterns('vat_amount')),
             'extraction_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
         
@@ -217,36 +234,33 @@ class InvoiceDataExtractor:
         Save extracted data to Excel file
         """
         try:
-            df = pd.DataFrame(data_list)
+            # Columns in order of first appearance, as a DataFrame would lay them out
+            columns = list(dict.fromkeys(key for data in data_list for key in data))
             
-            # Create Excel writer
-            with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Invoice Data', index=False)
-                
-                # Auto-adjust column widths
-                worksheet = writer.sheets['Invoice Data']
-                for column in worksheet.columns:
-                    max_length = 0
-                    column_letter = column[0].column_letter
-                    for cell in column:
-                        try:
-                            if len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-                    adjusted_width = min(max_length + 2, 50)
-                    worksheet.column_dimensions[column_letter].width = adjusted_width
+            # Streamed write; column widths come from the tracked value lengths
+            with StreamingExcelWriter(output_path, {'Invoice Data': columns}) as writer:
+                writer.extend(data_list)
             
             print(f"Data saved to Excel: {output_path}")
             
         except Exception as e:
             print(f"Error saving to Excel: {e}")
     
-    def save_to_word(self, data_list: List[Dict], output_path: str):
+    def save_to_word(self, data_list, output_path: str, columns: Optional[List[str]] = None,
+                     count: Optional[int] = None):
         """
         Save extracted data to Word document
+
+        ``data_list`` may be any iterable of rows (e.g. StreamingExcelWriter.rows())
+        when ``columns`` and ``count`` are given.
         """
         try:
+            if columns is None:
+                data_list = list(data_list)
+                columns = list(data_list[0].keys())
+            if count is None:
+                count = len(data_list)
+            
             doc = Document()
             
             # Add title
@@ -255,23 +269,11 @@ class InvoiceDataExtractor:
             
             # Add summary
             doc.add_paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-            doc.add_paragraph(f"Total invoices processed: {len(data_list)}")
+            doc.add_paragraph(f"Total invoices processed: {count}")
             doc.add_paragraph("")
             
-            # Add table
-            table = doc.add_table(rows=1, cols=len(data_list[0].keys()))
-            table.style = 'Table Grid'
-            
-            # Add headers
-            header_cells = table.rows[0].cells
-            for i, key in enumerate(data_list[0].keys()):
-                header_cells[i].text = key.replace('_', ' ').title()
-            
-            # Add data rows
-            for data in data_list:
-                row_cells = table.add_row().cells
-                for i, value in enumerate(data.values()):
-                    row_cells[i].text = str(value)
+            # Add table (rows built in bulk)
+            add_bulk_table(doc, columns, data_list, headers=[key.replace('_', ' ').title() for key in columns])
             
             # Save document
             doc.save(output_path)
@@ -294,31 +296,46 @@ class InvoiceDataExtractor:
             print("No PDF files found in the input folder")
             return
         
-        # Process each PDF
-        all_data = []
-        for pdf_file in pdf_files:
-            pdf_path = os.path.join(input_folder, pdf_file)
-            data = self.extract_invoice_data(pdf_path)
+        # Process each PDF, spooling rows for the Excel file as invoices complete;
+        # the Word report reads them back from the spool rather than a second list
+        excel_path = os.path.join(output_folder, f"invoice_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
+        excel_writer = None
+        try:
+            for pdf_file in pdf_files:
+                pdf_path = os.path.join(input_folder, pdf_file)
+                data = self.extract_invoice_data(pdf_path)
+                
+                if 'error' not in data:
+                    if excel_writer is None:
+                        excel_writer = StreamingExcelWriter(excel_path, {'Invoice Data': list(data)})
+                    excel_writer.append(data)
+                    print(f"✓ Processed: {pdf_file}")
+                else:
+                    print(f"✗ Failed: {pdf_file} - {data['error']}")
             
-            if 'error' not in data:
-                all_data.append(data)
-                print(f"✓ Processed: {pdf_file}")
-            else:
-                print(f"✗ Failed: {pdf_file} - {data['error']}")
-        
-        if all_data:
-            # Save to Excel
-            excel_path = os.path.join(output_folder, f"invoice_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-            self.save_to_excel(all_data, excel_path)
+            if excel_writer is None:
+                print("No data extracted from any invoices")
+                return
+            processed = excel_writer.counts[excel_writer.default_sheet]
             
-            # Save to Word
+            # Save to Word first: close() releases the spooled rows
             word_path = os.path.join(output_folder, f"invoice_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx")
-            self.save_to_word(all_data, word_path)
+            self.save_to_word(excel_writer.rows(), word_path, excel_writer.columns[excel_writer.default_sheet],
+                              processed)
+            
+            # Save to Excel
+            try:
+                excel_writer.close()
+                print(f"Data saved to Excel: {excel_path}")
+            except Exception as e:
+                print(f"Error saving to Excel: {e}")
             
-            print(f"\nProcessing complete! {len(all_data)} invoices processed.")
+            print(f"\nProcessing complete! {processed} invoices processed.")
             print(f"Files saved to: {output_folder}")
-        else:
-            print("No data extracted from any invoices")
+        finally:
+            # Remove the spool files if extraction stopped with an exception
+            if excel_writer is not None:
+                excel_writer.discard()
 
 def main():
     """
@@ -0,0 +1,391 @@
+"""
+Queryable store of extracted invoices.
+
+Every invoice row a job extracts is saved as a typed ``invoices`` record
+linked to its ``uploads`` row (schema in db.py): amounts as REAL, dates as
+ISO ``YYYY-MM-DD`` when they can be parsed (the text as printed is kept in
+``date_text``), and "Not Found" as NULL. Indexes on seller TRN, invoice
+number, date and amounts, each led by username and ending with id, serve the
+filters and sorts of query_invoices() without reading any export files.
+
+The OCR text of every page goes into the ``page_search`` FTS5 index (when
+SQLite has FTS5) together with the invoice the page belongs to, so
+search_pages() finds documents by any printed text, such as a PO number or
+product description, without re-running OCR or opening exports. The owner
+is an indexed token of each page, so a search reads only the user's pages.
+
+Duplicates are flagged as they are stored: an upload whose file content hash
+matches an earlier upload, and an invoice whose key (seller TRN, normalized
+invoice number, total) matches an earlier invoice of the same user. Both are
+single lookups on an index, so the check costs the same however large the
+archive grows.
+
+Triggers on ``invoices`` (db.migration_7) keep per user, seller TRN and
+invoice-month totals in ``invoice_totals`` as rows are stored, so
+invoice_stats() reads one row per group instead of summing every invoice.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+import config
+import db
+
+# Day-first formats used on UAE invoices, tried in order
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y', '%d-%m-%y', '%Y-%m-%d', '%Y/%m/%d', '%d-%b-%Y', '%d %b %Y')
+
+INVOICE_FIELDS = [
+    'id', 'upload_id', 'job_id', 'pages', 'company_name', 'invoice_number', 'invoice_date', 'date_text',
+    'seller_trn', 'buyer_trn', 'vat_amount', 'total_amount', 'duplicate_of',
+]
+
+# Query parameter -> (SQL condition, value converter)
+INVOICE_FILTERS = {
+    'seller_trn': ("seller_trn = ?", str),
+    'buyer_trn': ("buyer_trn = ?", str),
+    'invoice_number': ("invoice_number = ?", lambda v: normalize_invoice_number(v)),
+    'company': ("company_name LIKE ? ESCAPE '\\'", lambda v: like_prefix(v)),
+    'date_from': ("invoice_date >= ?", lambda v: parse_date_strict(v)),
+    'date_to': ("invoice_date <= ?", lambda v: parse_date_strict(v)),
+    'min_total': ("total_amount >= ?", float),
+    'max_total': ("total_amount <= ?", float),
+    'upload_id': ("upload_id = ?", int),
+}
+
+# Sort names accepted by query_invoices ("-" prefix for descending)
+INVOICE_SORTS = {
+    'date': 'invoice_date',
+    'total': 'total_amount',
+    'vat': 'vat_amount',
+    'invoice_number': 'invoice_number',
+    'seller_trn': 'seller_trn',
+    'id': 'id',
+}
+
+
+def field_value(value):
+    """Extracted value, or None for missing ones."""
+    if value is None or value == "Not Found" or value == "":
+        return None
+    return value
+
+
+def to_amount(value) -> float | None:
+    value = field_value(value)
+    if value is None:
+        return None
+    try:
+        return float(str(value).replace(',', ''))
+    except ValueError:
+        return None
+
+
+def normalize_date(value) -> str | None:
+    """ISO date for an extracted date string, or None if no known format matches."""
+    value = field_value(value)
+    if value is None:
+        return None
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_date_strict(value: str) -> str:
+    iso = normalize_date(value)
+    if iso is None:
+        raise ValueError(f"Unrecognized date: {value}")
+    return iso
+
+
+def normalize_invoice_number(value) -> str | None:
+    """Upper-case invoice number with whitespace removed, so lookups match however it was typed."""
+    value = field_value(value)
+    return None if value is None else ''.join(str(value).split()).upper()
+
+
+def like_prefix(value: str) -> str:
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"{escaped}%"
+
+
+def invoice_record(row: dict) -> dict:
+    pages = row.get('Pages') or [row.get('Page')]
+    return {
+        'pages': ','.join(str(p) for p in pages if p is not None),
+        'company_name': field_value(row.get('Company Name')),
+        'invoice_number': normalize_invoice_number(row.get('Invoice Number')),
+        'invoice_date': normalize_date(row.get('Date')),
+        'date_text': field_value(row.get('Date')),
+        'seller_trn': field_value(row.get('Seller TRN')),
+        'buyer_trn': field_value(row.get('Buyer TRN')),
+        'vat_amount': to_amount(row.get('VAT Amount')),
+        'total_amount': to_amount(row.get('Total Amount')),
+    }
+
+
+def duplicate_key(record: dict) -> str | None:
+    """``TRN|INVOICE NUMBER|TOTAL`` of an invoice record; None unless all three were extracted.
+
+    db.migration_6 computes the same key in SQL for invoices stored before it.
+    """
+    if record['seller_trn'] is None or record['invoice_number'] is None or record['total_amount'] is None:
+        return None
+    trn = str(record['seller_trn']).replace(' ', '').replace('-', '').upper()
+    return f"{trn}|{record['invoice_number']}|{record['total_amount']:.2f}"
+
+
+def find_duplicate_invoice(conn, username: str, key: str | None) -> int | None:
+    """Id of the user's first invoice with this duplicate key, if any."""
+    if key is None:
+        return None
+    found = conn.execute(
+        "SELECT id FROM invoices WHERE username = ? AND duplicate_key = ? ORDER BY id LIMIT 1", (username, key)
+    ).fetchone()
+    return found[0] if found else None
+
+
+def find_duplicate_upload(conn, username: str, content_hash: str | None, upload_id: int) -> dict | None:
+    """The user's earliest other upload of the same file contents, if any."""
+    if not content_hash:
+        return None
+    found = conn.execute(
+        "SELECT id, original_filename, upload_time FROM uploads WHERE username = ? AND content_hash = ? AND id != ? "
+        "ORDER BY id LIMIT 1", (username, content_hash, upload_id)
+    ).fetchone()
+    return dict(zip(('upload_id', 'original_filename', 'upload_time'), found)) if found else None
+
+
+def record_invoices(conn, upload_id: int, username: str, job_id: str, rows: list[dict]) -> tuple[list[int], list[dict]]:
+    """Insert the extracted rows of one upload (not committed); returns (new invoice ids, duplicates found)."""
+    ids, duplicates = [], []
+    for row in rows:
+        record = invoice_record(row)
+        key = duplicate_key(record)
+        duplicate_of = find_duplicate_invoice(conn, username, key)
+        cur = conn.execute(
+            "INSERT INTO invoices (upload_id, username, job_id, pages, company_name, invoice_number, invoice_date, "
+            "date_text, seller_trn, buyer_trn, vat_amount, total_amount, duplicate_key, duplicate_of) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (upload_id, username, job_id, record['pages'], record['company_name'], record['invoice_number'],
+             record['invoice_date'], record['date_text'], record['seller_trn'], record['buyer_trn'],
+             record['vat_amount'], record['total_amount'], key, duplicate_of)
+        )
+        ids.append(cur.lastrowid)
+        if duplicate_of is not None:
+            duplicates.append({
+                'invoice_id': cur.lastrowid, 'duplicate_of': duplicate_of, 'invoice_number': record['invoice_number'],
+                'seller_trn': record['seller_trn'], 'total_amount': record['total_amount'],
+            })
+    return ids, duplicates
+
+
+def record_pages(conn, upload_id: int, username: str, page_texts: list[str], rows: list[dict],
+                 invoice_ids: list[int]) -> int:
+    """Add an upload's page texts to the full-text index (not committed); returns the pages indexed."""
+    if not page_texts or not db.has_table(conn, 'page_search'):
+        return 0
+    page_invoice = {}
+    for row, invoice_id in zip(rows, invoice_ids):
+        for page in row.get('Pages') or [row.get('Page')]:
+            page_invoice[page] = invoice_id
+    owner = owner_token(username)
+    entries = [(text, owner, username, upload_id, page_invoice.get(page), page)
+               for page, text in enumerate(page_texts, start=1) if text.strip()]
+    conn.executemany(
+        "INSERT INTO page_search (body, owner, username, upload_id, invoice_id, page) VALUES (?, ?, ?, ?, ?, ?)",
+        entries
+    )
+    return len(entries)
+
+
+def store_result(conn, upload_id: int, username: str, result: dict) -> dict:
+    """Persist what a processed job produced for an upload (not committed).
+
+    Returns ``{'invoice_ids', 'pages_indexed', 'duplicates': {'document', 'invoices'}}``:
+    the earlier upload of the same file (or None) and the invoices that repeat
+    earlier ones.
+    """
+    rows = result.get('rows', [])
+    content_hash = result.get('content_hash')
+    duplicate_document = find_duplicate_upload(conn, username, content_hash, upload_id)
+    conn.execute("UPDATE uploads SET content_hash = ? WHERE id = ?", (content_hash, upload_id))
+    invoice_ids, duplicate_invoices = record_invoices(conn, upload_id, username, result['job_id'], rows)
+    pages = record_pages(conn, upload_id, username, result.get('page_texts', []), rows, invoice_ids)
+    return {
+        'invoice_ids': invoice_ids,
+        'pages_indexed': pages,
+        'duplicates': {'document': duplicate_document, 'invoices': duplicate_invoices},
+    }
+
+
+def encode_invoice_cursor(sort: str, value, invoice_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, value, invoice_id]).encode()).decode().rstrip('=')
+
+
+def decode_invoice_cursor(cursor: str, sort: str) -> tuple:
+    """(sort value, id) of the last row of a page; raises ValueError for other cursors or another sort."""
+    try:
+        cursor_sort, value, invoice_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if value is not None and not isinstance(value, (str, int, float)):
+            raise ValueError
+        invoice_id = int(invoice_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("Cursor belongs to another sort")
+    return value, invoice_id
+
+
+def query_invoices(conn, username: str, filters: dict | None = None, sort: str = '-date',
+                   limit: int | str | None = None, cursor: str | None = None) -> tuple[list[dict], str | None]:
+    """A user's invoices matching ``filters`` (keys of INVOICE_FILTERS); returns (rows, cursor of the next page or None).
+
+    Keyset pagination on (sort column, id) walks the (username, column, id)
+    index, so every page costs the same however deep it is. Missing values
+    sort first ascending and last descending, as SQLite orders NULLs; they
+    are read as their own run of the index, so neither run needs an OR that
+    would stop the index seek. Raises ValueError for unknown filters or sort
+    keys and malformed values or cursors.
+    """
+    where, params = ["username = ?"], [username]
+    for name, value in (filters or {}).items():
+        if value in (None, ''):
+            continue
+        if name not in INVOICE_FILTERS:
+            raise ValueError(f"Unknown filter: {name}")
+        condition, convert = INVOICE_FILTERS[name]
+        where.append(condition)
+        params.append(convert(value))
+    descending = sort.startswith('-')
+    column = INVOICE_SORTS.get(sort.lstrip('-'))
+    if column is None:
+        raise ValueError(f"Unknown sort: {sort}")
+    direction, op = ('DESC', '<') if descending else ('ASC', '>')
+    limit = config.INVOICES_PAGE_SIZE if limit is None else max(1, min(int(limit), config.INVOICES_MAX_PAGE_SIZE))
+    after = decode_invoice_cursor(cursor, sort) if cursor else None
+
+    # Runs of the index in sort order, True for the run of NULL values; a cursor resumes inside its own run
+    runs = [False] if column == 'id' else [False, True] if descending else [True, False]
+    if after is not None:
+        runs = runs[runs.index(after[0] is None and column != 'id'):]
+    rows = []
+    for null_run in runs:
+        conditions, run_params = list(where), list(params)
+        if column != 'id':
+            conditions.append(f"{column} IS NULL" if null_run else f"{column} IS NOT NULL")
+        if after is not None and null_run == (after[0] is None and column != 'id'):
+            if null_run or column == 'id':
+                conditions.append(f"id {op} ?")
+                run_params.append(after[1])
+            else:
+                conditions.append(f"({column}, id) {op} (?, ?)")
+                run_params.extend(after)
+        rows += conn.execute(
+            f"SELECT {', '.join(INVOICE_FIELDS)} FROM invoices WHERE {' AND '.join(conditions)} "
+            f"ORDER BY {column} {direction}, id {direction} LIMIT ?",
+            run_params + [limit + 1 - len(rows)]
+        ).fetchall()
+        if len(rows) > limit:
+            break
+    page = [dict(zip(INVOICE_FIELDS, row)) for row in rows[:limit]]
+    next_cursor = encode_invoice_cursor(sort, page[-1][column], page[-1]['id']) if len(rows) > limit else None
+    return page, next_cursor
+
+
+SEARCH_FIELDS = [
+    'upload_id', 'job_id', 'original_filename', 'page', 'snippet', 'invoice_id',
+    'invoice_number', 'company_name', 'seller_trn', 'invoice_date', 'total_amount',
+]
+
+
+def owner_token(username: str) -> str:
+    """The single FTS5 token standing for ``username`` in page_search.owner (same as SQL 'u' || hex(username))."""
+    return 'u' + username.encode('utf-8').hex().upper()
+
+
+def match_expression(query: str) -> str:
+    """FTS5 query for free text: every word must appear, punctuation is literal and ``word*`` matches a prefix."""
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*') and len(word) > 1
+        word = word.rstrip('*') if prefix else word
+        terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    if not terms:
+        raise ValueError("Empty search query")
+    return ' '.join(terms)
+
+
+def search_pages(conn, username: str, query: str, limit: int | str | None = None,
+                 offset: int | str | None = None) -> tuple[list[dict], int | None]:
+    """A user's pages whose OCR text matches ``query``, best first, with snippets and their invoices.
+
+    Returns (hits, next offset or None). Raises ValueError for an empty query
+    or when the database has no full-text index.
+    """
+    if not db.has_table(conn, 'page_search'):
+        raise ValueError("Full-text search is not available (SQLite lacks FTS5)")
+    limit = config.SEARCH_PAGE_SIZE if limit is None else max(1, min(int(limit), config.SEARCH_MAX_PAGE_SIZE))
+    offset = 0 if offset is None else max(0, int(offset))
+    rows = conn.execute(
+        "SELECT page_search.upload_id, u.job_id, u.original_filename, page_search.page, "
+        f"snippet(page_search, 0, '[', ']', '...', {int(config.SEARCH_SNIPPET_TOKENS)}), page_search.invoice_id, "
+        "i.invoice_number, i.company_name, i.seller_trn, i.invoice_date, i.total_amount "
+        "FROM page_search JOIN uploads u ON u.id = page_search.upload_id "
+        "LEFT JOIN invoices i ON i.id = page_search.invoice_id "
+        "WHERE page_search MATCH ? AND page_search.username = ? ORDER BY page_search.rank LIMIT ? OFFSET ?",
+        (f"owner : {owner_token(username)} AND body : ({match_expression(query)})", username, limit + 1, offset)
+    ).fetchall()
+    hits = [dict(zip(SEARCH_FIELDS, row)) for row in rows[:limit]]
+    return hits, (offset + limit if len(rows) > limit else None)
+
+
+# Grouping names accepted by invoice_stats -> invoice_totals column
+STATS_GROUPS = {'seller': 'seller_trn', 'month': 'month'}
+
+
+def month_bound(value: str) -> str:
+    """``YYYY-MM`` filter value, validated."""
+    return datetime.strptime(value, '%Y-%m').strftime('%Y-%m')
+
+
+def invoice_stats(conn, username: str, group_by: str | None = 'seller,month', seller_trn: str | None = None,
+                  month_from: str | None = None, month_to: str | None = None) -> tuple[list[dict], dict]:
+    """Invoice count, total and VAT of a user's invoices, per group; returns (groups, overall totals).
+
+    ``group_by`` is a comma-separated subset of STATS_GROUPS (empty for the
+    overall totals only); months are invoice months (``YYYY-MM``, '' when the
+    date was not recognized). Duplicate invoices are not counted. Raises
+    ValueError for unknown groupings and malformed months.
+    """
+    names = [name.strip() for name in (group_by or '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in STATS_GROUPS]
+    if unknown:
+        raise ValueError(f"Unknown grouping: {', '.join(unknown)}")
+    columns = [STATS_GROUPS[name] for name in dict.fromkeys(names)]
+    where, params = ["username = ?"], [username]
+    if seller_trn:
+        where.append("seller_trn = ?")
+        params.append(seller_trn)
+    if month_from:
+        where.append("month >= ?")
+        params.append(month_bound(month_from))
+    if month_to:
+        where.append("month <= ?")
+        params.append(month_bound(month_to))
+    sums = "sum(invoices), round(sum(total_amount), 2), round(sum(vat_amount), 2)"
+    condition = ' AND '.join(where)
+    fields = columns + ['invoices', 'total_amount', 'vat_amount']
+    groups = []
+    if columns:
+        keys = ', '.join(columns)
+        rows = conn.execute(
+            f"SELECT {keys}, {sums} FROM invoice_totals WHERE {condition} GROUP BY {keys} ORDER BY {keys}", params
+        ).fetchall()
+        groups = [dict(zip(fields, row)) for row in rows]
+    count, total, vat = conn.execute(f"SELECT {sums} FROM invoice_totals WHERE {condition}", params).fetchone()
+    return groups, {'invoices': count or 0, 'total_amount': total or 0.0, 'vat_amount': vat or 0.0}
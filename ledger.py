@@ -0,0 +1,189 @@
+"""
+Append-only master ledger of extracted invoice rows.
+
+Every processed document appends its typed rows to a Parquet dataset under
+config.LEDGER_FOLDER, partitioned by processing month:
+
+    ledger/month=2026-10/part-20261019_101500_<job>.parquet
+
+A part is written under a temporary name and renamed into place, so readers
+never see a partial file. Compaction merges the parts of a month into a single
+file; consolidated reports then read one file per month instead of every
+per-upload workbook. The compacted file lists the parts it replaces in its
+Parquet metadata, so parts left behind by a compaction that stopped before
+removing them are ignored (and removed by the next compaction) rather than
+counted twice:
+
+    python ledger.py compact
+    python ledger.py report --month 2026-10
+"""
+
+import argparse
+import glob
+import json
+import os
+import secrets
+from datetime import datetime
+
+import pandas as pd
+
+import config
+from file_lock import locked
+from report_writers import HAS_PYARROW
+
+if HAS_PYARROW:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+# Provenance columns added to the extraction columns
+LEDGER_COLUMNS = ['Job ID', 'Source File', 'Extracted At']
+# Parquet metadata key of a compacted file: JSON list of the part names it replaces
+REPLACES_KEY = b'ledger.replaces'
+
+
+def month_folder(month: str, folder: str = config.LEDGER_FOLDER) -> str:
+    return os.path.join(folder, f"month={month}")
+
+
+def ledger_months(folder: str = config.LEDGER_FOLDER) -> list[str]:
+    # Skips the month=<month>.lock files of compact_month
+    return sorted(os.path.basename(p)[len('month='):] for p in glob.glob(os.path.join(folder, 'month=*'))
+                  if os.path.isdir(p))
+
+
+def replaced_parts(path: str) -> list[str]:
+    """Names of the parts a compacted file replaces."""
+    metadata = pq.read_schema(path).metadata or {}
+    return json.loads(metadata.get(REPLACES_KEY, b'[]'))
+
+
+def month_files(month: str, folder: str = config.LEDGER_FOLDER) -> tuple[list[str], list[str]]:
+    """(live parts, stale parts) of one month; stale parts are already merged into a compacted file."""
+    paths = sorted(glob.glob(os.path.join(month_folder(month, folder), '*.parquet')))
+    replaced = set()
+    for path in paths:
+        if os.path.basename(path).startswith('compacted-'):
+            replaced.update(replaced_parts(path))
+    live = [p for p in paths if os.path.basename(p) not in replaced]
+    return live, [p for p in paths if os.path.basename(p) in replaced]
+
+
+def ledger_parts(month: str, folder: str = config.LEDGER_FOLDER) -> list[str]:
+    return month_files(month, folder)[0]
+
+
+def write_part(df: pd.DataFrame, directory: str, prefix: str, replaces: list[str] | None = None) -> str:
+    """Write a Parquet file under a hidden temporary name, then rename it into place."""
+    os.makedirs(directory, exist_ok=True)
+    name = f"{prefix}-{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(4)}.parquet"
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if replaces:
+        metadata = dict(table.schema.metadata or {})
+        metadata[REPLACES_KEY] = json.dumps(replaces).encode('utf-8')
+        table = table.replace_schema_metadata(metadata)
+    pq.write_table(table, tmp_path)
+    path = os.path.join(directory, name)
+    os.replace(tmp_path, path)
+    return path
+
+
+def append_to_ledger(table: pd.DataFrame, source: str | None = None, job_id: str | None = None,
+                     folder: str = config.LEDGER_FOLDER, when: datetime | None = None) -> str | None:
+    """Append one job's typed rows (see typed_table) to the month partition; returns the part path."""
+    if table is None or table.empty:
+        return None
+    if not HAS_PYARROW:
+        print("Ledger not updated: pyarrow library not found. Please install it using: pip install pyarrow")
+        return None
+    when = when or datetime.now()
+    df = table.copy()
+    df['Job ID'] = job_id
+    df['Source File'] = source
+    df['Extracted At'] = pd.Timestamp(when)
+    try:
+        return write_part(df, month_folder(when.strftime('%Y-%m'), folder), 'part')
+    except Exception as e:
+        print(f"Error appending to ledger: {e}")
+        return None
+
+
+def read_ledger(months: list[str] | None = None, folder: str = config.LEDGER_FOLDER) -> pd.DataFrame:
+    """All ledger rows of the given months (default: every month), oldest first."""
+    frames = []
+    for month in months or ledger_months(folder):
+        for path in ledger_parts(month, folder):
+            df = pd.read_parquet(path)
+            df['Month'] = month
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).sort_values('Extracted At', kind='stable', ignore_index=True)
+
+
+def compact_month(month: str, folder: str = config.LEDGER_FOLDER) -> int:
+    """Merge the parts of one month into a single file; returns the number of parts merged.
+
+    Compactions of the same month wait for each other on a lock beside the
+    month folder, and each one lists the parts only once it holds the lock.
+    Parts appended while compaction runs are not touched and stay alongside
+    the compacted file. The compacted file is in place before any part is
+    removed, and it names the parts it replaces, so a crash in between loses
+    no rows and counts none twice.
+    """
+    directory = month_folder(month, folder)
+    with locked(directory):
+        parts, stale = month_files(month, folder)
+        for path in stale:
+            os.remove(path)
+        if len(parts) < 2:
+            return 0
+        df = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+        df = df.sort_values('Extracted At', kind='stable', ignore_index=True)
+        write_part(df, directory, 'compacted', [os.path.basename(p) for p in parts])
+        for path in parts:
+            os.remove(path)
+    return len(parts)
+
+
+def compact_ledger(months: list[str] | None = None, folder: str = config.LEDGER_FOLDER) -> int:
+    merged = 0
+    for month in months or ledger_months(folder):
+        count = compact_month(month, folder)
+        if count:
+            print(f"✓ {month}: {count} parts compacted")
+        merged += count
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain and report on the master invoice ledger")
+    parser.add_argument('command', choices=['compact', 'report'])
+    parser.add_argument('--month', action='append', help="YYYY-MM partition (repeatable; default: all months)")
+    parser.add_argument('--folder', default=config.LEDGER_FOLDER, help="ledger folder")
+    args = parser.parse_args()
+
+    if not HAS_PYARROW:
+        print("Error: pyarrow library not found. Please install it using: pip install pyarrow")
+        return
+
+    if args.command == 'compact':
+        merged = compact_ledger(args.month, args.folder)
+        print(f"\nCompaction complete! {merged} parts merged.")
+        return
+
+    df = read_ledger(args.month, args.folder)
+    if df.empty:
+        print(f"No ledger rows found in {args.folder}")
+        return
+    summary = df.groupby(['Month', 'Seller TRN'], dropna=False).agg(
+        Invoices=('Invoice Number', 'size'),
+        VAT=('VAT Amount', 'sum'),
+        Total=('Total Amount', 'sum'),
+    )
+    print(summary.to_string())
+    print(f"\n{len(df)} invoices in {df['Month'].nunique()} month(s)")
+
+
+if __name__ == "__main__":
+    main()
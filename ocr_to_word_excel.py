@@ -249,7 +249,26 @@ def extract_amounts(lines):
         total = f"AED {max(candidate_amounts):,.2f}"
     return subtotal, total
 
-def extract_invoice_table(ocr_lines, invoice_number=None, page_idx=None):
+def extract_invoice_table(ocr_lines, invoice_number=None, page_idx=None, page=None):
+    # Joined OCR lines carry no column gaps; use word geometry when the page export is available
+    if page is not None:
+        from ocr_to_word_excel_fixed import PageLayout, extract_line_items
+        items = [
+            {
+                'Invoice Number': invoice_number if invoice_number else '',
+                'Page': page_idx + 1 if page_idx is not None else '',
+                **item,
+            }
+            for item in extract_line_items(PageLayout(page))
+        ]
+        if not items:
+            print("No table header found.")
+            return pd.DataFrame()
+        df = pd.DataFrame(items)
+        for col in ('Quantity', 'Rate', 'Amount'):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        df['Valid'] = (df['Quantity'] * df['Rate'] - df['Amount']).abs() < 0.05
+        return summarize_invoice_table(df)
     header_idx = None
     for i, line in enumerate(ocr_lines):
         if (re.search(r'qty|quantity', line, re.I) and
@@ -283,7 +302,9 @@ def extract_invoice_table(ocr_lines, invoice_number=None, page_idx=None):
                 })
             except Exception:
                 continue
-    df = pd.DataFrame(items)
+    return summarize_invoice_table(pd.DataFrame(items))
+
+def summarize_invoice_table(df):
     if not df.empty:
         df['Quantity'] = pd.to_numeric(df['Quantity'], errors='coerce')
         df['Rate'] = pd.to_numeric(df['Rate'], errors='coerce')
@@ -314,6 +335,7 @@ def extract_items_from_pdf(pdf_path):
     model = ocr_predictor(pretrained=True)
     doc = DocumentFile.from_pdf(pdf_path)
     result = model(doc)
+    page_exports = result.export()['pages']
     rows = []
     all_items = []
     for page_idx, page in enumerate(result.pages):
@@ -337,7 +359,7 @@ def extract_items_from_pdf(pdf_path):
         row['VAT Amount'] = vat_amount
         row['Total Amount'] = total
         rows.append(row)
-        item_df = extract_invoice_table(page_lines, invoice_number=row['Invoice Number'], page_idx=page_idx)
+        item_df = extract_invoice_table(page_lines, invoice_number=row['Invoice Number'], page_idx=page_idx, page=page_exports[page_idx])
         if not item_df.empty:
             all_items.append(item_df)
     if all_items:
@@ -367,6 +389,7 @@ if __name__ == '__main__':
     model = ocr_predictor(pretrained=True)
     doc = DocumentFile.from_pdf(PDF_PATH)
     result = model(doc)
+    page_exports = result.export()['pages']
     rows = []
     all_items = []
     for page_idx, page in enumerate(result.pages):
@@ -393,7 +416,7 @@ if __name__ == '__main__':
         row['VAT Amount'] = vat_amount
         row['Total Amount'] = total
         rows.append(row)
-        item_df = extract_invoice_table(page_lines, invoice_number=row['Invoice Number'], page_idx=page_idx)
+        item_df = extract_invoice_table(page_lines, invoice_number=row['Invoice Number'], page_idx=page_idx, page=page_exports[page_idx])
         if not item_df.empty:
             item_excel_path = os.path.join(OUTPUT_FOLDER, f"items_table_page_{page_idx+1}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
             item_df.to_excel(item_excel_path, index=False)
@@ -19,92 +19,409 @@ except ImportError:
     print("Error: python-docx library not found. Please install it using: pip install python-docx")
     exit(1)
 
+try:
+    import numpy as np
+except ImportError:
+    print("Error: numpy library not found. Please install it using: pip install numpy")
+    exit(1)
+
 from datetime import datetime
+import gzip
+import hashlib
+import json
 import re
+import threading
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
 from pathlib import Path
 
+from config import GRID_TABLES_ENABLED, LEDGER_ENABLED, TEMPLATE_MARGIN
+from exports import job_dir, new_job_id, save_result
+from extraction_rules import get_rules
+from grid_tables import HAS_CV2, merge_grid_tables, recognize_grid_tables
+from ledger import append_to_ledger
+from report_writers import (
+    HAS_PYARROW,
+    ITEM_TABLE_COLUMNS,
+    parse_formats,
+    typed_table,
+    write_outputs,
+)
+from vendor_index import get_vendor_index, is_labelled_trn
+from vendor_templates import TEMPLATE_FIELDS, get_template_store
+
 PDF_PATH = "invoices/your_invoice.pdf"
 OUTPUT_FOLDER = "extracted_data"
+# Persisted doctr exports, one gzipped JSON per document content hash
+OCR_CACHE_FOLDER = "ocr_cache"
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
 # Global variable for model (will be loaded lazily)
 _model = None
+_model_lock = threading.Lock()
 
 def get_model():
     """Lazy load the OCR model only when needed"""
     global _model
     if _model is None:
-        print("Loading OCR model...")
-        _model = ocr_predictor(pretrained=True)
-        print("OCR model loaded successfully!")
+        with _model_lock:
+            if _model is None:
+                print("Loading OCR model...")
+                _model = ocr_predictor(pretrained=True)
+                print("OCR model loaded successfully!")
     return _model
 
-def process_invoice(pdf_path=PDF_PATH):
-    """Main function to process the invoice. Supports PDF and image files (png/jpg/jpeg)."""
+def is_document_bytes(source) -> bool:
+    return isinstance(source, (bytes, bytearray, memoryview))
+
+def document_hash(source) -> str:
+    """SHA-256 of the document contents (a path or bytes); identifies a document in the OCR cache."""
+    if is_document_bytes(source):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def document_name(source, filename: str | None = None) -> str:
+    """File name of a document given as a path, or as bytes with an optional upload name."""
+    if filename:
+        return os.path.basename(filename)
+    return 'document.pdf' if is_document_bytes(source) else os.path.basename(source)
+
+def load_document(source, filename: str | None = None):
+    """Open a PDF or image given as a path or as bytes (``filename`` supplies the extension for bytes)."""
+    file_ext = Path(document_name(source, filename)).suffix.lower()
+    if is_document_bytes(source):
+        source = bytes(source)
+    if file_ext in [".png", ".jpg", ".jpeg"]:
+        return DocumentFile.from_images([source])
+    return DocumentFile.from_pdf(source)
+
+def ocr_cache_path(doc_hash: str, cache_folder: str = OCR_CACHE_FOLDER) -> str:
+    return os.path.join(cache_folder, f"{doc_hash}.json.gz")
+
+def save_ocr_export(pdf_path: str, export_data: dict, doc_hash: str, cache_folder: str = OCR_CACHE_FOLDER):
+    """Persist the doctr export of a document so extraction can be replayed without OCR."""
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        record = {
+            'source': os.path.basename(pdf_path),
+            'sha256': doc_hash,
+            'created': datetime.now().isoformat(),
+            'export': export_data,
+        }
+        path = ocr_cache_path(doc_hash, cache_folder)
+        tmp_path = path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+        return path
+    except Exception as e:
+        print(f"Error saving OCR export: {e}")
+        return None
+
+def load_ocr_export(path: str) -> dict:
+    """Load a cached OCR record written by save_ocr_export."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+def run_ocr(source, use_cache: bool = True, filename: str | None = None, doc_hash: str | None = None) -> dict:
+    """Return the doctr export for a document (path or bytes), from the OCR cache when available."""
+    doc_hash = doc_hash or document_hash(source)
+    cached = ocr_cache_path(doc_hash)
+    if use_cache and os.path.exists(cached):
+        print(f"Using cached OCR export: {cached}")
+        return load_ocr_export(cached)['export']
+    # Load model and process
+    model = get_model()
+    doc = load_document(source, filename)
+    page_tables = []
+    if GRID_TABLES_ENABLED and HAS_CV2:
+        # Ruled tables: recognize cells directly and blank them for the full pass
+        doc, page_tables = recognize_grid_tables(model, doc)
+    print("Running OCR...")
+    result = model(doc)
+    print("OCR completed!")
+    # Structured export for layout-aware parsing
+    export_data = result.export()
+    merge_grid_tables(export_data, page_tables)
+    save_ocr_export(document_name(source, filename), export_data, doc_hash)
+    return export_data
+
+def process_invoice(pdf_path=PDF_PATH, formats=None, job_id=None, filename=None):
+    """Main function to process the invoice. Supports PDF and image files (png/jpg/jpeg).
+
+    ``pdf_path`` may also be the document's bytes (e.g. an upload held in
+    memory); ``filename`` then names the upload, for its file type and the
+    job id.
+
+    ``formats`` selects the outputs (list or comma-separated string, e.g.
+    ``"xlsx,parquet"``); defaults to config.OUTPUT_FORMATS. An empty list
+    writes none up front and leaves them to exports.render_export.
+
+    Everything the job writes goes to its own folder (exports.job_dir).
+    Returns ``{'job_id', 'folder', 'invoices', 'rows', 'page_texts',
+    'content_hash', 'outputs': {format: path}}``, or None if processing failed.
+    """
     try:
-        print(f"Processing invoice: {pdf_path}")
+        filename = document_name(pdf_path, filename)
+        print(f"Processing invoice: {filename}")
         
         # Check if file exists
-        if not os.path.exists(pdf_path):
+        if not is_document_bytes(pdf_path) and not os.path.exists(pdf_path):
             print(f"Error: PDF file not found at {pdf_path}")
-            return False
+            return None
             
-        # Load model and process
-        model = get_model()
-        file_ext = Path(pdf_path).suffix.lower()
-        if file_ext in [".png", ".jpg", ".jpeg"]:
-            doc = DocumentFile.from_images([pdf_path])
-        else:
-            doc = DocumentFile.from_pdf(pdf_path)
-        print("Running OCR...")
-        result = model(doc)
-        print("OCR completed!")
-        
-        # Structured export for layout-aware parsing
-        export_data = result.export()
-        # Build per-page texts for keyword-only fallbacks
-        page_texts = extract_page_texts(result)
-        if not page_texts:
-            # Fallback: single combined text
-            combined_text = result.render()
-            page_texts = [combined_text]
-        
-        rows = []
-        for idx, page_text in enumerate(page_texts, start=1):
-            lines = page_text.split('\n')
-            company_name = extract_company_name(lines)
-            invoice_number = extract_invoice_number(lines, page_text)
-            date = extract_date(lines, page_text)
-            seller_trn, buyer_trn = extract_trns(page_text)
-            # Prefer layout-aware extraction using word coordinates
-            page_dict = export_data.get('pages', [])[idx - 1] if export_data.get('pages') else None
-            subtotal_layout, vat_layout, total_layout = extract_amounts_layout(page_dict)
-
-            # Fallbacks to text-only heuristics
-            vat_amount = vat_layout if vat_layout != "Not Found" else extract_vat_amount(lines)
-            total_amount = total_layout if total_layout != "Not Found" else extract_total_amount(lines)
-            rows.append({
-                'Page': idx,
-                'Company Name': company_name,
-                'Invoice Number': invoice_number,
-                'Date': date,
-                'Seller TRN': seller_trn,
-                'Buyer TRN': buyer_trn,
-                'VAT Amount': vat_amount,
-                'Total Amount': total_amount,
-            })
+        content_hash = document_hash(pdf_path)
+        export_data = run_ocr(pdf_path, filename=filename, doc_hash=content_hash)
+        layouts = build_layouts(export_data)
+        rows = extract_invoices(export_data, layouts)
+        items = extract_items(layouts, rows)
         
-        print("Data extracted successfully!")
+        print(f"Data extracted successfully! {len(rows)} invoice(s) found.")
+        job_id = job_id or new_job_id(filename)
+        save_result(job_id, rows, items)
+        if LEDGER_ENABLED and HAS_PYARROW:
+            append_to_ledger(typed_table(rows), source=filename, job_id=job_id)
         
         # Save tabular outputs
-        save_table_to_excel(rows)
-        save_table_to_word(rows)
+        if formats is None or isinstance(formats, str):
+            formats = parse_formats(formats)
+        folder = job_dir(job_id)
+        outputs = write_outputs(rows, items, formats, job_id, folder)
         
-        return True
+        return {
+            'job_id': job_id, 'folder': folder, 'invoices': len(rows), 'rows': rows,
+            'page_texts': page_texts_from_export(export_data), 'content_hash': content_hash, 'outputs': outputs,
+        }
         
     except Exception as e:
         print(f"Error processing invoice: {e}")
-        return False
+        return None
+
+def build_layouts(export_data: dict) -> list:
+    """Word index per page, built once and shared by every extraction step."""
+    anchor_terms = get_rules().anchor_terms
+    return [PageLayout(p, anchor_terms) for p in export_data.get('pages', [])]
+
+def extract_rows(export_data: dict, layouts: list | None = None, use_templates: bool = True) -> list[dict]:
+    """Field-extraction stage: turn a doctr export into one row dict per page.
+
+    Needs no OCR model, so it can be replayed over cached exports. With
+    ``use_templates`` off, vendor templates are neither read nor learned and
+    every field comes from the heuristics.
+    """
+    # One rule set for the whole document, even if the rules file changes mid-way
+    rules = get_rules()
+    templates = get_template_store() if use_templates else None
+    vendors = get_vendor_index()
+    if layouts is None:
+        layouts = build_layouts(export_data)
+    # Build per-page texts for keyword-only fallbacks
+    page_texts = page_texts_from_export(export_data)
+    if not page_texts:
+        page_texts = ['']
+
+    rows = []
+    for idx, page_text in enumerate(page_texts, start=1):
+        lines = page_text.split('\n')
+        seller_trn, buyer_trn = extract_trns(page_text, rules)
+        vendor_trn = seller_trn if is_labelled_trn(page_text, seller_trn) else None
+        company_name = vendors.canonical_name(extract_company_name(lines, rules), vendor_trn)
+        layout = layouts[idx - 1] if idx <= len(layouts) else None
+        # Fast path: read the regions learned for this seller's layout
+        template = templates.get(seller_trn) if templates and layout else None
+        found = read_template_fields(layout, template, rules) if template else {}
+
+        invoice_number = found.get('Invoice Number') or extract_invoice_number(lines, page_text, rules)
+        date = found.get('Date') or extract_date(lines, page_text, rules)
+        if 'VAT Amount' in found and 'Total Amount' in found:
+            vat_amount, total_amount = found['VAT Amount'], found['Total Amount']
+        else:
+            # Prefer layout-aware extraction using word coordinates
+            subtotal_layout, vat_layout, total_layout = extract_amounts_layout(layout, rules)
+
+            # Fallbacks to text-only heuristics
+            vat_amount = vat_layout if vat_layout != "Not Found" else extract_vat_amount(lines, rules)
+            total_amount = total_layout if total_layout != "Not Found" else extract_total_amount(lines, rules)
+        row = {
+            'Page': idx,
+            'Company Name': company_name,
+            'Invoice Number': invoice_number,
+            'Date': date,
+            'Seller TRN': seller_trn,
+            'Buyer TRN': buyer_trn,
+            'VAT Amount': vat_amount,
+            'Total Amount': total_amount,
+        }
+        rows.append(row)
+
+        # Learn regions for fields the template did not supply
+        if templates and layout is not None and len(found) < len(TEMPLATE_FIELDS):
+            missed = {f: row[f] for f in TEMPLATE_FIELDS if f not in found}
+            templates.learn(seller_trn, locate_fields(layout, missed))
+    return rows
+
+def page_signals(page_text: str, rules) -> dict:
+    """Cheap per-page cues used to find where one invoice ends and the next begins."""
+    lines = page_text.split('\n')
+    page_no = page_count = None
+    for pattern in rules.patterns['page_of']:
+        m = pattern.search(page_text)
+        if m:
+            page_no, page_count = int(m.group(1)), int(m.group(2))
+            break
+    upper = page_text.upper()
+    return {
+        'invoice_number': extract_invoice_number(lines, page_text, rules),
+        'seller_trn': extract_trns(page_text, rules)[0],
+        'page_no': page_no,
+        'page_count': page_count,
+        'has_total': any(term in upper for term in rules.keywords['final_total']),
+    }
+
+def starts_new_invoice(prev: dict, page: dict, current: dict) -> bool:
+    """Whether ``page`` opens a new invoice, given the previous page and the open invoice's header."""
+    # Explicit page numbering wins when present
+    if page['page_no'] is not None:
+        if page['page_no'] == 1:
+            return True
+        if prev['page_no'] is not None and page['page_no'] == prev['page_no'] + 1:
+            return False
+    if prev['page_no'] is not None and prev['page_no'] == prev['page_count']:
+        return True
+    number, trn = page['invoice_number'], page['seller_trn']
+    if number != "Not Found" and current['invoice_number'] != "Not Found":
+        return number != current['invoice_number']
+    if trn != "Not Found" and current['seller_trn'] != "Not Found" and trn != current['seller_trn']:
+        return True
+    # A fresh header right after a page that carried the totals
+    return prev['has_total'] and (number != "Not Found" or trn != "Not Found")
+
+def segment_invoices(page_texts: list[str], rules=None) -> list[list[int]]:
+    """Group consecutive page indices (0-based) into invoices."""
+    rules = rules or get_rules()
+    if not page_texts:
+        return []
+    signals = [page_signals(text, rules) for text in page_texts]
+    groups = [[0]]
+    current = dict(signals[0])
+    for idx in range(1, len(signals)):
+        page = signals[idx]
+        if starts_new_invoice(signals[idx - 1], page, current):
+            groups.append([idx])
+            current = dict(page)
+            continue
+        groups[-1].append(idx)
+        # Fill in header fields the first page of the invoice lacked
+        for key in ('invoice_number', 'seller_trn'):
+            if current[key] == "Not Found":
+                current[key] = page[key]
+    return groups
+
+def merge_invoice_rows(page_rows: list[dict]) -> dict:
+    """One row for a multi-page invoice: header fields from the first page that has them,
+    amounts from the last page that has them (totals are printed at the end)."""
+    pages = [row['Page'] for row in page_rows]
+    merged = {
+        'Page': pages[0] if len(pages) == 1 else f"{pages[0]}-{pages[-1]}",
+        'Pages': pages,
+    }
+    for field in ('Company Name', 'Invoice Number', 'Date', 'Seller TRN', 'Buyer TRN'):
+        merged[field] = next((row[field] for row in page_rows if row[field] != "Not Found"), "Not Found")
+    for field in ('VAT Amount', 'Total Amount'):
+        merged[field] = next((row[field] for row in reversed(page_rows) if row[field] != "Not Found"), "Not Found")
+    return merged
+
+def extract_invoice(pages: list[dict], page_numbers: list[int], layouts: list | None = None,
+                    use_templates: bool = True) -> dict:
+    """Extract one invoice from its pages (doctr export page dicts) as a single row."""
+    rows = extract_rows({'pages': pages}, layouts, use_templates)
+    for row, page_no in zip(rows, page_numbers):
+        row['Page'] = page_no
+    return merge_invoice_rows(rows)
+
+def extract_invoices(export_data: dict, layouts: list | None = None, use_templates: bool = True) -> list[dict]:
+    """Split a document into invoices and extract one row per invoice.
+
+    Invoices are extracted one after another in this process: extraction is
+    cheap next to OCR, and vendor registrations and template learning must
+    land in this process. reextract.py parallelises across documents instead.
+    """
+    pages = export_data.get('pages', [])
+    if not pages:
+        return extract_rows(export_data, layouts, use_templates)
+    if layouts is None:
+        layouts = build_layouts(export_data)
+    groups = segment_invoices(page_texts_from_export(export_data), get_rules())
+    jobs = [([pages[i] for i in group], [i + 1 for i in group]) for group in groups]
+    return [
+        extract_invoice(group_pages, page_numbers, [layouts[n - 1] for n in page_numbers], use_templates)
+        for group_pages, page_numbers in jobs
+    ]
+
+def read_template_fields(layout, template: dict, rules) -> dict:
+    """Read field values from a vendor template's regions, keeping only values that validate.
+
+    VAT and total are returned together or not at all, since each is checked
+    against the other.
+    """
+    found = {}
+    for field, pattern_name in (('Invoice Number', 'invoice_number'), ('Date', 'date')):
+        box = template.get(field)
+        if not box:
+            continue
+        text = ' '.join(w['text'] for w in layout.words_in(box, TEMPLATE_MARGIN))
+        for pattern in rules.patterns[pattern_name]:
+            m = pattern.search(text)
+            if m:
+                found[field] = m.group(0) if field == 'Invoice Number' else match_value(m)
+                break
+
+    def amount_in(box):
+        if not box:
+            return None
+        cx, cy = (box[0] + box[2]) / 2.0, (box[1] + box[3]) / 2.0
+        candidates = []
+        for w in layout.words_in(box, TEMPLATE_MARGIN):
+            val = w.get('amount')
+            if '%' not in w['text'] and val is not None:
+                candidates.append((abs((w['x0'] + w['x1']) / 2.0 - cx) + abs(w['yc'] - cy), val))
+        return min(candidates)[1] if candidates else None
+
+    vat_val = amount_in(template.get('VAT Amount'))
+    total_val = amount_in(template.get('Total Amount'))
+    if (total_val is not None and total_val > 0 and vat_val is not None
+            and 0 <= vat_val <= rules.thresholds['vat_to_total_ratio'] * total_val):
+        found['VAT Amount'] = f"{vat_val:.2f}"
+        found['Total Amount'] = f"{total_val:.2f}"
+    return found
+
+def locate_fields(layout, values: dict) -> dict:
+    """Find the word box each extracted value came from, for learning a vendor template."""
+    boxes = {}
+    for field, value in values.items():
+        if not value or value == "Not Found":
+            continue
+        if field in ('VAT Amount', 'Total Amount'):
+            target = parse_number(value)
+            if target is None:
+                continue
+            matches = []
+            for pos in layout.amount_positions:
+                w = layout.words[pos]
+                val = w['amount']
+                if '%' not in w['text'] and val is not None and abs(val - target) < 0.005:
+                    matches.append(w)
+            # Summary amounts sit at the bottom of the page; take the lowest match
+            word = max(matches, key=lambda w: w['yc']) if matches else None
+        else:
+            word = next((w for w in layout.words if value in w['text']), None)
+        if word:
+            boxes[field] = [round(word[k], 4) for k in ('x0', 'y0', 'x1', 'y1')]
+    return boxes
 
 def extract_page_texts(result) -> list:
     """Extract plain text per page from doctr result.export() structure."""
@@ -112,6 +429,10 @@ def extract_page_texts(result) -> list:
         data = result.export()
     except Exception:
         return []
+    return page_texts_from_export(data)
+
+def page_texts_from_export(data: dict) -> list:
+    """Extract plain text per page from a doctr export dict."""
     page_texts = []
     for page in data.get('pages', []):
         lines_text = []
@@ -123,62 +444,82 @@ def extract_page_texts(result) -> list:
         page_texts.append('\n'.join(lines_text))
     return page_texts
 
-# Keywords for company name
-company_keywords = ["GARMENTS", "TRADING", "LLC", "COLLECTIONS", "TEXTILES", "COMPANY", "CORPORATION", "EST", "SUPPLIERS", "INDUSTRIAL", "UNIFORMS"]
+def match_value(m) -> str:
+    """Value of a pattern match: its first group if it has one, else the whole match."""
+    return m.group(1) if m.re.groups else m.group(0)
 
-def extract_company_name(lines):
-    company_keywords = [
-        "LLC", "L.L.C", "TRADING", "GARMENTS", "COMPANY", "COLLECTIONS", "TEXTILES",
-        "CORPORATION", "EST", "SUPPLIERS", "INDUSTRIAL", "UNIFORMS", "AREA"
-    ]
+def extract_company_name(lines, rules=None):
+    rules = rules or get_rules()
+    company_keywords = rules.keywords['company']
+    exclude = rules.keywords['company_exclude']
+    search_lines = rules.thresholds['company_search_lines']
     # 1. Look for a line with a company keyword in the first 30 lines
-    for line in lines[:30]:
+    for line in lines[:search_lines]:
         if any(kw in line.upper() for kw in company_keywords):
             return line.strip()
     # 2. Fallback: first long line not containing common headers
-    for line in lines[:30]:
-        if len(line) > 6 and not any(x in line.upper() for x in [
-            "INVOICE", "DATE", "TOTAL", "AMOUNT", "VAT", "TRN", "BILL", "NUMBER", "QUANTITY", "ADDRESS"
-        ]):
+    for line in lines[:search_lines]:
+        if len(line) > 6 and not any(x in line.upper() for x in exclude):
             return line.strip()
     return "Not Found"
 
-def extract_invoice_number(lines, text):
+def extract_invoice_number(lines, text, rules=None):
+    rules = rules or get_rules()
+    patterns = rules.patterns['invoice_number']
+    labels = rules.keywords['invoice_number_label']
+    search_lines = rules.thresholds['invoice_number_search_lines']
     # 1. If a line contains 'Invoice No.', check that line and next 2 lines for invoice pattern
-    for i, line in enumerate(lines[:15]):
-        if 'INVOICE NO' in line.upper():
+    for i, line in enumerate(lines[:search_lines]):
+        if any(label in line.upper() for label in labels):
             for j in range(i, min(i+3, len(lines))):
-                m = re.search(r'[A-Z]{2,4}/\d{4,}/?\d{0,6}|[A-Z]{2,4}/\d{6,}', lines[j])
-                if m:
-                    return m.group(0)
+                for pattern in patterns:
+                    m = pattern.search(lines[j])
+                    if m:
+                        return m.group(0)
     # 2. Search first 15 lines for invoice pattern
-    for line in lines[:15]:
-        m = re.search(r'[A-Z]{2,4}/\d{4,}/?\d{0,6}|[A-Z]{2,4}/\d{6,}', line)
-        if m:
-            return m.group(0)
+    for line in lines[:search_lines]:
+        for pattern in patterns:
+            m = pattern.search(line)
+            if m:
+                return m.group(0)
     return "Not Found"
 
-def extract_date(lines, text):
+def extract_date(lines, text, rules=None):
+    rules = rules or get_rules()
+    patterns = rules.patterns['date']
+    labels = rules.keywords['date_label']
     for line in lines:
-        if 'DATED' in line.upper() or 'DATE' in line.upper():
-            m = re.search(r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}[/-]\d{1,2}[/-]\d{1,2}|\d{1,2}-[A-Za-z]{3}-\d{4})', line)
-            if m:
-                return m.group(1)
-    m = re.search(r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}[/-]\d{1,2}[/-]\d{1,2}|\d{1,2}-[A-Za-z]{3}-\d{4})', text)
-    if m:
-        return m.group(1)
+        if any(label in line.upper() for label in labels):
+            for pattern in patterns:
+                m = pattern.search(line)
+                if m:
+                    return match_value(m)
+    for pattern in patterns:
+        m = pattern.search(text)
+        if m:
+            return match_value(m)
     return "Not Found"
 
-def extract_trns(text):
-    trns = re.findall(r'TRN\s*:?\s*(\d{9,15})', text, re.IGNORECASE)
+def extract_trns(text, rules=None):
+    rules = rules or get_rules()
+    trns = []
+    for pattern in rules.patterns['trn']:
+        trns = [match_value(m) for m in pattern.finditer(text)]
+        if trns:
+            break
     seller = trns[0] if len(trns) > 0 else "Not Found"
     buyer = trns[1] if len(trns) > 1 else seller
     return seller, buyer
 
+NON_NUMERIC_PATTERN = re.compile(r'[^0-9.,-]')
+AMOUNT_DIGITS_PATTERN = re.compile(r'[\d,.]+')
+
+# Amount literals repeat across anchors, fallbacks and pages; parse each string once
+@lru_cache(maxsize=8192)
 def parse_number(val):
     try:
         s = val.upper().replace('AED', '')
-        s = re.sub(r'[^0-9.,-]', '', s)
+        s = NON_NUMERIC_PATTERN.sub('', s)
         # Prefer dot as decimal separator
         if s.count(',') > 1 and '.' not in s:
             s = s.replace(',', '')
@@ -188,7 +529,177 @@ def parse_number(val):
     except Exception:
         return None
 
-def extract_amounts_layout(page: dict) -> tuple[str, str, str]:
+AMOUNT_TOKEN_PATTERN = re.compile(r'^(?:AED\s*)?[\d,.]+(?:\s*AED)?$', re.IGNORECASE)
+
+# Anchor terms indexed up front for every page; other terms are resolved lazily
+ANCHOR_TERMS = [
+    'SUBTOTAL', 'SUB-TOTAL', 'TOTAL', 'VAT', 'AMOUNT', 'PAYABLE',
+    'GRAND TOTAL', 'TOTAL AMOUNT', 'AMOUNT PAYABLE', 'NET PAYABLE', 'INVOICE TOTAL',
+    'AMOUNT BEFORE TAX', 'BEFORE VAT',
+]
+
+# Amount column detection: histogram resolution over the page width, minimum
+# tokens sharing a right edge to count as a column, and slack around the band
+COLUMN_HIST_BINS = 100
+COLUMN_MIN_TOKENS = 2
+COLUMN_TOLERANCE = 0.01
+
+def is_amount_token(t: str) -> bool:
+    return bool(AMOUNT_TOKEN_PATTERN.search(t))
+
+@lru_cache(maxsize=8192)
+def parse_amount_token(t: str):
+    m = AMOUNT_DIGITS_PATTERN.search(t)
+    if not m:
+        return None
+    return parse_number(m.group(0))
+
+def detect_amount_columns(amount_words: list[dict]) -> list[tuple[float, float]]:
+    """Find right-aligned money columns from the right edges (x1) of amount tokens.
+
+    Right edges are histogrammed across the page width; bins are smoothed with
+    their neighbours so jitter across a bin boundary still forms one peak, and
+    each contiguous dense run becomes one column. Returns ``(x1_min, x1_max)``
+    bands (with tolerance), left to right.
+    """
+    if len(amount_words) < COLUMN_MIN_TOKENS:
+        return []
+    x1 = np.fromiter((w['x1'] for w in amount_words), dtype=float, count=len(amount_words))
+    counts, edges = np.histogram(x1, bins=COLUMN_HIST_BINS, range=(0.0, 1.0))
+    dense = np.convolve(counts, np.ones(3, dtype=int), mode='same') >= COLUMN_MIN_TOKENS
+    # Run boundaries of dense bins
+    steps = np.diff(np.concatenate(([0], dense.astype(np.int8), [0])))
+    starts = np.flatnonzero(steps == 1)
+    ends = np.flatnonzero(steps == -1)
+    columns = []
+    for start, end in zip(starts, ends):
+        in_run = (x1 >= edges[start]) & (x1 <= edges[end])
+        if np.count_nonzero(in_run) < COLUMN_MIN_TOKENS:
+            continue
+        members = x1[in_run]
+        columns.append((float(members.min()) - COLUMN_TOLERANCE, float(members.max()) + COLUMN_TOLERANCE))
+    return columns
+
+def normalize_token(text: str) -> str:
+    """Uppercase a word and strip surrounding punctuation for index lookups."""
+    return (text or '').upper().strip(' .,:;()[]')
+
+TOKEN_PART_PATTERN = re.compile(r'[A-Z]+|\d+')
+
+def token_parts(token: str) -> set[str]:
+    """Letter and digit runs of a normalized token, e.g. 'SUB-TOTAL' -> {'SUB', 'TOTAL'}, 'VAT5%' -> {'VAT', '5'}."""
+    return set(TOKEN_PART_PATTERN.findall(token))
+
+def iter_page_words(page: dict):
+    """Yield word dicts (text + normalized bbox) from a doctr export page in reading order."""
+    for block in page.get('blocks', []):
+        for line in block.get('lines', []):
+            for word in line.get('words', []):
+                val = word.get('value', '')
+                box = word.get('geometry', [[0,0],[0,0]])
+                # geometry: [[x0,y0],[x1,y1]]
+                try:
+                    (x0,y0),(x1,y1) = box
+                except Exception:
+                    x0=y0=x1=y1=0.0
+                yield {
+                    'text': val,
+                    'x0': float(x0), 'y0': float(y0), 'x1': float(x1), 'y1': float(y1),
+                    'yc': float(y0+y1)/2.0
+                }
+
+class PageLayout:
+    """Words of one OCR page plus an inverted token index, built once per page.
+
+    The index maps each letter/digit run of a word ('SUB-TOTAL' gives SUB and
+    TOTAL) to the word's positions, so a lookup reads only the words sharing a
+    run with the term. Positions returned by lookups are indices into
+    ``words`` and are always in reading order, so "first hit" matches a
+    linear scan over the page. Amount tokens carry their parsed value under
+    ``'amount'`` (None if unparseable).
+    """
+
+    def __init__(self, page: dict | None, anchor_terms=ANCHOR_TERMS):
+        self.page = page or {}
+        self.words = list(iter_page_words(self.page))
+        self.tokens = [normalize_token(w['text']) for w in self.words]
+        # token part -> word positions, ascending
+        self.index = {}
+        for pos, token in enumerate(self.tokens):
+            for part in token_parts(token):
+                self.index.setdefault(part, []).append(pos)
+        # Positions of tokens that look like money amounts, parsed once per page
+        self.amount_positions = [pos for pos, w in enumerate(self.words) if is_amount_token(w['text'])]
+        for pos in self.amount_positions:
+            self.words[pos]['amount'] = parse_amount_token(self.words[pos]['text'])
+        self._term_hits = {}
+        for term in anchor_terms:
+            self.lookup(term)
+        self._amount_columns = None
+        # (sorted y-centres, word positions in that order), built on first region query
+        self._by_y = None
+
+    @property
+    def amount_columns(self) -> list[tuple[float, float]]:
+        """Right-aligned money column bands, detected once and cached on the page."""
+        if self._amount_columns is None:
+            self._amount_columns = detect_amount_columns([self.words[pos] for pos in self.amount_positions])
+        return self._amount_columns
+
+    def in_amount_column(self, w: dict) -> bool:
+        """True if ``w`` is right-aligned in one of the detected money columns."""
+        return any(lo <= w['x1'] <= hi for lo, hi in self.amount_columns)
+
+    def lookup(self, term: str, substring: bool = False) -> list[int]:
+        """Positions of words whose normalized text contains ``term`` (memoized per term).
+
+        The term must cover whole letter/digit runs of the word ('TOTAL' finds
+        'SUB-TOTAL' and 'TOTAL:' but not 'SUBTOTAL'); with ``substring`` any
+        occurrence counts, at the cost of scanning every word of the page.
+        """
+        term = term.upper()
+        key = (term, substring)
+        hits = self._term_hits.get(key)
+        if hits is None:
+            parts = token_parts(term)
+            if substring:
+                hits = [pos for pos, token in enumerate(self.tokens) if term in token]
+            elif not parts:
+                hits = []
+            else:
+                # Candidates share the term's rarest run; the term itself must then appear in the token
+                candidates = min((self.index.get(part, []) for part in parts), key=len)
+                hits = [pos for pos in candidates if term in self.tokens[pos]
+                        and parts <= token_parts(self.tokens[pos])]
+            self._term_hits[key] = hits
+        return hits
+
+    def first(self, terms, predicate=None, substring: bool = False):
+        """First word (in reading order) containing any of ``terms`` and passing ``predicate``."""
+        best = None
+        for term in terms:
+            for pos in self.lookup(term, substring):
+                if best is not None and pos >= best:
+                    break
+                if predicate is None or predicate(self.words[pos]):
+                    best = pos
+                    break
+        return self.words[best] if best is not None else None
+
+    def words_in(self, box, margin: float = 0.0) -> list[dict]:
+        """Words whose centre lies inside ``box`` ([x0, y0, x1, y1]) expanded by ``margin``."""
+        if self._by_y is None:
+            order = sorted(range(len(self.words)), key=lambda pos: self.words[pos]['yc'])
+            self._by_y = ([self.words[pos]['yc'] for pos in order], order)
+        ys, order = self._by_y
+        x0, y0, x1, y1 = box
+        lo = bisect_left(ys, y0 - margin)
+        hi = bisect_right(ys, y1 + margin)
+        hits = sorted(order[lo:hi])
+        return [self.words[pos] for pos in hits
+                if x0 - margin <= (self.words[pos]['x0'] + self.words[pos]['x1']) / 2.0 <= x1 + margin]
+
+def extract_amounts_layout(page, rules=None) -> tuple[str, str, str]:
     """Layout-aware extraction of (subtotal, vat, total) by reading horizontally.
 
     Strategy:
@@ -198,58 +709,32 @@ def extract_amounts_layout(page: dict) -> tuple[str, str, str]:
     - For each anchor, look to the right on approximately the same line (y overlap) and pick the rightmost numeric token
       that looks like currency/amount.
     - Return strings (formatted to 2 decimals) or "Not Found".
+
+    ``page`` may be a doctr export page dict or a prebuilt ``PageLayout``.
     """
     if not page:
         return "Not Found", "Not Found", "Not Found"
 
-    def iter_words():
-        for block in page.get('blocks', []):
-            for line in block.get('lines', []):
-                for word in line.get('words', []):
-                    val = word.get('value', '')
-                    box = word.get('geometry', [[0,0],[0,0]])
-                    # geometry: [[x0,y0],[x1,y1]]
-                    try:
-                        (x0,y0),(x1,y1) = box
-                    except Exception:
-                        x0=y0=x1=y1=0.0
-                    yield {
-                        'text': val,
-                        'x0': float(x0), 'y0': float(y0), 'x1': float(x1), 'y1': float(y1),
-                        'yc': float(y0+y1)/2.0
-                    }
-
-    words = list(iter_words())
+    rules = rules or get_rules()
+    layout = page if isinstance(page, PageLayout) else PageLayout(page, rules.anchor_terms)
+    words = layout.words
     if not words:
         return "Not Found", "Not Found", "Not Found"
 
     # Uppercase helper available to all nested functions
     text_upper = lambda s: (s or '').upper()
-
-    def is_amount_token(t: str) -> bool:
-        return bool(re.search(r'^(?:AED\s*)?[\d,.]+(?:\s*AED)?$', t, re.IGNORECASE))
-
-    def parse_amount_token(t: str):
-        m = re.search(r'[\d,.]+', t)
-        if not m:
-            return None
-        return parse_number(m.group(0))
+    amount_words = [words[pos] for pos in layout.amount_positions]
 
     def get_amount_column_bounds() -> tuple[float, float] | None:
         # 1) Try header 'AMOUNT'
-        header = None
-        for w in words:
-            if 'AMOUNT' in text_upper(w['text']) and len(w['text']) <= 10:
-                header = w
-                break
+        header = layout.first(['AMOUNT'], lambda w: len(w['text']) <= 10)
         if header:
             # assume amounts are to the right of the header start
             return max(0.0, header['x0'] - 0.02), 1.0
         # 2) Infer from numeric tokens clustered on the right
-        numeric_tokens = [w for w in words if re.match(r'^(?:AED\s*)?[\d,.]+(?:\s*AED)?$', w['text'], re.IGNORECASE)]
-        if not numeric_tokens:
+        if not amount_words:
             return None
-        max_x0 = max(w['x0'] for w in numeric_tokens)
+        max_x0 = max(w['x0'] for w in amount_words)
         # set a band to capture the rightmost column
         return max(0.0, max_x0 - 0.2), 1.0
 
@@ -261,35 +746,38 @@ def extract_amounts_layout(page: dict) -> tuple[str, str, str]:
         left, right = amount_bounds
         return left <= w['x0'] <= right
 
+    # Candidate pools: tokens inside the detected money columns first, then the
+    # wider header/right-band region for values that sit outside any column
+    bounded_words = [w for w in amount_words if in_amount_column(w)]
+    column_words = [w for w in bounded_words if layout.in_amount_column(w)]
+    candidate_pools = [column_words, bounded_words] if len(column_words) < len(bounded_words) else [bounded_words]
+
     def nearest_right_amount(anchor, max_dx=0.6, y_tol=0.02):
         ax1 = anchor['x1']
         ay = anchor['yc']
-        candidates = []
-        for w in words:
-            # right side and similar y, constrained to amount column if known
-            if w['x0'] >= ax1 and abs(w['yc'] - ay) <= y_tol and (w['x0'] - ax1) <= max_dx and in_amount_column(w):
-                if is_amount_token(w['text']):
-                    val = parse_amount_token(w['text'])
+        for pool in candidate_pools:
+            candidates = []
+            for w in pool:
+                # right side and similar y
+                if w['x0'] >= ax1 and abs(w['yc'] - ay) <= y_tol and (w['x0'] - ax1) <= max_dx:
+                    val = w['amount']
                     if val is not None:
                         candidates.append((w['x0'], val))
-        if not candidates:
-            return None
-        # choose the rightmost (largest x0)
-        candidates.sort(key=lambda t: t[0], reverse=True)
-        return candidates[0][1]
-
-    def find_anchor(predicate):
-        for w in words:
-            if predicate(w['text']):
-                return w
+            if candidates:
+                # choose the rightmost (largest x0)
+                candidates.sort(key=lambda t: t[0], reverse=True)
+                return candidates[0][1]
         return None
 
     # Anchors
-    subtotal_anchor = find_anchor(lambda t: any(k in text_upper(t) for k in ['SUBTOTAL','SUB-TOTAL','AMOUNT BEFORE TAX','BEFORE VAT']))
-    total_anchor = find_anchor(lambda t: any(k in text_upper(t) for k in ['GRAND TOTAL','TOTAL AMOUNT','AMOUNT PAYABLE','NET PAYABLE','INVOICE TOTAL']))
+    subtotal_anchor = layout.first(rules.keywords['subtotal'])
+    total_anchor = layout.first(rules.keywords['layout_total'])
     if total_anchor is None:
-        # fallback to a plain TOTAL that is not quantity related
-        total_anchor = find_anchor(lambda t: 'TOTAL' in text_upper(t) and all(q not in text_upper(t) for q in ['QTY','QUANTITY','PCS']))
+        # fallback to a plain TOTAL that is not quantity related, also where OCR ran it into
+        # the next word ('TOTALAED'), hence the substring scan
+        total_exclude = rules.keywords['layout_total_exclude']
+        total_anchor = layout.first(['TOTAL'], lambda w: all(q not in text_upper(w['text']) for q in total_exclude),
+                                    substring=True)
 
     subtotal_val = nearest_right_amount(subtotal_anchor) if subtotal_anchor else None
     total_val = nearest_right_amount(total_anchor) if total_anchor else None
@@ -299,39 +787,40 @@ def extract_amounts_layout(page: dict) -> tuple[str, str, str]:
             return None
         ax1 = anchor['x1']
         ay = anchor['yc']
-        candidates = []
-        for w in words:
-            if w['x0'] >= ax1 and abs(w['yc'] - ay) <= y_tol and (w['x0'] - ax1) <= max_dx and in_amount_column(w):
-                if '%' in w['text']:
-                    continue
-                if is_amount_token(w['text']):
-                    val = parse_amount_token(w['text'])
-                    if val is not None:
-                        candidates.append((abs(w['yc'] - ay), w['x0'], val))
-        if not candidates:
-            # Try a small vertical window below the anchor (same column region)
-            for w in words:
-                if w['x0'] >= ax1 and (0 < (w['yc'] - ay) <= 0.06) and (w['x0'] - ax1) <= max_dx and in_amount_column(w):
+        for pool in candidate_pools:
+            candidates = []
+            for w in pool:
+                if w['x0'] >= ax1 and abs(w['yc'] - ay) <= y_tol and (w['x0'] - ax1) <= max_dx:
                     if '%' in w['text']:
                         continue
-                    if is_amount_token(w['text']):
-                        val = parse_amount_token(w['text'])
+                    val = w['amount']
+                    if val is not None:
+                        candidates.append((abs(w['yc'] - ay), w['x0'], val))
+            if not candidates:
+                # Try a small vertical window below the anchor (same column region)
+                for w in pool:
+                    if w['x0'] >= ax1 and (0 < (w['yc'] - ay) <= 0.06) and (w['x0'] - ax1) <= max_dx:
+                        if '%' in w['text']:
+                            continue
+                        val = w['amount']
                         if val is not None:
                             candidates.append((abs(w['yc'] - ay), w['x0'], val))
-            if not candidates:
-                return None
-        # Pick closest by vertical distance, then rightmost by x
-        candidates.sort(key=lambda t: (t[0], -t[1]))
-        return candidates[0][2]
+            if candidates:
+                # Pick closest by vertical distance, then rightmost by x
+                candidates.sort(key=lambda t: (t[0], -t[1]))
+                return candidates[0][2]
+        return None
 
     # Consider all VAT anchors; choose the one nearest to totals region and with a valid amount to the right
     def all_vat_anchors():
-        bad_terms = ['TRN', 'REG', 'REGISTRATION', 'INCLUSIVE']
-        for w in words:
+        bad_terms = rules.keywords['vat_exclude']
+        for pos in layout.lookup('VAT'):
+            w = words[pos]
             u = text_upper(w['text'])
-            if 'VAT' in u and not any(bt in u for bt in bad_terms):
+            if not any(bt in u for bt in bad_terms):
                 yield w
 
+    vat_ratio = rules.thresholds['vat_to_total_ratio']
     candidate_vats = []
     for va in all_vat_anchors():
         vv = nearest_right_vat(va)
@@ -342,7 +831,7 @@ def extract_amounts_layout(page: dict) -> tuple[str, str, str]:
             else:
                 dist_to_total = 1.0 - va['yc']
             # Filter implausible VATs: VAT should be a small fraction of total (e.g., <= 30%)
-            if total_val is not None and vv > 0.3 * total_val:
+            if total_val is not None and vv > vat_ratio * total_val:
                 continue
             candidate_vats.append((dist_to_total, va['yc'], vv))
     vat_val = None
@@ -356,10 +845,11 @@ def extract_amounts_layout(page: dict) -> tuple[str, str, str]:
 
     return fmt(subtotal_val), fmt(vat_val), fmt(total_val)
 
-def extract_amount_before_tax(lines, vat_amount_str: str, total_amount_str: str):
+def extract_amount_before_tax(lines, vat_amount_str: str, total_amount_str: str, rules=None):
     """Estimate subtotal using VAT and Total when possible; fallback to heuristics.
     Avoid confusing quantities with amounts by preferring lines containing currency hints.
     """
+    rules = rules or get_rules()
     total_val = parse_number(total_amount_str) if total_amount_str else None
     vat_val = parse_number(vat_amount_str) if vat_amount_str else None
 
@@ -373,7 +863,7 @@ def extract_amount_before_tax(lines, vat_amount_str: str, total_amount_str: str)
     # Heuristic fallback: find a line that looks like subtotal/sub-total
     for line in lines:
         u = line.upper()
-        if any(k in u for k in ['SUBTOTAL', 'SUB-TOTAL', 'AMOUNT BEFORE TAX', 'BEFORE VAT']):
+        if any(k in u for k in rules.keywords['subtotal']):
             nums = re.findall(r'AED\s*[\d,.]+|[\d,.]+', line)
             if nums:
                 val = parse_number(nums[-1])
@@ -396,10 +886,13 @@ def extract_amount_before_tax(lines, vat_amount_str: str, total_amount_str: str)
 
     return "Not Found"
 
-def extract_vat_amount(lines):
+def extract_vat_amount(lines, rules=None):
     """
     Extract VAT amount by looking for values exactly in front of or below "VAT 5%" patterns
     """
+    rules = rules or get_rules()
+    vat_ratio = rules.thresholds['vat_to_total_ratio']
+    currency_amount = rules.currency + r'\s*([\d,.]+)'
     def safe_float(num_str):
         try:
             return float(num_str.replace(',', ''))
@@ -412,8 +905,8 @@ def extract_vat_amount(lines):
     total_guess = None
     for line in lines:
         u = line.upper()
-        if any(k in u for k in ['GRAND TOTAL', 'TOTAL AMOUNT', 'AMOUNT PAYABLE', 'INVOICE TOTAL']):
-            m = re.search(r'(?:AED|DHS|DIRHAM)\s*([\d,.]+)', line)
+        if any(k in u for k in rules.keywords['vat_total_hint']):
+            m = re.search(currency_amount, line)
             if m:
                 total_guess = parse_number(m.group(1))
                 break
@@ -423,13 +916,13 @@ def extract_vat_amount(lines):
                 break
     for i, line in enumerate(lines):
         u = line.upper()
-        if 'VAT' in u and not any(x in u for x in ['TRN', 'REG', 'REGISTRATION', 'INCLUSIVE']):
+        if 'VAT' in u and not any(x in u for x in rules.keywords['vat_exclude']):
             last_vat_line_idx = i
             # 1) AED-marked amount on same line
-            aed_match = re.search(r'(?:AED|DHS|DIRHAM)\s*([\d,.]+)', line, flags=re.IGNORECASE)
+            aed_match = re.search(currency_amount, line, flags=re.IGNORECASE)
             if aed_match:
                 cand = parse_number(aed_match.group(1))
-                if cand is not None and (total_guess is None or cand <= 0.3 * total_guess):
+                if cand is not None and (total_guess is None or cand <= vat_ratio * total_guess):
                     vat_value = aed_match.group(1)
                     continue
             # 2) Non-percent numeric on same line
@@ -438,7 +931,7 @@ def extract_vat_amount(lines):
                 # choose last number but ensure plausible vs total
                 for c in reversed(candidates):
                     cand = parse_number(c)
-                    if cand is not None and (total_guess is None or cand <= 0.3 * total_guess):
+                    if cand is not None and (total_guess is None or cand <= vat_ratio * total_guess):
                         vat_value = c
                         break
                 if vat_value is not None:
@@ -446,17 +939,17 @@ def extract_vat_amount(lines):
             # 3) Look down 1-3 lines for amount (skip percent)
             for j in range(i+1, min(i+4, len(lines))):
                 next_line = lines[j].strip()
-                aed_match = re.search(r'(?:AED|DHS|DIRHAM)\s*([\d,.]+)', next_line, flags=re.IGNORECASE)
+                aed_match = re.search(currency_amount, next_line, flags=re.IGNORECASE)
                 if aed_match:
                     cand = parse_number(aed_match.group(1))
-                    if cand is not None and (total_guess is None or cand <= 0.3 * total_guess):
+                    if cand is not None and (total_guess is None or cand <= vat_ratio * total_guess):
                         vat_value = aed_match.group(1)
                         break
                 candidates = re.findall(r'(?<!\d)(\d{1,3}(?:,\d{3})*(?:\.\d{1,2})?)(?!\s*%)', next_line)
                 if candidates:
                     for c in reversed(candidates):
                         cand = parse_number(c)
-                        if cand is not None and (total_guess is None or cand <= 0.3 * total_guess):
+                        if cand is not None and (total_guess is None or cand <= vat_ratio * total_guess):
                             vat_value = c
                             break
                     if vat_value is not None:
@@ -466,7 +959,7 @@ def extract_vat_amount(lines):
     
     return "Not Found"
 
-def extract_total_amount(lines):
+def extract_total_amount(lines, rules=None):
     """Extract the final total amount payable, avoiding intermediate amounts and quantities.
     
     Priority order:
@@ -474,17 +967,17 @@ def extract_total_amount(lines):
     2) Lines with 'TOTAL' and currency, but only if they appear to be final totals
     3) The largest monetary value that appears to be a final amount (not subtotal, not VAT-related)
     """
+    rules = rules or get_rules()
     # Keywords that indicate final total amounts
-    final_total_keywords = [
-        'GRAND TOTAL', 'NET PAYABLE', 'NET AMOUNT', 'AMOUNT PAYABLE', 'TOTAL AMOUNT',
-        'AMOUNT DUE', 'BALANCE DUE', 'INVOICE TOTAL', 'FINAL TOTAL', 'TOTAL PAYABLE'
-    ]
+    final_total_keywords = rules.keywords['final_total']
     
     # Keywords that indicate intermediate amounts (avoid these)
-    intermediate_keywords = ['SUBTOTAL', 'SUB-TOTAL', 'BEFORE VAT', 'BEFORE TAX', 'EXCLUDING VAT']
+    intermediate_keywords = rules.keywords['intermediate']
     
     # Keywords that indicate quantities (avoid these)
-    quantity_keywords = ['QTY', 'QUANTITY', 'PCS', 'PIECES', 'ITEMS', 'TOTAL QTY', 'TOTAL PCS']
+    quantity_keywords = rules.keywords['quantity']
+    currency_keywords = rules.keywords['currency']
+    min_plain_total = rules.thresholds['min_plain_total']
     
     def is_intermediate_amount(line: str) -> bool:
         """Check if line contains intermediate amount indicators"""
@@ -502,8 +995,8 @@ def extract_total_amount(lines):
         
         # First priority: currency-marked values (AED, DHS, DIRHAM)
         currency_patterns = [
-            r'(?:AED|DHS|DIRHAM)\s*([\d,]+\.?\d*)',
-            r'([\d,]+\.?\d*)\s*(?:AED|DHS|DIRHAM)'
+            rules.currency + r'\s*([\d,]+\.?\d*)',
+            r'([\d,]+\.?\d*)\s*' + rules.currency
         ]
         
         for pattern in currency_patterns:
@@ -519,7 +1012,7 @@ def extract_total_amount(lines):
             number_matches = re.findall(r'\b(\d{1,3}(?:,\d{3})*(?:\.\d{1,2})?)\b', line)
             for match in number_matches:
                 val = parse_number(match)
-                if val is not None and val > 10:  # Filter out very small numbers
+                if val is not None and val > min_plain_total:  # Filter out very small numbers
                     values.append(val)
         
         return values
@@ -540,7 +1033,7 @@ def extract_total_amount(lines):
             not is_intermediate_amount(line) and 
             not is_quantity_line(line) and 
             'IN WORDS' not in u and
-            ('AED' in u or 'DHS' in u or 'DIRHAM' in u)):
+            any(c in u for c in currency_keywords)):
             
             values = extract_monetary_values(line)
             if values:
@@ -570,6 +1063,123 @@ def extract_total_amount(lines):
     
     return "Not Found"
 
+def group_rows(words: list[dict]) -> list[list[dict]]:
+    """Cluster words into visual rows by vertical centre; each row sorted left to right."""
+    if not words:
+        return []
+    ys = np.array([w['yc'] for w in words])
+    heights = np.array([w['y1'] - w['y0'] for w in words])
+    order = np.argsort(ys, kind='stable')
+    # A new row starts where the gap between consecutive centres exceeds half a word height
+    tol = max(float(np.median(heights)) * 0.5, 0.002)
+    row_ids = np.concatenate(([0], np.cumsum(np.diff(ys[order]) > tol)))
+    rows = [[] for _ in range(int(row_ids[-1]) + 1)]
+    for pos, row_id in zip(order, row_ids):
+        rows[row_id].append(words[pos])
+    return [sorted(row, key=lambda w: w['x0']) for row in rows]
+
+def extract_line_items(layout, rules=None) -> list[dict]:
+    """Recover line items from a page: ruled table cells when present, else word geometry.
+
+    Rows come from the grid structure or from clustering word centres
+    vertically. The header row (one with quantity, rate and amount headings)
+    fixes a centre per column, and each word/cell below it goes to the column
+    whose centre is nearest. Rows without numbers continue the previous item's
+    description. Stops at the first summary row.
+    """
+    rules = rules or get_rules()
+    for table in layout.page.get('grid_tables', []):
+        cell_rows = [[cell_word(cell) for cell in row if cell['value']] for row in table['rows']]
+        items = items_from_rows([row for row in cell_rows if row], rules)
+        if items:
+            return items
+    return items_from_rows(group_rows(layout.words), rules)
+
+def cell_word(cell: dict) -> dict:
+    """Ruled-table cell in the word dict shape used by PageLayout."""
+    (x0, y0), (x1, y1) = cell['geometry']
+    return {'text': cell['value'], 'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1, 'yc': (y0 + y1) / 2.0}
+
+def items_from_rows(rows: list[list[dict]], rules) -> list[dict]:
+    """Map rows of words (left to right) under a table header to line items."""
+    k = rules.keywords
+    header_terms = [
+        ('Quantity', k['item_quantity_header']),
+        ('Rate', k['item_rate_header']),
+        ('Amount', k['item_amount_header']),
+        ('Description', k['item_description_header']),
+    ]
+    header_idx, centres = None, {}
+    for i, row in enumerate(rows):
+        found = {}
+        for w in row:
+            u = w['text'].upper()
+            for field, terms in header_terms:
+                if field not in found and any(t in u for t in terms):
+                    found[field] = (w['x0'] + w['x1']) / 2.0
+                    break
+        if all(f in found for f in ('Quantity', 'Rate', 'Amount')):
+            header_idx, centres = i, found
+            break
+    if header_idx is None:
+        return []
+
+    fields = sorted(centres, key=centres.get)
+    xs = np.array([centres[f] for f in fields])
+    boundaries = (xs[:-1] + xs[1:]) / 2.0
+
+    items = []
+    for row in rows[header_idx + 1:]:
+        text = ' '.join(w['text'] for w in row).upper()
+        if any(t in text for t in k['item_table_end']):
+            break
+        row_xc = np.array([(w['x0'] + w['x1']) / 2.0 for w in row])
+        cells = {f: [] for f in fields}
+        for w, col in zip(row, np.searchsorted(boundaries, row_xc)):
+            field = fields[col]
+            # Without a description column, text that isn't a number is description
+            if 'Description' not in centres and not is_amount_token(w['text']):
+                field = 'Description'
+            cells.setdefault(field, []).append(w['text'])
+        values = {}
+        for field in ('Quantity', 'Rate', 'Amount'):
+            numbers = [parse_amount_token(t) for t in cells.get(field, []) if re.search(r'\d', t)]
+            numbers = [n for n in numbers if n is not None]
+            values[field] = numbers[-1] if numbers else None
+        description = ' '.join(cells.get('Description', []))
+        if all(v is None for v in values.values()):
+            if description and items:
+                items[-1]['Description'] = f"{items[-1]['Description']} {description}".strip()
+            continue
+        items.append({
+            'Quantity': values['Quantity'],
+            'Description': description,
+            'Rate': values['Rate'],
+            'Amount': values['Amount'],
+        })
+    return items
+
+def extract_items(layouts: list, rows: list[dict]) -> pd.DataFrame:
+    """Line items for every page, with a vectorized ``qty * rate ~= amount`` check.
+
+    ``rows`` may be per-page rows or per-invoice rows (with a ``Pages`` list).
+    """
+    rules = get_rules()
+    page_invoice = {}
+    for row in rows:
+        for page_no in row.get('Pages', [row.get('Page')]):
+            page_invoice[page_no] = row.get('Invoice Number', '')
+    items = []
+    for page_no, layout in enumerate(layouts, start=1):
+        invoice_number = page_invoice.get(page_no, '')
+        for item in extract_line_items(layout, rules):
+            items.append({'Invoice Number': invoice_number, 'Page': page_no, **item})
+    df = pd.DataFrame(items, columns=ITEM_TABLE_COLUMNS)
+    for col in ('Quantity', 'Rate', 'Amount'):
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df['Valid'] = np.isclose(df['Quantity'] * df['Rate'], df['Amount'], rtol=1e-3, atol=0.05)
+    return df
+
 def save_to_excel(results):
     """Save results to Excel file"""
     try:
@@ -619,56 +1229,22 @@ def save_to_word(results):
         print(f"Error saving Word file: {e}")
         return None
 
-def save_table_to_excel(rows: list[dict]):
-    """Save a list of row dicts to Excel as a table (one invoice per row)."""
-    try:
-        if not rows:
-            return None
-        columns = ['Page', 'Company Name', 'Invoice Number', 'Date', 'Seller TRN', 'Buyer TRN', 'VAT Amount', 'Total Amount']
-        # Ensure all keys exist
-        normalized = [{col: row.get(col, '') for col in columns} for row in rows]
-        df = pd.DataFrame(normalized, columns=columns)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"multi_invoice_table_{timestamp}.xlsx"
-        filepath = os.path.join(OUTPUT_FOLDER, filename)
-        df.to_excel(filepath, index=False)
-        print(f"Excel file saved: {filepath}")
-        return filename
-    except Exception as e:
-        print(f"Error saving table to Excel: {e}")
-        return None
-
-def save_table_to_word(rows: list[dict]):
-    """Save a list of row dicts to Word as a table."""
-    try:
-        if not rows:
-            return None
-        columns = ['Page', 'Company Name', 'Invoice Number', 'Date', 'Seller TRN', 'Buyer TRN', 'VAT Amount', 'Total Amount']
-        doc = Document()
-        doc.add_heading('Multi-Invoice Extraction Results', 0)
-        doc.add_paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        table = doc.add_table(rows=1, cols=len(columns))
-        table.style = 'Table Grid'
-        for i, col in enumerate(columns):
-            table.rows[0].cells[i].text = col
-        for row in rows:
-            tr = table.add_row().cells
-            for i, col in enumerate(columns):
-                tr[i].text = str(row.get(col, ''))
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"multi_invoice_table_{timestamp}.docx"
-        filepath = os.path.join(OUTPUT_FOLDER, filename)
-        doc.save(filepath)
-        print(f"Word file saved: {filepath}")
-        return filename
-    except Exception as e:
-        print(f"Error saving table to Word: {e}")
-        return None
-
 if __name__ == "__main__":
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Extract invoice data to Excel/Word and columnar formats")
+    parser.add_argument('--input', default=PDF_PATH, help="invoice file, or - to read the document from stdin")
+    parser.add_argument('--filename', default=None, help="original file name of a document read from stdin")
+    parser.add_argument('--formats', default=None, help="comma-separated outputs: xlsx,docx,parquet,csv,jsonl")
+    parser.add_argument('--job-id', default=None,
+                        help="id of the job folder to write to; without --formats no exports are written up front")
+    args = parser.parse_args()
     print("Starting invoice processing...")
-    success = process_invoice()
-    if success:
-        print("✅ Invoice processing completed successfully!")
+    source = sys.stdin.buffer.read() if args.input == '-' else args.input
+    formats = args.formats if args.formats or not args.job_id else []
+    result = process_invoice(source, formats=formats, job_id=args.job_id, filename=args.filename)
+    if result:
+        print(f"✅ Invoice processing completed successfully! Job {result['job_id']}: {result['folder']}")
     else:
         print("❌ Invoice processing failed!")
+        sys.exit(1)
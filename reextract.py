@@ -0,0 +1,141 @@
+"""
+Re-run field extraction over cached OCR exports without loading the OCR model.
+
+Every document processed by ocr_to_word_excel_fixed.process_invoice leaves its
+doctr export in the OCR cache folder. After changing an extraction heuristic,
+run this script to regenerate the Excel/Word outputs for the whole archive:
+
+    python reextract.py
+    python reextract.py --workers 8 --output extracted_data/reextracted
+
+The new rows also replace what the API serves for every upload of the same
+document (matched by content hash): the job's stored result is rewritten, so
+downloads render from it (exports written up front are removed), and the
+upload's ``invoices`` rows and indexed pages are stored again. Uploads made
+before content hashes were recorded are not matched; --no-update writes the
+output files only.
+
+Learned vendor templates are bypassed by default, so every field comes from
+the current heuristics and a heuristic fix reaches the whole archive; pass
+--templates to read (and keep learning) them as uploads do.
+"""
+
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import config
+import db
+import invoice_store
+from exports import job_dir, result_path, save_result
+from ocr_to_word_excel_fixed import (
+    OCR_CACHE_FOLDER,
+    OUTPUT_FOLDER,
+    build_layouts,
+    extract_invoices,
+    extract_items,
+    load_ocr_export,
+    page_texts_from_export,
+    write_outputs,
+)
+from report_writers import parse_formats
+
+
+def reextract_document(cache_path: str, output_folder: str, formats: list[str],
+                       use_templates: bool = False) -> dict:
+    """Replay the extraction stage for one cached export and rewrite its outputs.
+
+    Returns ``{'cache_path', 'sha256', 'rows', 'items', 'page_texts'}`` for update_uploads.
+    """
+    record = load_ocr_export(cache_path)
+    layouts = build_layouts(record['export'])
+    rows = extract_invoices(record['export'], layouts, use_templates)
+    items = extract_items(layouts, rows)
+    stem = os.path.splitext(record.get('source') or 'document')[0]
+    write_outputs(rows, items, formats, f"{stem}_{record['sha256'][:12]}", output_folder)
+    return {'cache_path': cache_path, 'sha256': record['sha256'], 'rows': rows, 'items': items,
+            'page_texts': page_texts_from_export(record['export'])}
+
+
+def update_uploads(conn, document: dict, jobs_folder: str = config.JOBS_FOLDER) -> int:
+    """Store a re-extracted document for every upload of it (committed per upload); returns the uploads updated."""
+    uploads = conn.execute(
+        "SELECT id, username, job_id FROM uploads WHERE content_hash = ? AND job_id IS NOT NULL "
+        "AND status = 'completed' ORDER BY id", (document['sha256'],)
+    ).fetchall()
+    updated = 0
+    for upload_id, username, job_id in uploads:
+        if not os.path.exists(result_path(job_id, jobs_folder)):
+            continue
+        save_result(job_id, document['rows'], document['items'], jobs_folder)
+        # Exports written up front would be served instead of one rendered from the new result
+        folder = job_dir(job_id, jobs_folder)
+        for name in os.listdir(folder):
+            if name != os.path.basename(result_path(job_id, jobs_folder)):
+                os.remove(os.path.join(folder, name))
+        conn.execute("DELETE FROM invoices WHERE upload_id = ?", (upload_id,))
+        if db.has_table(conn, 'page_search'):
+            conn.execute("DELETE FROM page_search WHERE upload_id = ?", (upload_id,))
+        invoice_store.store_result(conn, upload_id, username, {
+            'job_id': job_id, 'rows': document['rows'], 'page_texts': document['page_texts'],
+            'content_hash': document['sha256'],
+        })
+        conn.commit()
+        updated += 1
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-extract invoice fields from cached OCR exports")
+    parser.add_argument('--cache', default=OCR_CACHE_FOLDER, help="folder containing cached OCR exports")
+    parser.add_argument('--output', default=os.path.join(OUTPUT_FOLDER, 'reextracted'), help="folder for regenerated outputs")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument('--formats', default=None, help="comma-separated outputs: xlsx,docx,parquet,csv,jsonl")
+    parser.add_argument('--templates', action='store_true', help="use learned vendor templates (default: heuristics only)")
+    parser.add_argument('--no-update', action='store_true',
+                        help="only write output files; leave stored job results and the database as they are")
+    parser.add_argument('--db', default=config.DATABASE_FILE, help="SQLite database of the API servers")
+    parser.add_argument('--jobs', default=config.JOBS_FOLDER, help="folder containing job results")
+    args = parser.parse_args()
+    formats = parse_formats(args.formats)
+
+    cache_files = sorted(glob.glob(os.path.join(args.cache, '*.json.gz')))
+    if not cache_files:
+        print(f"No cached OCR exports found in {args.cache}")
+        return
+    os.makedirs(args.output, exist_ok=True)
+
+    print(f"Re-extracting {len(cache_files)} documents with {args.workers} workers...")
+    done = failed = uploads = 0
+    conn = None
+    if not args.no_update:
+        db.migrate(args.db)
+        conn = db.connect(args.db)
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(reextract_document, path, args.output, formats, args.templates)
+                       for path in cache_files]
+            for future in as_completed(futures):
+                try:
+                    document = future.result()
+                    updated = update_uploads(conn, document, args.jobs) if conn is not None else 0
+                    done += 1
+                    uploads += updated
+                    print(f"✓ {os.path.basename(document['cache_path'])}: {len(document['rows'])} rows, "
+                          f"{updated} uploads updated")
+                except Exception as e:
+                    if conn is not None:
+                        conn.rollback()
+                    failed += 1
+                    print(f"✗ Re-extraction failed: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+    print(f"\nRe-extraction complete! {done} documents processed, {failed} failed, {uploads} uploads updated.")
+    print(f"Files saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
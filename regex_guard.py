@@ -0,0 +1,399 @@
+"""
+Load-time guard for user-supplied regex patterns.
+
+Patterns from config.CUSTOM_PATTERNS, the rules file and
+InvoiceDataExtractor.patterns run over the whole joined OCR text, so a pattern
+that backtracks badly can stall a worker. Every pattern is checked with the
+stdlib regex parser before use:
+
+* nested unbounded quantifiers such as ``(\\d+)+`` (exponential backtracking);
+* unbounded quantifiers over overlapping characters with only optional items
+  between them, such as ``[\\d,]+\\.?\\d*`` or ``\\s*:?\\s*`` (polynomial);
+* alternatives under an unbounded quantifier that can start on the same
+  character, such as ``(a|a)*`` or ``(?:\\d|\\d)*`` (exponential).
+
+Optional-separator chains like ``A+ x? B* y? B*`` (B a subset of A) are
+rewritten to the equivalent ``A+ (?:x B*)? (?:y B*)?``, which matches the same
+text without ambiguity, and a pattern opening with ``A+`` only starts matching
+at the beginning of a run of A. A pattern that is still flagged is compiled with the
+linear-time ``re2`` engine when it is installed and allowed, otherwise it is
+rejected with a warning. search_first() adds a per-field time budget on top:
+it is checked between patterns and, when matching runs in the main thread on
+Unix (the CLI and the extraction worker process), also interrupts a pattern
+that is still running when the budget runs out.
+"""
+
+import re
+import signal
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+from functools import lru_cache
+
+# The stdlib regex parser is private; without it patterns cannot be analyzed
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            import sre_parse
+    except ImportError:
+        sre_parse = None
+HAS_SRE_PARSE = sre_parse is not None
+
+import config
+
+# Try to import RE2 for linear-time matching
+try:
+    import re2
+    HAS_RE2 = True
+except ImportError:
+    HAS_RE2 = False
+
+# Character sets are approximated over ASCII code points plus one slot per
+# class of non-ASCII characters (digits, spaces, letters, everything else)
+OTHER_DIGIT, OTHER_SPACE, OTHER_WORD, OTHER = 128, 129, 130, 131
+ALPHABET = frozenset(range(132))
+NON_ASCII = {OTHER_DIGIT, OTHER_SPACE, OTHER_WORD, OTHER}
+# Stands for "matches the empty string" in first-character sets
+EMPTY = -1
+
+if HAS_SRE_PARSE:
+    CATEGORY_CHARS = {
+        sre_parse.CATEGORY_DIGIT: set(range(48, 58)) | {OTHER_DIGIT},
+        sre_parse.CATEGORY_SPACE: {9, 10, 11, 12, 13, 32, OTHER_SPACE},
+        sre_parse.CATEGORY_WORD: set(range(48, 58)) | set(range(65, 91)) | set(range(97, 123)) | {95, OTHER_DIGIT, OTHER_WORD},
+    }
+    CATEGORY_CHARS[sre_parse.CATEGORY_NOT_DIGIT] = ALPHABET - CATEGORY_CHARS[sre_parse.CATEGORY_DIGIT]
+    CATEGORY_CHARS[sre_parse.CATEGORY_NOT_SPACE] = ALPHABET - CATEGORY_CHARS[sre_parse.CATEGORY_SPACE]
+    CATEGORY_CHARS[sre_parse.CATEGORY_NOT_WORD] = ALPHABET - CATEGORY_CHARS[sre_parse.CATEGORY_WORD]
+
+    SINGLE_CHAR_OPS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY, sre_parse.IN)
+    REPEAT_OPS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT)
+    if hasattr(sre_parse, 'POSSESSIVE_REPEAT'):
+        REPEAT_OPS += (sre_parse.POSSESSIVE_REPEAT,)
+
+# Chain "A+ x? B* y? C* ..." written with single-character atoms
+ATOM = r'(?:\\[dswDSW]|\[(?:\\.|[^\]\\])+\]|\.)'
+OPTIONAL_CHAR = r'(?:\\.|[^\\\[\]().*+?{}|^$])'
+CHAIN_PATTERN = re.compile(rf'({ATOM})([+*])((?:{OPTIONAL_CHAR}\?{ATOM}\*)+)')
+CHAIN_UNIT_PATTERN = re.compile(rf'({OPTIONAL_CHAR})\?({ATOM})\*')
+# Pattern opening with "A+" (possibly inside groups), after any global flags
+LEADING_RUN_PATTERN = re.compile(rf'^((?:\(\?[aiLmsux]+\))?(?:\((?:\?:)?)*)({ATOM})\+')
+
+
+def char_codes(c: int, ignorecase: bool) -> set[int]:
+    codes = {c if c < OTHER_DIGIT else OTHER}
+    if ignorecase and c < OTHER_DIGIT:
+        codes.add(ord(chr(c).swapcase()))
+    return codes
+
+
+def char_set(item, ignorecase: bool = False) -> set[int] | None:
+    """Characters a single-character item can match, or None for other items."""
+    op, av = item
+    if op == sre_parse.LITERAL:
+        return char_codes(av, ignorecase)
+    if op == sre_parse.NOT_LITERAL:
+        return ALPHABET - char_codes(av, ignorecase) | {OTHER}
+    if op == sre_parse.ANY:
+        return set(ALPHABET)
+    if op != sre_parse.IN:
+        return None
+    chars, negate = set(), False
+    for sub_op, sub_av in av:
+        if sub_op == sre_parse.NEGATE:
+            negate = True
+        elif sub_op == sre_parse.LITERAL:
+            chars |= char_codes(sub_av, ignorecase)
+        elif sub_op == sre_parse.RANGE:
+            lo, hi = sub_av
+            for c in range(lo, min(hi, OTHER - 1) + 1):
+                chars |= char_codes(c, ignorecase)
+            if hi >= OTHER_DIGIT:
+                chars |= NON_ASCII
+        elif sub_op == sre_parse.CATEGORY:
+            chars |= CATEGORY_CHARS.get(sub_av, {OTHER})
+        else:
+            chars.add(OTHER)
+    return ALPHABET - chars | {OTHER} if negate else chars
+
+
+def repeat_parts(item):
+    """(min, max, body) for a repeat item, else None."""
+    op, av = item
+    if op in REPEAT_OPS:
+        return av
+    return None
+
+
+def single_char_repeat(item, ignorecase: bool):
+    """(min, max, chars) for a repeat of one single-character item, else None."""
+    parts = repeat_parts(item)
+    if parts is None:
+        return None
+    lo, hi, body = parts
+    if len(body) != 1 or body[0][0] not in SINGLE_CHAR_OPS:
+        return None
+    return lo, hi, char_set(body[0], ignorecase)
+
+
+def sub_sequences(item) -> list:
+    """Nested item sequences of a group, branch or repeat."""
+    op, av = item
+    if op == sre_parse.SUBPATTERN:
+        return [av[-1]]
+    if op == sre_parse.BRANCH:
+        return list(av[1])
+    if op in REPEAT_OPS:
+        return [av[2]]
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return [av[1]]
+    if op == getattr(sre_parse, 'ATOMIC_GROUP', None):
+        return [av]
+    return []
+
+
+def nullable(item) -> bool:
+    """Whether an item can match the empty string."""
+    op, av = item
+    if op in REPEAT_OPS:
+        return av[0] == 0 or all(nullable(i) for i in av[2])
+    if op == sre_parse.SUBPATTERN:
+        return all(nullable(i) for i in av[-1])
+    if op == sre_parse.BRANCH:
+        return any(all(nullable(i) for i in branch) for branch in av[1])
+    return op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT)
+
+
+def leading_repeats(seq, ignorecase: bool) -> list[set[int]]:
+    """Character sets of unbounded single-character repeats that can start a sequence."""
+    found = []
+    for item in seq:
+        rep = single_char_repeat(item, ignorecase)
+        if rep is not None:
+            if rep[1] == sre_parse.MAXREPEAT:
+                found.append(rep[2])
+        else:
+            for sub in sub_sequences(item):
+                found.extend(leading_repeats(sub, ignorecase))
+        if not nullable(item):
+            break
+    return found
+
+
+def first_chars(seq, ignorecase: bool) -> set[int]:
+    """Characters that can start a match of a sequence (EMPTY if it can match nothing)."""
+    chars = set()
+    for item in seq:
+        op = item[0]
+        if op in SINGLE_CHAR_OPS:
+            chars |= char_set(item, ignorecase)
+        elif op not in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            for sub in sub_sequences(item):
+                chars |= first_chars(sub, ignorecase) - {EMPTY}
+        if not nullable(item):
+            return chars
+    return chars | {EMPTY}
+
+
+def ambiguous_branches(seq, ignorecase: bool, follow: set[int]) -> bool:
+    """Whether a branch in ``seq`` has two alternatives that can start on the same character.
+
+    ``follow`` is what can come after ``seq``; an alternative matching the
+    empty string "starts" with it. Under an unbounded repeat such a branch
+    lets the engine split one run of text in exponentially many ways.
+    """
+    for i, item in enumerate(seq):
+        after = first_chars(seq[i + 1:], ignorecase)
+        if EMPTY in after:
+            after = after - {EMPTY} | follow
+        if item[0] == sre_parse.BRANCH:
+            starts = []
+            for branch in item[1][1]:
+                chars = first_chars(branch, ignorecase)
+                starts.append(chars | after if EMPTY in chars else chars)
+            if any(a & b for n, a in enumerate(starts) for b in starts[n + 1:]):
+                return True
+        if item[0] not in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if any(ambiguous_branches(sub, ignorecase, after) for sub in sub_sequences(item)):
+                return True
+    return False
+
+
+def contains_unbounded(seq) -> bool:
+    for item in seq:
+        parts = repeat_parts(item)
+        if parts is not None and parts[1] == sre_parse.MAXREPEAT:
+            return True
+        if any(contains_unbounded(sub) for sub in sub_sequences(item)):
+            return True
+    return False
+
+
+def sequence_problems(seq, ignorecase: bool) -> list[str]:
+    problems = []
+    for i, item in enumerate(seq):
+        parts = repeat_parts(item)
+        if parts is not None and parts[1] > 1 and contains_unbounded(parts[2]):
+            problems.append("nested quantifier")
+        if parts is not None and parts[1] == sre_parse.MAXREPEAT:
+            # The next iteration can follow the body, so it counts as what comes after
+            again = first_chars(parts[2], ignorecase) | {EMPTY}
+            if ambiguous_branches(parts[2], ignorecase, again):
+                problems.append("overlapping alternation")
+        rep = single_char_repeat(item, ignorecase)
+        if rep is not None and rep[1] == sre_parse.MAXREPEAT:
+            # Walk forward over optional items looking for another unbounded
+            # repeat that can consume the same characters
+            for following in seq[i + 1:]:
+                nxt = single_char_repeat(following, ignorecase)
+                if nxt is not None:
+                    if nxt[2] & rep[2]:
+                        if nxt[1] == sre_parse.MAXREPEAT:
+                            problems.append("adjacent overlapping quantifiers")
+                            break
+                        continue
+                elif following[0] in SINGLE_CHAR_OPS:
+                    if char_set(following, ignorecase) & rep[2]:
+                        continue
+                elif any(chars & rep[2] for sub in sub_sequences(following)
+                         for chars in leading_repeats(sub, ignorecase)):
+                    problems.append("adjacent overlapping quantifiers")
+                    break
+                if not nullable(following):
+                    break
+        for sub in sub_sequences(item):
+            problems.extend(sequence_problems(sub, ignorecase))
+    return problems
+
+
+def analyze_pattern(pattern: str, flags: int = 0) -> list[str]:
+    """Backtracking hazards found in a pattern (empty when it looks linear)."""
+    parsed = sre_parse.parse(pattern, flags)
+    ignorecase = bool((flags | parsed.state.flags) & re.IGNORECASE)
+    return list(dict.fromkeys(sequence_problems(parsed.data, ignorecase)))
+
+
+def atom_chars(atom: str, flags: int) -> set[int]:
+    return char_set(sre_parse.parse(atom, flags).data[0], bool(flags & re.IGNORECASE))
+
+
+def rewrite_pattern(pattern: str, flags: int = 0) -> str:
+    """Rewrite optional-separator chains to their unambiguous equivalent."""
+    def rewrite_chain(m):
+        allowed = atom_chars(m.group(1), flags)
+        units = CHAIN_UNIT_PATTERN.findall(m.group(3))
+        out = []
+        for separator, atom in units:
+            chars = atom_chars(atom, flags)
+            # Only valid while each run is a subset of the one before it
+            if not chars <= allowed:
+                return m.group(0)
+            allowed = chars
+            out.append(f'(?:{separator}{atom}*)?')
+        return m.group(1) + m.group(2) + ''.join(out)
+    rewritten = CHAIN_PATTERN.sub(rewrite_chain, pattern)
+    # A match can only be leftmost at the start of a run of A, so searching
+    # need not retry from every position inside a long run (quadratic)
+    lead = LEADING_RUN_PATTERN.match(rewritten)
+    if lead and '|' not in rewritten:
+        rewritten = f'{lead.group(1)}(?<!{lead.group(2)}){rewritten[len(lead.group(1)):]}'
+    return rewritten
+
+
+@lru_cache(maxsize=1024)
+def guard_pattern(pattern: str, flags: int = 0, linear: bool = False):
+    """Compile a pattern after validation; returns None if it is rejected.
+
+    With ``linear`` (custom patterns), the pattern is compiled with RE2 when it
+    is installed and config.REGEX_USE_RE2 is set. Without the stdlib regex
+    parser patterns cannot be analyzed, and only RE2 compiles them.
+    """
+    if not HAS_SRE_PARSE:
+        if linear and HAS_RE2 and config.REGEX_USE_RE2:
+            try:
+                return re2.compile(('(?i)' if flags & re.IGNORECASE else '') + pattern)
+            except Exception:
+                pass
+        print(f"Rejected regex pattern {pattern!r}: cannot be checked without the re parser")
+        return None
+    try:
+        rewritten = rewrite_pattern(pattern, flags)
+        problems = analyze_pattern(rewritten, flags)
+    except re.error as e:
+        print(f"Rejected regex pattern {pattern!r}: {e}")
+        return None
+    if linear and HAS_RE2 and config.REGEX_USE_RE2:
+        try:
+            return re2.compile(('(?i)' if flags & re.IGNORECASE else '') + rewritten)
+        except Exception:
+            pass  # Uses a construct RE2 lacks (e.g. backreferences)
+    if problems:
+        print(f"Rejected regex pattern {pattern!r}: {', '.join(problems)}")
+        return None
+    return re.compile(rewritten, flags)
+
+
+def guard_patterns(patterns: list[str], flags: int = 0, linear: bool = False) -> list:
+    """Compile the patterns that pass validation, in order."""
+    compiled = (guard_pattern(p, flags, linear) for p in patterns)
+    return [p for p in compiled if p is not None]
+
+
+def match_text(m) -> str:
+    """Text of a match the way re.findall reports it: the group(s), else the whole match."""
+    groups = m.groups('')
+    if not groups:
+        return m.group(0)
+    return groups[0] if len(groups) == 1 else ' '.join(groups)
+
+
+class RegexTimeout(Exception):
+    """A match ran past its time limit."""
+
+
+def can_interrupt() -> bool:
+    """Whether a running match can be interrupted: SIGALRM is only handled in the main thread."""
+    return (hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+            and signal.getitimer(signal.ITIMER_REAL)[0] == 0)
+
+
+@contextmanager
+def time_limit(seconds: float):
+    """Raise RegexTimeout inside a match still running after ``seconds``; a no-op where that is not possible."""
+    if seconds <= 0 or not can_interrupt():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise RegexTimeout()
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def search_first(patterns: list, text: str, budget: float = config.REGEX_FIELD_BUDGET) -> str | None:
+    """First match of the first matching pattern, giving up once the field's time budget is spent."""
+    start = time.perf_counter()
+    for pattern in patterns:
+        remaining = budget - (time.perf_counter() - start)
+        if remaining <= 0:
+            print(f"Regex time budget ({budget}s) exceeded before pattern {pattern.pattern!r}; skipping the rest")
+            return None
+        try:
+            with time_limit(remaining):
+                m = pattern.search(text)
+        except RegexTimeout:
+            print(f"Regex time budget ({budget}s) exceeded in pattern {pattern.pattern!r}; skipping the rest")
+            return None
+        if m:
+            return match_text(m)
+    return None
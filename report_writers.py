@@ -0,0 +1,363 @@
+"""
+Report writers for large batches.
+
+StreamingExcelWriter keeps memory flat with row count: rows are appended as
+invoices complete and spooled to a temporary file while the longest value per
+column is tracked, then streamed into a write-only openpyxl workbook on close
+with column widths taken from those lengths.
+
+add_bulk_table builds Word table rows as WordprocessingML in one pass and
+attaches them in batches, instead of python-docx's per-row add_row() and
+per-cell text assignment, which slow down as the table grows.
+
+Columnar formats for bulk consumers (Parquet, CSV, JSON Lines) are TableWriter
+subclasses registered by name in WRITERS; register_writer() adds more.
+
+write_outputs() writes extraction rows (TABLE_COLUMNS) and line items
+(ITEM_TABLE_COLUMNS) in any of these formats. It needs no OCR model, so
+exports can be rendered without loading the extraction pipeline.
+"""
+
+import math
+import os
+import pickle
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+import pandas as pd
+from docx import Document
+from docx.enum.text import WD_BREAK
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+import config
+
+# Try to import pyarrow for Parquet output
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Column width cap (characters), matching the previous auto-fit behaviour
+MAX_COLUMN_WIDTH = 50
+
+
+def cell_value(value):
+    """Excel-safe cell value: NaN/None become empty cells, everything else as is."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return value
+
+
+class StreamingExcelWriter:
+    """Constant-memory .xlsx writer.
+
+    ``sheets`` maps sheet name -> column list (in order); the first sheet is
+    the default target of append(). Sheets that receive no rows are omitted
+    unless they are the first one.
+
+        with StreamingExcelWriter(path, {'Invoice Data': columns}) as writer:
+            for row in rows:
+                writer.append(row)
+    """
+
+    def __init__(self, path: str, sheets: dict, max_width: int = MAX_COLUMN_WIDTH):
+        self.path = path
+        self.max_width = max_width
+        self.columns = {name: list(columns) for name, columns in sheets.items()}
+        self.default_sheet = next(iter(self.columns))
+        self.spools = {name: tempfile.TemporaryFile() for name in self.columns}
+        self.counts = {name: 0 for name in self.columns}
+        self.widths = {name: [len(str(c)) for c in columns] for name, columns in self.columns.items()}
+
+    def append(self, row: dict, sheet: str | None = None):
+        """Add one row (dict keyed by column name; missing keys become empty cells)."""
+        sheet = sheet or self.default_sheet
+        values = [cell_value(row.get(col)) for col in self.columns[sheet]]
+        widths = self.widths[sheet]
+        for i, value in enumerate(values):
+            if value is not None:
+                widths[i] = max(widths[i], len(str(value)))
+        pickle.dump(values, self.spools[sheet], protocol=pickle.HIGHEST_PROTOCOL)
+        self.counts[sheet] += 1
+
+    def extend(self, rows, sheet: str | None = None):
+        for row in rows:
+            self.append(row, sheet)
+
+    def spooled_rows(self, sheet: str):
+        spool = self.spools[sheet]
+        spool.seek(0)
+        for _ in range(self.counts[sheet]):
+            yield pickle.load(spool)
+
+    def rows(self, sheet: str | None = None):
+        """Rows appended to a sheet so far, as dicts keyed by column name (before close)."""
+        sheet = sheet or self.default_sheet
+        columns = self.columns[sheet]
+        for values in self.spooled_rows(sheet):
+            yield dict(zip(columns, values))
+
+    def discard(self):
+        """Release the spool files without writing the workbook."""
+        for spool in self.spools.values():
+            spool.close()
+
+    def close(self):
+        """Write the workbook and release the spool files."""
+        try:
+            workbook = Workbook(write_only=True)
+            for name, columns in self.columns.items():
+                if name != self.default_sheet and not self.counts[name]:
+                    continue
+                sheet = workbook.create_sheet(title=name)
+                # Widths must be set before the first row in write-only mode
+                for i, width in enumerate(self.widths[name], start=1):
+                    sheet.column_dimensions[get_column_letter(i)].width = min(width + 2, self.max_width)
+                sheet.append(columns)
+                for values in self.spooled_rows(name):
+                    sheet.append(values)
+            workbook.save(self.path)
+        finally:
+            self.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+# Rows parsed into the document per parse_xml call
+WORD_ROW_BATCH = 1000
+# Characters XML 1.0 does not allow (python-docx would reject them too)
+XML_INVALID_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def cell_xml(value, width: str) -> str:
+    text = '' if value is None else XML_INVALID_CHARS.sub('', str(value))
+    paragraph = f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>' if text else '<w:p/>'
+    return f'<w:tc><w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr>{paragraph}</w:tc>'
+
+
+def new_table(doc, headers: list[str], style: str):
+    table = doc.add_table(rows=1, cols=len(headers))
+    table.style = style
+    for cell, header in zip(table.rows[0].cells, headers):
+        cell.text = header
+    # Repeat the header row at the top of every page the table spans
+    table.rows[0]._tr.get_or_add_trPr().append(parse_xml(f'<w:tblHeader {nsdecls("w")}/>'))
+    return table
+
+
+def append_rows(table, row_xml: list[str]):
+    parsed = parse_xml(f'<w:tbl {nsdecls("w")}>{"".join(row_xml)}</w:tbl>')
+    tbl = table._tbl
+    for tr in list(parsed):
+        tbl.append(tr)
+
+
+def add_bulk_table(doc, columns: list[str], rows, headers: list[str] | None = None,
+                   style: str = config.WORD_TABLE_STYLE, split_rows: int = config.WORD_TABLE_SPLIT_ROWS):
+    """Append a table of ``rows`` (dicts keyed by ``columns``) to a python-docx Document.
+
+    With ``split_rows`` > 0 the table is cut every ``split_rows`` rows and the
+    next part starts on a new page with its own header row.
+    """
+    headers = headers or list(columns)
+    table = new_table(doc, headers, style)
+    widths = [col.get(qn('w:w')) for col in table._tbl.tblGrid.gridCol_lst]
+    pending, in_table = [], 0
+    for row in rows:
+        if split_rows and in_table == split_rows:
+            append_rows(table, pending)
+            pending, in_table = [], 0
+            doc.add_paragraph().add_run().add_break(WD_BREAK.PAGE)
+            table = new_table(doc, headers, style)
+        cells = ''.join(cell_xml(row.get(col, ''), width) for col, width in zip(columns, widths))
+        pending.append(f'<w:tr>{cells}</w:tr>')
+        in_table += 1
+        if len(pending) >= WORD_ROW_BATCH:
+            append_rows(table, pending)
+            pending = []
+    if pending:
+        append_rows(table, pending)
+    return table
+
+
+class TableWriter(ABC):
+    """Writes a typed DataFrame of extraction rows to one file format."""
+
+    extension = ''
+
+    @abstractmethod
+    def write(self, df, path: str):
+        """Write ``df`` to ``path``."""
+
+
+class CsvWriter(TableWriter):
+    extension = '.csv'
+
+    def write(self, df, path: str):
+        df.to_csv(path, index=False)
+
+
+class JsonlWriter(TableWriter):
+    extension = '.jsonl'
+
+    def write(self, df, path: str):
+        df.to_json(path, orient='records', lines=True, force_ascii=False)
+
+
+class ParquetWriter(TableWriter):
+    extension = '.parquet'
+
+    def write(self, df, path: str):
+        if not HAS_PYARROW:
+            raise RuntimeError("pyarrow library not found. Please install it using: pip install pyarrow")
+        df.to_parquet(path, index=False)
+
+
+WRITERS = {
+    'csv': CsvWriter(),
+    'jsonl': JsonlWriter(),
+    'parquet': ParquetWriter(),
+}
+
+# Formats produced by the Excel/Word report functions rather than a TableWriter
+REPORT_FORMATS = ('xlsx', 'docx')
+
+
+def register_writer(name: str, writer: TableWriter):
+    """Make an extra output format selectable by name."""
+    WRITERS[name] = writer
+
+
+def parse_formats(value) -> list[str]:
+    """Output formats from a comma-separated string or list; unknown names are reported and dropped."""
+    if not value:
+        return list(config.OUTPUT_FORMATS)
+    names = value.split(',') if isinstance(value, str) else value
+    formats = []
+    for name in (n.strip().lower() for n in names):
+        if not name or name in formats:
+            continue
+        if name in REPORT_FORMATS or name in WRITERS:
+            formats.append(name)
+        else:
+            print(f"Unknown output format ignored: {name}")
+    return formats or list(config.OUTPUT_FORMATS)
+
+
+# Columns of the extraction result tables: one row per invoice, one per line item
+TABLE_COLUMNS = ['Page', 'Company Name', 'Invoice Number', 'Date', 'Seller TRN', 'Buyer TRN', 'VAT Amount', 'Total Amount']
+ITEM_TABLE_COLUMNS = ['Invoice Number', 'Page', 'Quantity', 'Description', 'Rate', 'Amount', 'Valid']
+AMOUNT_COLUMNS = ['VAT Amount', 'Total Amount']
+
+
+def typed_table(rows: list[dict]) -> pd.DataFrame:
+    """Rows as typed columns for columnar outputs: amounts as floats, "Not Found" as null."""
+    df = pd.DataFrame([{col: row.get(col, '') for col in TABLE_COLUMNS} for row in rows], columns=TABLE_COLUMNS)
+    df = df.replace("Not Found", None)
+    df['Page'] = df['Page'].astype(str)
+    for col in AMOUNT_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def save_table(rows: list[dict], fmt: str, filename: str | None = None, output_folder: str = config.DEFAULT_OUTPUT_FOLDER, items=None):
+    """Save rows with a registered columnar writer (parquet, csv, jsonl).
+
+    Line items, when given as a non-empty DataFrame, go to a sibling ``*_items`` file.
+    """
+    try:
+        if not rows:
+            return None
+        writer = WRITERS[fmt]
+        if filename is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"multi_invoice_table_{timestamp}{writer.extension}"
+        filepath = os.path.join(output_folder, filename)
+        writer.write(typed_table(rows), filepath)
+        if items is not None and not items.empty:
+            stem, ext = os.path.splitext(filepath)
+            writer.write(items, f"{stem}_items{ext}")
+        print(f"{fmt.upper()} file saved: {filepath}")
+        return filename
+    except Exception as e:
+        print(f"Error saving table to {fmt}: {e}")
+        return None
+
+
+def save_table_to_excel(rows: list[dict], filename: str | None = None, output_folder: str = config.DEFAULT_OUTPUT_FOLDER, items=None):
+    """Save a list of row dicts to Excel as a table (one invoice per row).
+
+    Line items, when given as a non-empty DataFrame, go to an extra 'Items' sheet.
+    """
+    try:
+        if not rows:
+            return None
+        columns = TABLE_COLUMNS
+        if filename is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"multi_invoice_table_{timestamp}.xlsx"
+        filepath = os.path.join(output_folder, filename)
+        sheets = {'Sheet1': columns, 'Items': list(items.columns) if items is not None else []}
+        with StreamingExcelWriter(filepath, sheets) as writer:
+            # Ensure all keys exist
+            writer.extend({col: row.get(col, '') for col in columns} for row in rows)
+            if items is not None and not items.empty:
+                writer.extend(items.to_dict('records'), sheet='Items')
+        print(f"Excel file saved: {filepath}")
+        return filename
+    except Exception as e:
+        print(f"Error saving table to Excel: {e}")
+        return None
+
+
+def save_table_to_word(rows: list[dict], filename: str | None = None, output_folder: str = config.DEFAULT_OUTPUT_FOLDER):
+    """Save a list of row dicts to Word as a table."""
+    try:
+        if not rows:
+            return None
+        columns = TABLE_COLUMNS
+        doc = Document()
+        doc.add_heading('Multi-Invoice Extraction Results', 0)
+        doc.add_paragraph(f"Generated on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        add_bulk_table(doc, columns, rows)
+        if filename is None:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            filename = f"multi_invoice_table_{timestamp}.docx"
+        filepath = os.path.join(output_folder, filename)
+        doc.save(filepath)
+        print(f"Word file saved: {filepath}")
+        return filename
+    except Exception as e:
+        print(f"Error saving table to Word: {e}")
+        return None
+
+
+def write_outputs(rows: list[dict], items, formats: list[str], basename: str, output_folder: str) -> dict:
+    """Write each format as ``<basename><extension>``; returns ``{format: path}`` of the files written."""
+    outputs = {}
+    for fmt in formats:
+        if fmt == 'xlsx':
+            filename = save_table_to_excel(rows, filename=f"{basename}.xlsx", output_folder=output_folder, items=items)
+        elif fmt == 'docx':
+            filename = save_table_to_word(rows, filename=f"{basename}.docx", output_folder=output_folder)
+        elif fmt in WRITERS:
+            filename = save_table(rows, fmt, filename=f"{basename}{WRITERS[fmt].extension}", output_folder=output_folder, items=items)
+        else:
+            continue
+        if filename:
+            outputs[fmt] = os.path.join(output_folder, filename)
+    return outputs
@@ -0,0 +1,13 @@
+import pytest
+
+import db
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """Connection to a freshly migrated database."""
+    path = str(tmp_path / 'users.db')
+    db.migrate(path)
+    connection = db.open_connection(path)
+    yield connection
+    connection.close()
@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip('doctr')
+
+from ocr_to_word_excel_fixed import COLUMN_TOLERANCE, detect_amount_columns  # noqa: E402
+
+
+def words(*right_edges):
+    return [{'x1': x1} for x1 in right_edges]
+
+
+def test_finds_one_band_per_right_aligned_column():
+    columns = detect_amount_columns(words(0.601, 0.600, 0.602, 0.899, 0.900, 0.901, 0.900))
+    assert len(columns) == 2
+    (lo1, hi1), (lo2, hi2) = columns
+    assert lo1 == pytest.approx(0.600 - COLUMN_TOLERANCE) and hi1 == pytest.approx(0.602 + COLUMN_TOLERANCE)
+    assert lo2 == pytest.approx(0.899 - COLUMN_TOLERANCE) and hi2 == pytest.approx(0.901 + COLUMN_TOLERANCE)
+
+
+def test_jitter_across_a_bin_boundary_stays_one_column():
+    assert len(detect_amount_columns(words(0.8995, 0.9005, 0.9001))) == 1
+
+
+def test_isolated_tokens_form_no_column():
+    assert detect_amount_columns(words(0.2, 0.5, 0.9)) == []
+    assert detect_amount_columns(words(0.9)) == []
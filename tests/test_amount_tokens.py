@@ -0,0 +1,34 @@
+import pytest
+
+pytest.importorskip('doctr')
+
+from ocr_to_word_excel_fixed import PageLayout, is_amount_token, parse_amount_token  # noqa: E402
+
+
+@pytest.mark.parametrize('text', ['1,250.00', '50', 'AED 1,250.00', '1,250.00AED', 'aed 5.5'])
+def test_amount_tokens(text):
+    assert is_amount_token(text)
+
+
+@pytest.mark.parametrize('text', ['Total', 'INV/2024001', '5%', '01/02/2024', 'AED'])
+def test_not_amount_tokens(text):
+    assert not is_amount_token(text)
+
+
+def test_parse_amount_token():
+    assert parse_amount_token('1,250.00') == 1250.0
+    assert parse_amount_token('AED 50.5') == 50.5
+    assert parse_amount_token('Total') is None
+
+
+def test_page_parses_each_amount_token_once():
+    parse_amount_token.cache_clear()
+    page = {'blocks': [{'lines': [{'words': [
+        {'value': text, 'geometry': [[0.1 * i, 0.5], [0.1 * i + 0.05, 0.52]]}
+        for i, text in enumerate(['Total', '100.00', 'VAT', '5.00', 'Net', '100.00'])
+    ]}]}]}
+    layout = PageLayout(page)
+    assert layout.amount_positions == [1, 3, 5]
+    assert [layout.words[pos]['amount'] for pos in layout.amount_positions] == [100.0, 5.0, 100.0]
+    assert 'amount' not in layout.words[0]
+    assert parse_amount_token.cache_info().misses == 2
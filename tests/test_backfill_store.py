@@ -0,0 +1,29 @@
+import pytest
+
+pytest.importorskip('doctr')
+pytest.importorskip('werkzeug')
+
+from backfill_store import cache_entry, upload_job_id  # noqa: E402
+
+SOURCES = {
+    'My_Invoice.pdf': ['ocr_cache/aa.json.gz'],
+    'scan.pdf': ['ocr_cache/bb.json.gz', 'ocr_cache/cc.json.gz'],
+}
+
+
+def test_cache_entry_matches_the_recorded_or_secured_name():
+    assert cache_entry(SOURCES, 'My_Invoice.pdf') == 'ocr_cache/aa.json.gz'
+    # api_app records the name as uploaded; the cache has it as secure_filename() left it
+    assert cache_entry(SOURCES, 'My Invoice.pdf') == 'ocr_cache/aa.json.gz'
+
+
+def test_cache_entry_needs_exactly_one_entry():
+    assert cache_entry(SOURCES, 'scan.pdf') is None
+    assert cache_entry(SOURCES, 'other.pdf') is None
+    assert cache_entry(SOURCES, None) is None
+
+
+def test_upload_job_id_falls_back_to_export_names():
+    assert upload_job_id('job_1', 'job_2.xlsx') == 'job_1'
+    assert upload_job_id(None, None, 'jobs/ab/job_2/job_2.docx') == 'job_2'
+    assert upload_job_id(None, 'not an export', None) is None
@@ -0,0 +1,75 @@
+import pytest
+
+import db
+
+
+def test_migrate_is_idempotent(tmp_path):
+    path = str(tmp_path / 'users.db')
+    version = db.migrate(path)
+    assert version == max(db.MIGRATIONS)
+    db._migrated.pop(path)
+    assert db.migrate(path) == version
+    conn = db.open_connection(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == version
+    conn.close()
+
+
+def test_pooled_connection_is_reused_and_rolled_back(tmp_path):
+    path = str(tmp_path / 'users.db')
+    conn = db.connect(path)
+    raw = conn._conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    conn.execute("INSERT INTO uploads (username, original_filename) VALUES ('u', 'a.pdf')")
+    conn.close()
+    again = db.connect(path)
+    assert again._conn is raw
+    assert again.execute("SELECT COUNT(*) FROM uploads").fetchone()[0] == 0
+    again.close()
+
+
+def add_uploads(conn, times, username='u', status='completed'):
+    for upload_time in times:
+        conn.execute(
+            "INSERT INTO uploads (username, original_filename, upload_time, status) VALUES (?, ?, ?, ?)",
+            (username, f"{upload_time}.pdf", upload_time, status)
+        )
+    conn.commit()
+
+
+def test_history_pages_by_keyset_without_gaps_or_repeats(conn):
+    # Equal timestamps are ordered by id
+    add_uploads(conn, ['2026-10-01T10:00:00', '2026-10-02T10:00:00', '2026-10-02T10:00:00',
+                       '2026-10-03T10:00:00', '2026-10-04T10:00:00'])
+    add_uploads(conn, ['2026-10-05T10:00:00'], username='other')
+    seen, cursor = [], None
+    while True:
+        page, cursor = db.upload_history(conn, 'u', limit=2, cursor=cursor)
+        seen.extend(row['id'] for row in page)
+        if cursor is None:
+            break
+    assert seen == [5, 4, 3, 2, 1]
+
+
+def test_history_filters(conn):
+    add_uploads(conn, ['2026-10-01T10:00:00', '2026-10-02T23:59:00', '2026-10-03T00:00:00'])
+    add_uploads(conn, ['2026-10-02T12:00:00'], status='failed')
+    page, _ = db.upload_history(conn, 'u', date_from='2026-10-02', date_to='2026-10-02')
+    assert [row['id'] for row in page] == [2]
+    page, _ = db.upload_history(conn, 'u', status=None)
+    assert len(page) == 4
+    page, _ = db.upload_history(conn, 'u', status='failed')
+    assert [row['status'] for row in page] == ['failed']
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'cursor': 'not-a-cursor'},
+    {'status': 'pending'},
+    {'date_from': '02/10/2026'},
+])
+def test_history_rejects_malformed_parameters(conn, kwargs):
+    with pytest.raises(ValueError):
+        db.upload_history(conn, 'u', **kwargs)
+
+
+def test_cursor_round_trip():
+    assert db.decode_cursor(db.encode_cursor('2026-10-01T10:00:00', 7)) == ('2026-10-01T10:00:00', 7)
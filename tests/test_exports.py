@@ -0,0 +1,55 @@
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('docx')
+pytest.importorskip('openpyxl')
+
+import exports  # noqa: E402
+
+
+@pytest.mark.parametrize('filename, expected', [
+    ('inv_20261019_101500_ab12cd34.xlsx', ('inv_20261019_101500_ab12cd34', 'xlsx', False)),
+    ('inv_1.DOCX', ('inv_1', 'docx', False)),
+    ('inv_1_items.parquet', ('inv_1', 'parquet', True)),
+    ('inv_1_items.xlsx', ('inv_1_items', 'xlsx', False)),
+])
+def test_parse_export_name(filename, expected):
+    assert exports.parse_export_name(filename) == expected
+
+
+@pytest.mark.parametrize('filename', ['../users.xlsx', 'inv_1.exe', 'inv_1', '.xlsx', 'a b.xlsx'])
+def test_parse_export_name_rejects_other_names(filename):
+    assert exports.parse_export_name(filename) is None
+
+
+def test_render_export_from_the_stored_result(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    rows = [{'Page': 1, 'Invoice Number': 'INV/2024001', 'Total Amount': '105.00'}]
+    exports.save_result('inv_1', rows)
+    path = exports.render_export('inv_1.csv', cache_folder=str(tmp_path / 'cache'))
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith('Page,Company Name,Invoice Number')
+    assert 'INV/2024001' in lines[1] and '105.0' in lines[1]
+    assert exports.render_export('missing.csv', cache_folder=str(tmp_path / 'cache')) is None
+
+
+def test_rendering_does_not_load_the_pipeline():
+    # The pipeline loads the OCR model's libraries (and exits without them)
+    code = ("import sys, exports, report_writers; "
+            "sys.exit('ocr_to_word_excel_fixed' in sys.modules)")
+    assert subprocess.run([sys.executable, '-c', code]).returncode == 0
+
+
+def test_new_job_id_is_filesystem_safe():
+    job_id = exports.new_job_id('../My Invoice (1).pdf')
+    assert job_id.startswith('My_Invoice__1__')
+    assert exports.parse_export_name(f"{job_id}.xlsx")[0] == job_id
+
+
+def test_job_dir_is_sharded(tmp_path):
+    path = exports.job_dir('inv_1', str(tmp_path))
+    assert path.startswith(str(tmp_path))
+    assert path.endswith('inv_1') and len(path.split('/')[-2]) == 2
@@ -0,0 +1,171 @@
+import pytest
+
+import db
+import invoice_store
+
+
+def invoice_row(number, total, trn='100234567890003', date='15/10/2026', page=1):
+    return {'Page': page, 'Company Name': 'ACME Trading LLC', 'Invoice Number': number, 'Date': date,
+            'Seller TRN': trn, 'Buyer TRN': '100999999900003', 'VAT Amount': str(round(total / 21, 2)),
+            'Total Amount': f"{total:,.2f}"}
+
+
+def store(conn, rows, username='u', content_hash=None, page_texts=None):
+    upload_id = db.record_upload(conn, username, 'invoice.pdf', None, None, 'printed', job_id='job')
+    result = {'job_id': 'job', 'rows': rows, 'content_hash': content_hash, 'page_texts': page_texts or []}
+    stored = invoice_store.store_result(conn, upload_id, username, result)
+    conn.commit()
+    return upload_id, stored
+
+
+def test_invoice_record_types_values():
+    record = invoice_store.invoice_record(invoice_row('inv 001', 1050.0))
+    assert record['invoice_number'] == 'INV001'
+    assert record['invoice_date'] == '2026-10-15'
+    assert record['total_amount'] == 1050.0
+    assert invoice_store.invoice_record({'Date': 'Not Found'})['invoice_date'] is None
+
+
+def test_query_invoices_filters_and_sorts(conn):
+    store(conn, [invoice_row('A1', 100.0, date='01/09/2026'), invoice_row('A2', 300.0), invoice_row('A3', 200.0)])
+    rows, next_cursor = invoice_store.query_invoices(conn, 'u', {'min_total': '150'}, sort='-total')
+    assert [row['invoice_number'] for row in rows] == ['A2', 'A3']
+    assert next_cursor is None
+    rows, _ = invoice_store.query_invoices(conn, 'u', {'date_from': '01/10/2026', 'invoice_number': 'a 2'})
+    assert [row['invoice_number'] for row in rows] == ['A2']
+    assert invoice_store.query_invoices(conn, 'other')[0] == []
+
+
+@pytest.mark.parametrize('filters, sort', [
+    ({'unknown': '1'}, '-date'),
+    ({'date_from': 'yesterday'}, '-date'),
+    ({}, 'company'),
+])
+def test_query_invoices_rejects_bad_parameters(conn, filters, sort):
+    with pytest.raises(ValueError):
+        invoice_store.query_invoices(conn, 'u', filters, sort=sort)
+
+
+def test_query_invoices_rejects_bad_cursors(conn):
+    store(conn, [invoice_row(f'A{i}', 100.0 + i) for i in range(3)])
+    _, cursor = invoice_store.query_invoices(conn, 'u', sort='-total', limit=1)
+    with pytest.raises(ValueError):
+        invoice_store.query_invoices(conn, 'u', sort='total', cursor=cursor)
+    with pytest.raises(ValueError):
+        invoice_store.query_invoices(conn, 'u', cursor='not-a-cursor')
+
+
+@pytest.mark.parametrize('sort', ['date', '-date', 'total', '-total', 'vat', 'invoice_number', '-seller_trn', '-id'])
+def test_query_invoices_pages_by_keyset_through_missing_values(conn, sort):
+    # Missing dates, totals and TRNs are NULL; equal values are ordered by id
+    rows = [invoice_row(f'A{i}', [100.0, 200.0, 100.0][i % 3], trn=[None, '100234567890003'][i % 2],
+                        date=['01/10/2026', 'Not Found', '02/10/2026', 'Not Found'][i % 4]) for i in range(11)]
+    rows[4]['Total Amount'] = rows[7]['VAT Amount'] = 'Not Found'
+    store(conn, rows)
+    column = invoice_store.INVOICE_SORTS[sort.lstrip('-')]
+    direction = 'DESC' if sort.startswith('-') else 'ASC'
+    expected = [row[0] for row in conn.execute(
+        f"SELECT id FROM invoices WHERE username = 'u' ORDER BY {column} {direction}, id {direction}")]
+    seen, cursor = [], None
+    while True:
+        page, cursor = invoice_store.query_invoices(conn, 'u', sort=sort, limit=3, cursor=cursor)
+        seen.extend(row['id'] for row in page)
+        if cursor is None:
+            break
+    assert seen == expected
+
+
+@pytest.mark.parametrize('sort', ['date', '-total', 'vat', 'invoice_number', 'seller_trn', 'id'])
+def test_query_invoices_reads_the_sort_index_in_order(conn, sort):
+    plans = []
+    real_execute = conn.execute
+
+    class Recorder:
+        def execute(self, sql, params=()):
+            plans.extend(row[3] for row in real_execute(f"EXPLAIN QUERY PLAN {sql}", params))
+            return real_execute(sql, params)
+
+    invoice_store.query_invoices(Recorder(), 'u', sort=sort)
+    assert plans and not any('TEMP B-TREE' in plan for plan in plans)
+
+
+def test_search_pages_only_finds_the_users_own_pages(conn):
+    if not db.has_table(conn, 'page_search'):
+        pytest.skip("SQLite lacks FTS5")
+    store(conn, [invoice_row('A1', 105.0)], page_texts=['Purchase order PO-4471 for widgets', ''])
+    store(conn, [], username='other', page_texts=['PO-4471 gadgets'])
+    hits, next_offset = invoice_store.search_pages(conn, 'u', 'po-4471')
+    assert [(hit['page'], hit['invoice_number']) for hit in hits] == [(1, 'A1')]
+    assert '[PO-4471]' in hits[0]['snippet']
+    assert next_offset is None
+    assert invoice_store.search_pages(conn, 'u', 'widg*')[0]
+    assert invoice_store.search_pages(conn, 'u', 'gadgets')[0] == []
+    with pytest.raises(ValueError):
+        invoice_store.search_pages(conn, 'u', '   ')
+
+
+def test_owner_token_is_one_index_token_per_user():
+    assert invoice_store.owner_token('ali') == 'u616C69'
+    assert invoice_store.owner_token('a b') != invoice_store.owner_token('ab')
+    assert invoice_store.owner_token('ali').isalnum()
+
+
+def test_duplicates_are_flagged(conn):
+    first_upload, first = store(conn, [invoice_row('A1', 105.0)], content_hash='abc')
+    _, second = store(conn, [invoice_row('a 1', 105.0, trn='100-2345-6789-0003'), invoice_row('A2', 50.0)],
+                      content_hash='abc')
+    assert first['duplicates'] == {'document': None, 'invoices': []}
+    assert second['duplicates']['document']['upload_id'] == first_upload
+    assert [d['duplicate_of'] for d in second['duplicates']['invoices']] == first['invoice_ids']
+    # Another user's identical invoice is not a duplicate
+    assert store(conn, [invoice_row('A1', 105.0)], username='other')[1]['duplicates']['invoices'] == []
+
+
+def test_duplicate_invoice_points_to_the_first_occurrence(conn):
+    _, first = store(conn, [invoice_row('A1', 105.0)])
+    _, second = store(conn, [invoice_row('A1', 105.0)])
+    _, third = store(conn, [invoice_row('A1', 105.0), invoice_row('A1', 106.0)])
+    rows, _ = invoice_store.query_invoices(conn, 'u', sort='id')
+    original = first['invoice_ids'][0]
+    assert [row['duplicate_of'] for row in rows] == [None, original, original, None]
+    assert third['duplicates']['invoices'][0]['duplicate_of'] == original
+
+
+def test_duplicates_are_not_counted(conn):
+    store(conn, [invoice_row('A1', 105.0)])
+    store(conn, [invoice_row('a 1', 105.0, trn='100-2345-6789-0003'), invoice_row('A2', 50.0)])
+    groups, totals = invoice_store.invoice_stats(conn, 'u')
+    assert totals['invoices'] == 2
+    assert totals['total_amount'] == 155.0
+    assert [(g['seller_trn'], g['month']) for g in groups] == [('100234567890003', '2026-10')]
+
+
+def test_deleting_an_original_promotes_its_copy(conn):
+    first_upload, first = store(conn, [invoice_row('A1', 105.0)])
+    _, second = store(conn, [invoice_row('A1', 105.0)])
+    _, third = store(conn, [invoice_row('A1', 105.0)])
+    conn.execute("DELETE FROM uploads WHERE id = ?", (first_upload,))
+    conn.commit()
+    rows, _ = invoice_store.query_invoices(conn, 'u', sort='id')
+    promoted, copy = second['invoice_ids'][0], third['invoice_ids'][0]
+    assert [(row['id'], row['duplicate_of']) for row in rows] == [(promoted, None), (copy, promoted)]
+    assert invoice_store.invoice_stats(conn, 'u')[1]['invoices'] == 1
+
+
+def test_stats_rejects_bad_parameters(conn):
+    with pytest.raises(ValueError):
+        invoice_store.invoice_stats(conn, 'u', group_by='vendor')
+    with pytest.raises(ValueError):
+        invoice_store.invoice_stats(conn, 'u', month_from='2026-13')
+
+
+def test_stats_groups_and_month_range(conn):
+    store(conn, [invoice_row('A1', 100.0, date='15/09/2026'), invoice_row('A2', 200.0),
+                 invoice_row('B1', 50.0, trn='100777777700003'), invoice_row('C1', 10.0, date='Not Found')])
+    groups, totals = invoice_store.invoice_stats(conn, 'u', group_by='month')
+    assert [(g['month'], g['invoices'], g['total_amount']) for g in groups] == [
+        ('', 1, 10.0), ('2026-09', 1, 100.0), ('2026-10', 2, 250.0)]
+    assert totals['invoices'] == 4
+    groups, totals = invoice_store.invoice_stats(conn, 'u', group_by='seller', month_from='2026-10')
+    assert {g['seller_trn']: g['total_amount'] for g in groups} == {'100234567890003': 200.0, '100777777700003': 50.0}
+    assert totals['total_amount'] == 250.0
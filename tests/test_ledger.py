@@ -0,0 +1,54 @@
+import os
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('pyarrow')
+pytest.importorskip('docx')
+
+import pandas as pd  # noqa: E402
+
+import ledger  # noqa: E402
+
+
+def append(folder, number, second):
+    table = pd.DataFrame({'Seller TRN': ['100234567890003'], 'Invoice Number': [number],
+                          'VAT Amount': [5.0], 'Total Amount': [105.0]})
+    return ledger.append_to_ledger(table, 'invoice.pdf', f'job_{number}', folder, datetime(2026, 10, 1, 0, 0, second))
+
+
+def test_compaction_interrupted_before_removing_parts_counts_rows_once(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    for i in range(3):
+        append(folder, f'A{i}', i)
+    real_remove = os.remove
+    removed = []
+
+    def crash_on_second_remove(path):
+        if removed:
+            raise KeyboardInterrupt
+        removed.append(path)
+        real_remove(path)
+
+    monkeypatch.setattr(ledger.os, 'remove', crash_on_second_remove)
+    with pytest.raises(KeyboardInterrupt):
+        ledger.compact_month('2026-10', folder)
+    monkeypatch.setattr(ledger.os, 'remove', real_remove)
+
+    assert len(ledger.read_ledger(folder=folder)) == 3
+    assert ledger.compact_month('2026-10', folder) == 0
+    assert len(os.listdir(ledger.month_folder('2026-10', folder))) == 1
+    assert list(ledger.read_ledger(folder=folder)['Invoice Number']) == ['A0', 'A1', 'A2']
+
+
+def test_concurrent_compactions_merge_each_part_once(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    folder = str(tmp_path)
+    for i in range(4):
+        append(folder, f'A{i}', i)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        merged = sorted(pool.map(lambda _: ledger.compact_month('2026-10', folder), range(2)))
+    assert merged == [0, 4]
+    assert ledger.ledger_months(folder) == ['2026-10']
+    assert list(ledger.read_ledger(folder=folder)['Invoice Number']) == ['A0', 'A1', 'A2', 'A3']
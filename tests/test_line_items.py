@@ -0,0 +1,46 @@
+import pytest
+
+pytest.importorskip('doctr')
+
+from extraction_rules import get_rules  # noqa: E402
+from ocr_to_word_excel_fixed import items_from_rows  # noqa: E402
+
+
+def row(*cells):
+    """Words of one table row: (text, x0, x1)."""
+    return [{'text': text, 'x0': x0, 'x1': x1} for text, x0, x1 in cells]
+
+
+HEADER = row(('Description', 0.10, 0.30), ('Qty', 0.50, 0.55), ('Rate', 0.65, 0.70), ('Amount', 0.82, 0.90))
+
+
+def test_maps_words_to_the_nearest_header_column():
+    rows = [
+        row(('INVOICE', 0.10, 0.20)),
+        HEADER,
+        row(('Cotton', 0.10, 0.18), ('fabric', 0.19, 0.25), ('100', 0.50, 0.54),
+            ('12.50', 0.64, 0.70), ('1,250.00', 0.82, 0.90)),
+        row(('Linen', 0.10, 0.18), ('20', 0.51, 0.54), ('30.00', 0.64, 0.70), ('600.00', 0.84, 0.90)),
+    ]
+    assert items_from_rows(rows, get_rules()) == [
+        {'Quantity': 100.0, 'Description': 'Cotton fabric', 'Rate': 12.5, 'Amount': 1250.0},
+        {'Quantity': 20.0, 'Description': 'Linen', 'Rate': 30.0, 'Amount': 600.0},
+    ]
+
+
+def test_wrapped_description_joins_the_previous_item_and_totals_end_the_table():
+    rows = [
+        HEADER,
+        row(('Cotton', 0.10, 0.18), ('100', 0.50, 0.54), ('12.50', 0.64, 0.70), ('1,250.00', 0.82, 0.90)),
+        row(('(white)', 0.10, 0.18)),
+        row(('Total', 0.65, 0.70), ('1,250.00', 0.82, 0.90)),
+        row(('Extra', 0.10, 0.18), ('1', 0.50, 0.54), ('1.00', 0.64, 0.70), ('1.00', 0.82, 0.90)),
+    ]
+    items = items_from_rows(rows, get_rules())
+    assert [item['Description'] for item in items] == ['Cotton (white)']
+
+
+def test_no_items_without_quantity_rate_and_amount_headers():
+    rows = [row(('Description', 0.10, 0.30), ('Amount', 0.82, 0.90)),
+            row(('Cotton', 0.10, 0.18), ('1,250.00', 0.82, 0.90))]
+    assert items_from_rows(rows, get_rules()) == []
@@ -0,0 +1,53 @@
+import pytest
+
+pytest.importorskip('doctr')
+
+from ocr_to_word_excel_fixed import PageLayout, token_parts  # noqa: E402
+
+
+def make_page(words):
+    """Export page with one line per word: (text, x0, y0, x1, y1)."""
+    return {'blocks': [{'lines': [{'words': [{'value': text, 'geometry': [[x0, y0], [x1, y1]]}]}
+                                  for text, x0, y0, x1, y1 in words]}]}
+
+
+PAGE = make_page([
+    ('Subtotal:', 0.50, 0.70, 0.60, 0.72),
+    ('1,000.00', 0.80, 0.70, 0.90, 0.72),
+    ('VAT(5%)', 0.50, 0.74, 0.60, 0.76),
+    ('50.00', 0.84, 0.74, 0.90, 0.76),
+    ('SUB-TOTAL', 0.50, 0.78, 0.60, 0.80),
+    ('Total', 0.50, 0.82, 0.60, 0.84),
+    ('TOTALAED', 0.50, 0.86, 0.60, 0.88),
+])
+
+
+def test_token_parts_split_letter_and_digit_runs():
+    assert token_parts('SUB-TOTAL') == {'SUB', 'TOTAL'}
+    assert token_parts('VAT5%') == {'VAT', '5'}
+
+
+def test_lookup_matches_whole_runs_in_reading_order():
+    layout = PageLayout(PAGE)
+    assert layout.lookup('total') == [4, 5]
+    assert layout.lookup('VAT') == [2]
+    assert layout.lookup('SUB-TOTAL') == [4]
+    assert layout.lookup('GRAND TOTAL') == []
+
+
+def test_substring_lookup_scans_every_word():
+    layout = PageLayout(PAGE)
+    assert layout.lookup('TOTAL', substring=True) == [0, 4, 5, 6]
+
+
+def test_first_returns_earliest_hit_across_terms():
+    layout = PageLayout(PAGE)
+    assert layout.first(['TOTAL', 'VAT'])['text'] == 'VAT(5%)'
+    assert layout.first(['TOTAL'], lambda w: w['yc'] > 0.81)['text'] == 'Total'
+    assert layout.first(['TOTAL'], lambda w: w['yc'] > 0.85, substring=True)['text'] == 'TOTALAED'
+    assert layout.first(['PAYABLE']) is None
+
+
+def test_words_in_box():
+    layout = PageLayout(PAGE)
+    assert [w['text'] for w in layout.words_in([0.7, 0.69, 1.0, 0.77])] == ['1,000.00', '50.00']
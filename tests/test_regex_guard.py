@@ -0,0 +1,47 @@
+import re
+import time
+
+import pytest
+
+import regex_guard
+from regex_guard import guard_pattern, match_text, search_first
+
+pytestmark = pytest.mark.skipif(not regex_guard.HAS_SRE_PARSE, reason="needs the stdlib regex parser")
+
+
+@pytest.mark.parametrize('pattern', [
+    r'(?i)TRN\s*:?\s*(\d{9,15})',
+    r'Invoice\s*(?:No|Number)\.?\s*:?\s*([A-Z0-9-]+)',
+    r'(?:a|ab)*c',
+])
+def test_accepts_linear_patterns(pattern):
+    assert guard_pattern(pattern) is not None
+
+
+@pytest.mark.parametrize('pattern', [
+    r'(a+)+$',
+    r'(a|a)*b',
+    r'(?:\d|\d)*x',
+    r'(?:a|a?)*',
+    r'(',
+])
+def test_rejects_backtracking_and_invalid_patterns(pattern):
+    assert guard_pattern(pattern) is None
+
+
+def test_search_first_returns_group():
+    patterns = [guard_pattern(r'Total\s*:?\s*([\d,.]+)')]
+    assert search_first(patterns, "Sub total 10\nTotal: 1,050.00") == '1,050.00'
+
+
+def test_search_first_interrupts_a_running_match():
+    # Compiled directly, bypassing the guard, to stand in for a pattern it misjudged
+    slow = re.compile(r'(a+)+$')
+    start = time.perf_counter()
+    assert search_first([slow], 'a' * 40 + 'b', budget=0.05) is None
+    assert time.perf_counter() - start < 2
+
+
+def test_match_text_joins_groups():
+    assert match_text(re.search(r'(\d+)-(\d+)', 'x 12-34')) == '12 34'
+    assert match_text(re.search(r'\d+', 'x 12')) == '12'
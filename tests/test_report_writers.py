@@ -0,0 +1,76 @@
+import pytest
+from openpyxl import load_workbook
+
+from report_writers import StreamingExcelWriter, add_bulk_table
+
+
+def test_excel_round_trip(tmp_path):
+    path = str(tmp_path / 'out.xlsx')
+    with StreamingExcelWriter(path, {'Invoices': ['Number', 'Total'], 'Items': ['Amount'], 'Empty': ['X']}) as writer:
+        writer.append({'Number': 'INV/2024001', 'Total': 105.5})
+        writer.extend([{'Number': 'INV/2024002', 'Total': float('nan')}, {'Total': 7}])
+        writer.append({'Amount': 3}, sheet='Items')
+        assert list(writer.rows()) == [{'Number': 'INV/2024001', 'Total': 105.5},
+                                       {'Number': 'INV/2024002', 'Total': None},
+                                       {'Number': None, 'Total': 7}]
+    workbook = load_workbook(path)
+    assert workbook.sheetnames == ['Invoices', 'Items']
+    sheet = workbook['Invoices']
+    assert [list(row) for row in sheet.iter_rows(values_only=True)] == [
+        ['Number', 'Total'], ['INV/2024001', 105.5], ['INV/2024002', None], [None, 7]]
+    assert sheet.column_dimensions['A'].width == len('INV/2024001') + 2
+    assert [list(row) for row in workbook['Items'].iter_rows(values_only=True)] == [['Amount'], [3]]
+
+
+def test_spools_are_released_when_writing_fails(tmp_path):
+    path = tmp_path / 'out.xlsx'
+    with pytest.raises(RuntimeError):
+        with StreamingExcelWriter(str(path), {'Invoices': ['Number']}) as writer:
+            writer.append({'Number': 'INV/2024001'})
+            raise RuntimeError
+    assert all(spool.closed for spool in writer.spools.values())
+    assert not path.exists()
+
+
+def test_process_invoices_writes_both_reports(monkeypatch, tmp_path):
+    pytest.importorskip('doctr')
+    pytest.importorskip('cv2')
+    import invoice_extractor
+    from docx import Document
+
+    monkeypatch.setattr(invoice_extractor, 'ocr_predictor', lambda pretrained: None)
+    extractor = invoice_extractor.InvoiceDataExtractor()
+    monkeypatch.setattr(extractor, 'extract_invoice_data',
+                        lambda path: {'file_name': path[-5:], 'total_amount': '10.00'})
+    for name in ('a.pdf', 'b.pdf'):
+        (tmp_path / name).write_bytes(b'')
+    output = tmp_path / 'out'
+    extractor.process_invoices(str(tmp_path), str(output))
+    excel = next(output.glob('*.xlsx'))
+    word = next(output.glob('*.docx'))
+    assert load_workbook(excel).active.max_row == 3
+    table = Document(str(word)).tables[0]
+    assert sorted(row.cells[0].text for row in table.rows[1:]) == ['a.pdf', 'b.pdf']
+
+
+def test_bulk_table_splits_with_a_header_per_part():
+    from docx import Document
+
+    doc = Document()
+    rows = ({'Number': f'INV/{n}', 'Total': n} for n in range(5))
+    add_bulk_table(doc, ['Number', 'Total'], rows, headers=['No.', 'Total'], style='Table Grid', split_rows=2)
+    tables = doc.tables
+    assert [len(table.rows) for table in tables] == [3, 3, 2]
+    assert all(table.rows[0].cells[0].text == 'No.' for table in tables)
+    assert [row.cells[0].text for table in tables for row in table.rows[1:]] == [f'INV/{n}' for n in range(5)]
+    assert [row.cells[1].text for row in tables[2].rows[1:]] == ['4']
+    page_breaks = [p for p in doc.paragraphs if 'w:br w:type="page"' in p._p.xml]
+    assert len(page_breaks) == 2
+
+
+def test_bulk_table_without_split_is_one_table():
+    from docx import Document
+
+    doc = Document()
+    add_bulk_table(doc, ['Number'], [{'Number': n} for n in range(5)], style='Table Grid', split_rows=0)
+    assert [len(table.rows) for table in doc.tables] == [6]
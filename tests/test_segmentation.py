@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip('doctr')
+
+from ocr_to_word_excel_fixed import merge_invoice_rows, segment_invoices  # noqa: E402
+
+
+def test_page_numbering_splits_invoices():
+    pages = ["Invoice No: INV/202401\nPage 1 of 2", "Page 2 of 2\nTotal 100.00",
+             "Invoice No: INV/202402\nPage 1 of 1\nTotal 50.00"]
+    assert segment_invoices(pages) == [[0, 1], [2]]
+
+
+def test_a_new_invoice_number_starts_a_new_invoice():
+    pages = ["Invoice No: INV/202401\nItems", "Invoice No: INV/202401\nTotal 100.00", "Invoice No: INV/202402\nTotal 50.00"]
+    assert segment_invoices(pages) == [[0, 1], [2]]
+
+
+def test_a_different_seller_trn_starts_a_new_invoice():
+    pages = ["TRN: 100234567890003\nItems", "TRN: 100234567890003\nTotal 100.00", "TRN: 100777777700003\nItems"]
+    assert segment_invoices(pages) == [[0, 1], [2]]
+
+
+def test_a_continuation_page_without_a_header_stays_with_its_invoice():
+    pages = ["Invoice No: INV/202401\nItems", "more items", "Total 100.00"]
+    assert segment_invoices(pages) == [[0, 1, 2]]
+    assert segment_invoices([]) == []
+
+
+def page_row(page, **fields):
+    row = dict.fromkeys(['Company Name', 'Invoice Number', 'Date', 'Seller TRN', 'Buyer TRN',
+                         'VAT Amount', 'Total Amount'], "Not Found")
+    return {'Page': page, **row, **fields}
+
+
+def test_merge_takes_header_fields_first_and_amounts_last():
+    merged = merge_invoice_rows([
+        page_row(3, **{'Invoice Number': 'INV/202401', 'Total Amount': '10.00'}),
+        page_row(4, **{'Date': '01/02/2024'}),
+        page_row(5, **{'Invoice Number': 'INV/202499', 'Total Amount': '105.00', 'VAT Amount': '5.00'}),
+    ])
+    assert merged['Page'] == '3-5' and merged['Pages'] == [3, 4, 5]
+    assert merged['Invoice Number'] == 'INV/202401'
+    assert merged['Date'] == '01/02/2024'
+    assert merged['Total Amount'] == '105.00' and merged['VAT Amount'] == '5.00'
+    assert merged['Seller TRN'] == "Not Found"
+
+
+def test_merge_of_one_page_keeps_its_number():
+    assert merge_invoice_rows([page_row(2)])['Page'] == 2
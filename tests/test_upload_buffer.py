@@ -0,0 +1,47 @@
+import io
+import os
+
+import pytest
+
+from upload_buffer import UploadBuffer
+
+
+def test_small_upload_stays_in_memory():
+    with UploadBuffer.from_stream(io.BytesIO(b'%PDF-1.4 small'), 'a.pdf', max_memory=1024) as upload:
+        assert upload.in_memory
+        assert upload.source == b'%PDF-1.4 small'
+
+
+def test_large_upload_spills_to_a_temp_file_removed_on_close():
+    data = os.urandom(4096)
+    with UploadBuffer.from_stream(io.BytesIO(data), 'scan.PDF', max_memory=1024) as upload:
+        path = upload.source
+        assert not upload.in_memory
+        assert path.endswith('.pdf')
+        with open(path, 'rb') as f:
+            assert f.read() == data
+    assert not os.path.exists(path)
+
+
+def test_failed_read_leaves_no_temp_file(monkeypatch):
+    created = []
+
+    class BrokenStream:
+        def __init__(self):
+            self.chunks = [b'x' * 2048]
+
+        def read(self, size):
+            if self.chunks:
+                return self.chunks.pop()
+            raise IOError("connection reset")
+
+    real_spill = UploadBuffer._spill
+
+    def spill(self):
+        real_spill(self)
+        created.append(self.path)
+
+    monkeypatch.setattr(UploadBuffer, '_spill', spill)
+    with pytest.raises(IOError):
+        UploadBuffer.from_stream(BrokenStream(), 'a.pdf', max_memory=1024)
+    assert created and not os.path.exists(created[0])
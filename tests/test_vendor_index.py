@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from vendor_index import VendorIndex, is_labelled_trn
+
+
+def test_only_labelled_trns_are_trusted():
+    assert is_labelled_trn("TRN: 100234567890003", '100234567890003')
+    assert is_labelled_trn("Tax Registration No. 100234567890003", '100234567890003')
+    assert not is_labelled_trn("Tel 100234567890003", '100234567890003')
+    assert not is_labelled_trn("TRN: Not Found", 'Not Found')
+
+
+def test_register_appends_each_trn_once(tmp_path):
+    path = str(tmp_path / 'vendors.csv')
+    first, second = VendorIndex(path), VendorIndex(path)
+    first.register('100234567890003', 'ACME Trading LLC')
+    second.register('100234567890003', 'ACME TRADING L.L.C')
+    with open(path, encoding='utf-8') as f:
+        assert len(f.read().splitlines()) == 2
+    assert second.canonical_name('anything', '100234567890003') == 'ACME Trading LLC'
+
+
+def test_index_reloads_when_the_file_changes(tmp_path):
+    path = str(tmp_path / 'vendors.csv')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('trn,name,aliases\n100234567890003,ACME Trading LLC,ACME\n')
+    index = VendorIndex(path)
+    assert index.match_name('ACME Trading L.L.C.') == 'ACME Trading LLC'
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('100777777700003,Gulf Supplies FZE,\n')
+    os.utime(path, (1, 1))
+    index.refresh()
+    assert index.canonical_name('Gulf Supplies', '100777777700003') == 'Gulf Supplies FZE'
+
+
+def extractor_reading(monkeypatch, tmp_path, text):
+    """An InvoiceDataExtractor (without its OCR model) that reads ``text`` from any PDF."""
+    pytest.importorskip('doctr')
+    pytest.importorskip('cv2')
+    import invoice_extractor
+    path = str(tmp_path / 'vendors.csv')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('trn,name,aliases\n100234567890003,ACME Trading LLC,\n')
+    index = VendorIndex(path)
+    monkeypatch.setattr(invoice_extractor, 'get_vendor_index', lambda: index)
+    monkeypatch.setattr(invoice_extractor, 'ocr_predictor', lambda pretrained: None)
+    extractor = invoice_extractor.InvoiceDataExtractor()
+    words = [{'text': word, 'confidence': 0.99, 'bbox': None} for word in text.split()]
+    monkeypatch.setattr(extractor, 'extract_text_from_pdf', lambda pdf_path: words)
+    return extractor
+
+
+def test_extract_invoice_data_uses_a_labelled_trn(monkeypatch, tmp_path):
+    extractor = extractor_reading(monkeypatch, tmp_path, "GULFCO Invoice # INV-1 TRN: 100234567890003 Total 100.00 AED")
+    data = extractor.extract_invoice_data('invoice.pdf')
+    assert data['seller_trn'] == '100234567890003'
+    assert data['company_name'] == 'ACME Trading LLC'
+
+
+def test_extract_invoice_data_ignores_an_unlabelled_number(monkeypatch, tmp_path):
+    extractor = extractor_reading(monkeypatch, tmp_path, "GULFCO Invoice # INV-1 Tel 100234567890003 Total 100.00 AED")
+    assert extractor.extract_invoice_data('invoice.pdf')['company_name'] == 'GULFCO'
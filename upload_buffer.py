@@ -0,0 +1,83 @@
+"""
+Per-job buffer for uploaded files.
+
+An upload is read into memory in chunks; only when it grows beyond
+config.UPLOAD_MEMORY_LIMIT bytes is it moved to a private temporary file
+(created with mkstemp, so readable by the owner only). ``source`` is then the
+bytes or the temp-file path, either of which process_invoice accepts, so an
+upload reaches the document loader without being saved and copied into a
+shared location first. Each job has its own buffer, so concurrent uploads
+never overwrite one another.
+
+    with UploadBuffer.from_stream(file.stream, filename) as upload:
+        process_invoice(upload.source, filename=upload.filename)
+"""
+
+import io
+import os
+import tempfile
+
+import config
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadBuffer:
+    def __init__(self, filename: str, max_memory: int = config.UPLOAD_MEMORY_LIMIT):
+        self.filename = filename
+        self.max_memory = max_memory
+        self.size = 0
+        self.path = None
+        self._memory = io.BytesIO()
+        self._file = None
+
+    @classmethod
+    def from_stream(cls, stream, filename: str, max_memory: int = config.UPLOAD_MEMORY_LIMIT):
+        buffer = cls(filename, max_memory)
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                buffer.write(chunk)
+            buffer.finish()
+        except Exception:
+            buffer.close()
+            raise
+        return buffer
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._file is None and self.size > self.max_memory:
+            self._spill()
+        (self._file or self._memory).write(chunk)
+
+    def _spill(self):
+        fd, self.path = tempfile.mkstemp(suffix=os.path.splitext(self.filename)[1].lower(), prefix='upload-')
+        self._file = os.fdopen(fd, 'wb')
+        self._file.write(self._memory.getvalue())
+        self._memory = None
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+
+    @property
+    def in_memory(self) -> bool:
+        return self.path is None
+
+    @property
+    def source(self):
+        """The upload as bytes, or the temp-file path if it was spilled to disk."""
+        return self._memory.getvalue() if self.in_memory else self.path
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
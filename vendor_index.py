@@ -0,0 +1,199 @@
+"""
+Vendor master index: canonical supplier names by TRN and by fuzzy name match.
+
+The master list is a CSV file (config.VENDOR_MASTER_FILE) with columns
+``trn,name[,aliases]`` where aliases are separated by ``|``. Lookups go by
+seller TRN first (a dict hit); otherwise the OCR'd company name is matched
+against a character-trigram index, so only vendors sharing trigrams with the
+query are scored. Both paths return the vendor's canonical name, giving every
+spelling of a supplier one grouping key.
+
+Only a TRN printed after a TRN label counts for the lookup (is_labelled_trn):
+a bare 9-15 digit number may be a phone or account number, and a wrong TRN
+would pin every later invoice to the wrong vendor. The file is reloaded
+when another process changes it, and registrations are appended under a
+file lock, each TRN once.
+"""
+
+import csv
+import os
+import re
+import threading
+from collections import Counter
+
+import config
+from file_lock import locked
+
+# A label right before the number: "TRN:", "Tax Registration No.", "VAT Reg. Number" ...
+TRN_LABEL = r'(?:TRN|TAX\s*REG(?:ISTRATION)?|VAT\s*REG(?:ISTRATION)?|VAT\s*(?:NO|NUMBER))[\s.:#-]*(?:NO|NUMBER)?[\s.:#-]*'
+# Cached fuzzy matches per index before the cache is reset
+MATCH_CACHE_SIZE = 10000
+
+
+def normalize_name(name: str) -> str:
+    """Uppercase, drop punctuation and collapse whitespace."""
+    name = re.sub(r'[^A-Z0-9 ]+', ' ', (name or '').upper())
+    return ' '.join(name.split())
+
+
+def is_labelled_trn(text: str, trn: str | None) -> bool:
+    """Whether ``trn`` appears in ``text`` right after a TRN label."""
+    if not trn or trn == "Not Found":
+        return False
+    return re.search(TRN_LABEL + re.escape(trn), text or '', re.IGNORECASE) is not None
+
+
+def trigrams(name: str) -> set[str]:
+    """Character trigrams of a normalized name, padded so short names still match."""
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class VendorIndex:
+    """In-memory TRN and trigram index over the vendor master list."""
+
+    def __init__(self, path: str = config.VENDOR_MASTER_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        self.mtime = None
+        self.reset()
+        self.refresh()
+
+    def reset(self):
+        self.names = []            # vendor id -> canonical name
+        self.by_trn = {}           # TRN -> vendor id
+        self.by_name = {}          # normalized name/alias -> vendor id
+        self.grams = {}            # vendor key id -> trigram set
+        self.key_vendor = []       # key id -> vendor id
+        self.postings = {}         # trigram -> list of key ids
+        self.matches = {}          # name -> match_name result
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            for record in csv.DictReader(f):
+                aliases = [a for a in (record.get('aliases') or '').split('|') if a.strip()]
+                self.add(record.get('trn', '').strip(), record['name'].strip(), aliases)
+
+    def refresh(self):
+        """Rebuild the index if the file changed on disk since we last read or wrote it."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            self.reset()
+            try:
+                self.load()
+            except Exception as e:
+                print(f"Error loading vendor master file: {e}")
+            self.mtime = mtime
+
+    def add(self, trn: str, name: str, aliases: list[str] | None = None) -> int:
+        """Add a vendor (or an alias/TRN of an existing one); returns its vendor id."""
+        with self.lock:
+            vendor_id = self.by_trn.get(trn) if trn else None
+            if vendor_id is None:
+                vendor_id = self.by_name.get(normalize_name(name))
+            if vendor_id is None:
+                vendor_id = len(self.names)
+                self.names.append(name)
+            if trn:
+                self.by_trn[trn] = vendor_id
+            for key in [name] + (aliases or []):
+                norm = normalize_name(key)
+                if not norm or norm in self.by_name:
+                    continue
+                self.by_name[norm] = vendor_id
+                key_id = len(self.key_vendor)
+                self.key_vendor.append(vendor_id)
+                grams = trigrams(norm)
+                self.grams[key_id] = grams
+                for gram in grams:
+                    self.postings.setdefault(gram, []).append(key_id)
+            self.matches.clear()
+            return vendor_id
+
+    def match_name(self, name: str) -> str | None:
+        """Canonical name for the closest known spelling, or None below the threshold."""
+        if name in self.matches:
+            return self.matches[name]
+        if len(self.matches) >= MATCH_CACHE_SIZE:
+            self.matches.clear()
+        match = self.matches[name] = self.find_match(name)
+        return match
+
+    def find_match(self, name: str) -> str | None:
+        norm = normalize_name(name)
+        if not norm:
+            return None
+        exact = self.by_name.get(norm)
+        if exact is not None:
+            return self.names[exact]
+        query = trigrams(norm)
+        shared = Counter()
+        for gram in query:
+            for key_id in self.postings.get(gram, ()):
+                shared[key_id] += 1
+        best_id, best_score = None, 0.0
+        for key_id, common in shared.items():
+            # Dice coefficient over trigram sets
+            score = 2.0 * common / (len(query) + len(self.grams[key_id]))
+            if score > best_score:
+                best_id, best_score = key_id, score
+        if best_id is None or best_score < config.VENDOR_MATCH_THRESHOLD:
+            return None
+        return self.names[self.key_vendor[best_id]]
+
+    def canonical_name(self, name: str, trn: str | None = None) -> str:
+        """Canonical vendor name for an OCR'd company name and seller TRN.
+
+        Falls back to the OCR'd name when the vendor is unknown; with
+        config.VENDOR_AUTO_REGISTER the first name seen for a new TRN becomes
+        its canonical name. Pass only a labelled TRN (is_labelled_trn).
+        """
+        if trn and trn != "Not Found":
+            vendor_id = self.by_trn.get(trn)
+            if vendor_id is not None:
+                return self.names[vendor_id]
+        if name and name != "Not Found":
+            match = self.match_name(name)
+            if match:
+                if trn and trn != "Not Found" and config.VENDOR_AUTO_REGISTER:
+                    self.register(trn, match)
+                return match
+            if trn and trn != "Not Found" and config.VENDOR_AUTO_REGISTER:
+                self.register(trn, name.strip())
+        return name
+
+    def register(self, trn: str, name: str):
+        """Add a TRN -> name mapping and append it to the master file, unless another process already has."""
+        try:
+            with locked(self.path), self.lock:
+                self.refresh()
+                if trn in self.by_trn:
+                    return
+                self.add(trn, name)
+                new_file = not os.path.exists(self.path)
+                with open(self.path, 'a', encoding='utf-8', newline='') as f:
+                    writer = csv.writer(f)
+                    if new_file:
+                        writer.writerow(['trn', 'name', 'aliases'])
+                    writer.writerow([trn, name, ''])
+                self.mtime = os.path.getmtime(self.path)
+        except Exception as e:
+            print(f"Error saving vendor master entry: {e}")
+
+
+_index = None
+
+
+def get_vendor_index() -> VendorIndex:
+    """Process-wide vendor index, loaded on first use and reloaded when the file changes."""
+    global _index
+    if _index is None:
+        _index = VendorIndex()
+    else:
+        _index.refresh()
+    return _index
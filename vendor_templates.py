@@ -0,0 +1,123 @@
+"""
+Per-vendor layout templates keyed by seller TRN.
+
+A template remembers where on the page (normalized bbox) each field was found
+the last time an invoice from that seller was extracted. The extraction
+pipeline reads those regions directly on the next invoice with the same TRN
+and only falls back to the full heuristics when a region is missing or its
+value fails validation. Templates are kept in a JSON file shared by all
+workers; a process reloads it when another process has written a newer copy.
+Writers hold a file lock, merge their change into the copy on disk and
+replace the file through a private temp file, so concurrent workers do not
+lose each other's updates.
+"""
+
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+import config
+from file_lock import locked
+
+# Fields a template can locate
+TEMPLATE_FIELDS = ['Invoice Number', 'Date', 'VAT Amount', 'Total Amount']
+
+
+class VendorTemplateStore:
+    """TRN -> {field: [x0, y0, x1, y1]} regions, persisted to a JSON file."""
+
+    def __init__(self, path: str = config.VENDOR_TEMPLATES_FILE):
+        self.path = path
+        self.templates = {}
+        self.mtime = None
+        self.lock = threading.Lock()
+        self.refresh()
+
+    def read(self) -> tuple[dict, float] | None:
+        """(templates, mtime) from disk, or None if the file is missing or unreadable."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f), mtime
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error loading vendor templates: {e}")
+            return None
+
+    def refresh(self):
+        """Reload the file if it changed on disk since we last read or wrote it."""
+        try:
+            if os.path.getmtime(self.path) == self.mtime:
+                return
+        except OSError:
+            return
+        loaded = self.read()
+        if loaded is None:
+            return
+        with self.lock:
+            self.templates, self.mtime = loaded
+
+    def get(self, trn: str) -> dict | None:
+        """Field regions recorded for a seller TRN, or None on a template miss."""
+        if not trn or trn == "Not Found":
+            return None
+        template = self.templates.get(trn)
+        return template['fields'] if template else None
+
+    def learn(self, trn: str, fields: dict):
+        """Record where fields were found for a TRN; writes the file only on change."""
+        if not trn or trn == "Not Found" or not fields:
+            return
+        # Pick up templates other workers learned since our last read
+        self.refresh()
+        with self.lock:
+            current = self.templates.get(trn, {}).get('fields', {})
+            if {**current, **fields} == current:
+                return
+            try:
+                with locked(self.path):
+                    # Merge into the latest copy on disk, which may be newer than our last read
+                    loaded = self.read()
+                    if loaded is not None:
+                        self.templates, self.mtime = loaded
+                    current = self.templates.get(trn, {}).get('fields', {})
+                    merged = {**current, **fields}
+                    if merged == current:
+                        return
+                    self.templates[trn] = {
+                        'fields': merged,
+                        'updated': datetime.now().isoformat(),
+                    }
+                    self.save()
+            except OSError as e:
+                print(f"Error saving vendor templates: {e}")
+
+    def save(self):
+        """Write the templates through a private temp file (callers hold the file lock)."""
+        fd, tmp_path = tempfile.mkstemp(prefix='.vendor_templates-', suffix='.tmp',
+                                        dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.templates, f, indent=2)
+            os.replace(tmp_path, self.path)
+            self.mtime = os.path.getmtime(self.path)
+        except Exception as e:
+            print(f"Error saving vendor templates: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+_store = None
+
+
+def get_template_store() -> VendorTemplateStore:
+    """Process-wide template store, refreshed from disk on each call."""
+    global _store
+    if _store is None:
+        _store = VendorTemplateStore()
+    else:
+        _store.refresh()
+    return _store